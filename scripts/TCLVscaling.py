@@ -45,7 +45,6 @@ examined in a separate notebook.
 import os
 import sys
 import logging
-import re
 from os.path import join as pjoin
 from datetime import datetime
 from builtins import str
@@ -55,17 +54,15 @@ from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
 
-from shapely.geometry import box as sbox
-from shapely.geometry import LineString
-
 import scipy.stats as stats
 from git import Repo, InvalidGitRepositoryError
 import seaborn as sns
 
 from qdm import qdm
-
-# From TCRM codebase
-from Utilities.loadData import maxWindSpeed
+from distfit import fit, fit_table, stack_models
+from tclv import (filter_tracks, filter_tracks_domain, track_summary,
+                  load_ensemble, calculate_max_wind)
+from ibtracs import load_ibtracs
 
 try:
     r = Repo('', search_parent_directories=True)
@@ -90,6 +87,9 @@ LOGGER.addHandler(console)
 LOGGER.info(f"Started {sys.argv[0]} (pid {os.getpid()})")
 LOGGER.info(f"Code version: f{commit}")
 
+# Number of processes used to load the TCLV files (set by PBS on NCI)
+NCPUS = int(os.environ.get('NCPUS', 1))
+
 LABELS = ['TD', 'TC1', 'TC2', 'TC3', 'TC4', 'TC5']
 
 PALETTE = sns.blend_palette([(0.000, 0.627, 0.235), (0.412, 0.627, 0.235), 
@@ -116,92 +116,6 @@ PALETTE = sns.blend_palette([(0.000, 0.627, 0.235), (0.412, 0.627, 0.235),
 # simulated events.
 
 
-def load_track_file(filename):
-    """
-    Load a TCLV file into a :class:`pandas.DataFrame`, and add a field 
-    representing the age of each TCLV in hours, and the pressure difference.
-
-    :param str filename: Path to a TCLV data file
-
-    :returns: :class:`pandas.DataFrame`
-    """
-    # This assumes the format of the TCLV files is identical
-    columns = ['num', 'year', 'month', 'day', 'hour', 'lon', 'lat',
-               'pmin', 'vorticity', 'vmax', 'tanomsum', 'tanomdiff',
-               'pmslanom', 'poci', 'reff', 'ravg', 'asym']
-
-    LOGGER.info(f"Loading TCLV data from {filename}")
-    try:
-        df = pd.read_csv(filename, delimiter=' ', skipinitialspace=True,
-                         names=columns, parse_dates={'datetime': [1, 2, 3, 4]},
-                         keep_date_col=True,
-                         dtype={'year': int, 'month': int, 'day': int})
-    except:
-        LOGGER.exception(f"Failed to load {filename}")
-        raise
-    df['dt'] = df.groupby('num')['datetime'].apply(lambda x: x.diff())
-    df['dt'] = df['dt'].transform(lambda x: x.total_seconds())
-
-    df['age'] = df.groupby('num')['dt'].apply(np.cumsum).fillna(0)/3600.
-    # Throw in the pressure deficit for good measure:
-    df['pdiff'] = df['poci'] - df['pmin']
-
-    # And normalised intensity. This is the intensity at any given time,
-    # dividied by the lifetime maximum intensity for each unique event
-    df['ni'] = df.pdiff / df.groupby('num').pdiff.transform(np.max)
-    return df
-
-
-def filter_tracks(df, start_year=1980, end_year=2010, zeta=0, age=36):
-    """
-    Takes a `DataFrame` and filters on the basis of a prescribed vorticity 
-    threshold, lifetime and a given time period.
-
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param int start_year: Starting year of the time period to filter
-    :param int end_year: End year of the period to filter
-    :param float zeta: Vorticity threshold to filter the TCLV data. 
-                       This can be a positive value, as we filter on the
-                       absolute value of the field.
-    :param int age: Minimum age of the TCLVs in hours
-
-    """
-    tracks = df.groupby('num')
-    filterdf = tracks.filter(lambda x: (x['datetime'].dt.year.min() >= start_year) &
-                                       (x['datetime'].dt.year.max() <= end_year) &
-                                       (x['age'].max() >= age) &
-                                       (np.abs(x['vorticity'].min()) > zeta))
-    return filterdf
-
-
-def filter_tracks_domain(df, minlon=90, maxlon=180, minlat=-40, maxlat=0):
-    """
-    Takes a `DataFrame` and filters on the basis of whether the track interscts
-    the given domain, which is specified by the minimum and maximum longitude and 
-    latitude.
-
-    NOTE: This assumes the tracks and bounding box are in the same geographic 
-    coordinate system (i.e. generally a latitude-longitude coordinate system). 
-    It will NOT support different projections (e.g. UTM data for the bounds and
-    geographic for the tracks).
-
-    NOTE: This doesn't work if there is only one point for the track. 
-
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param float minlon: minimum longitude of the bounding box
-    :param float minlat: minimum latitude of the bounding box
-    :param float maxlon: maximum longitude of the bounding box
-    :param float maxlat: maximum latitude of the bounding box
-    """
-
-    domain = sbox(minlon, minlat, maxlon, maxlat, ccw=False)
-    tracks = df.groupby('num')
-    tempfilter = tracks.filter(lambda x: len(x) > 1)
-    filterdf = tempfilter.groupby('num').filter(
-        lambda x: LineString(zip(x['lon'], x['lat'])).intersects(domain))
-    return filterdf
-
-
 def calculateMaxWind(df, dtname='ISO_TIME'):
     """
     Calculate a maximum gust wind speed based on the central pressure deficit and the 
@@ -211,20 +125,16 @@ def calculateMaxWind(df, dtname='ISO_TIME'):
 
     This returns a `DataFrame` with an additional column (`vmax`), which represents an estimated
     1-minute sustained wind speed (lines up with potential intensity).
-    """
-
-    idx = df.num.values
-    varidx = np.ones(len(idx))
-    varidx[1:][idx[1:] == idx[:-1]] = 0
 
-    dt = (df[dtname] - df[dtname].shift()).fillna(pd.Timedelta(seconds=0)
-                                                  ).apply(lambda x: x / np.timedelta64(1, 'h')).astype('int64') % (24*60)
-    df['vmax'] = maxWindSpeed(varidx, dt.values, df.lon.values, df.lat.values,
-                              df.pmin.values, df.poci.values, gustfactor=1.0)
-    return df
+    `df` can also be a `dict` of `DataFrame`s (e.g. all ensemble members), in
+    which case the members are processed together in a single call and the
+    `dict` is returned.
+    """
+    return calculate_max_wind(df, dtname, gustfactor=1.0)
 
 
-def loadTCLVdata(dataPath, start_year=None, end_year=None, domain=None):
+def loadTCLVdata(dataPath, start_year=None, end_year=None, domain=None,
+                 processes=None):
     """ 
     Load TCLV data from a directory, for a given year range 
     and a geographic domain
@@ -235,46 +145,12 @@ def loadTCLVdata(dataPath, start_year=None, end_year=None, domain=None):
     :param int end_year: end of the time period (year)
     :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat)) that
     describes the bounding domain.
+    :param int processes: Number of worker processes used to load the files.
+    Default is to load the files sequentially.
 
     """
-
-    if not os.path.isdir(dataPath):
-        LOGGER.error(f"{dataPath} is not a valid directory")
-        raise OSError(f"{dataPath} is not a valid directory")
-
-    if start_year is not None or end_year is not None:
-        if start_year is None or end_year is None:
-            raise ValueError(
-                "must supply both start year and end year or none")
-        if start_year > end_year:
-            raise ValueError(
-                f"Start year {start_year} is greater than end year {end_year}")
-
-    datadict = {}
-    regex = r'all_tracks_(.+)_(rcp\d+)\.dat'
-    for fname in os.listdir(dataPath):
-        # Skip the ERA-Interim sourced TCLV set
-        if fname == "all_tracks_ERAIntQ_rcp85.dat":
-            continue
-
-        if re.search(regex, fname):
-            m = re.match(regex, fname)
-            model, rcp = m.group(1, 2)
-            filename = pjoin(dataPath, fname)
-            df = load_track_file(filename)
-
-            if start_year is not None:
-                df = filter_tracks(df, start_year, end_year)
-            if domain is not None:
-                df = filter_tracks_domain(df, *domain)
-            label = f"{model} {rcp.upper()}"
-            datadict[label] = df
-        else:
-            LOGGER.debug(
-                f"{fname} does not match the expected pattern. Skipping...")
-            continue
-
-    return datadict
+    return load_ensemble(dataPath, start_year, end_year, domain,
+                         processes=processes)
 
 
 def append_ensembles(datadict):
@@ -320,15 +196,8 @@ def calculateFitParams(datadict, dist=stats.lognorm):
 
     """
 
-    params = pd.DataFrame(columns=['Model', 'RCP', 'mu', 'sigma', 'zeta'])
-    for m, df in datadict.items():
-        model, rcp = m.split(' ')
-        popt = dist.fit(df.pdiff, loc=0, scale=1)
-        params = params.append({'Model': model, 'RCP': rcp,
-                                'mu': popt[0], 'sigma': popt[1],
-                                'zeta': popt[2]},
-                               ignore_index=True)
-    return params
+    return fit_table(stack_models(datadict), by=['Model', 'RCP'],
+                     dist=dist, loc=0, scale=1)
 
 
 def load_obs_data(obsfile, domain):
@@ -346,13 +215,7 @@ def load_obs_data(obsfile, domain):
         sys.exit()
 
     LOGGER.info(f"Loading observed TC tracks from {obsfile}")
-    best = pd.read_csv(obsfile, skiprows=[1],
-                       usecols=[0, 6, 8, 9, 11, 95, 113],
-                       na_values=[' '],
-                       parse_dates=[1])
-    best.rename(columns={'SID': 'num', 'LAT': 'lat', 'LON': 'lon',
-                         'WMO_PRES': 'pmin', 'BOM_WIND': 'vmax',
-                         'BOM_POCI': 'poci'}, inplace=True)
+    best = load_ibtracs(obsfile, domain)
     best = best[best.poci.notnull() & best.pmin.notnull()]
     best['pdiff'] = best.poci - best.pmin
     best = best[best.pdiff > 1]
@@ -404,7 +267,7 @@ if __name__ == '__main__':
     obstc['category'] = pd.cut(obstc['vmax'], 
                                [0, 25, 35, 46, 62, 77, 200], 
                                labels=LABELS)
-    obsparams = stats.lognorm.fit(obstc.pdiff, loc=0, scale=1)
+    obsparams = fit(stats.lognorm, obstc.pdiff, loc=0, scale=1)
     obsdata = obstc.pdiff.values[obstc.pdiff.values > 0]
     obslmi = obstc.loc[obstc.groupby(["num"])["pdiff"].idxmax()]
 
@@ -413,7 +276,7 @@ if __name__ == '__main__':
     # below shows the histogram of $\Delta p_c$, with a fitted lognormal
     # distribution to each.
 
-    tclvdata = loadTCLVdata(path, domain=domain)
+    tclvdata = loadTCLVdata(path, domain=domain, processes=NCPUS)
 
     OUTPUTPATH = r"X:\georisk\HaRIA_B_Wind\projects\qfes_swha\data\derived\TCLV\tracks\corrected\20211124"
     if not os.path.isdir(OUTPUTPATH):
@@ -425,12 +288,19 @@ if __name__ == '__main__':
     STARTS = [2021, 2041, 2061, 2081]
     ENDS = [2040, 2060, 2080, 2100]
 
+    # Summarise the tracks once, then reuse for filtering each time period
+    summaries = {m: track_summary(df) for m, df in tclvdata.items()}
+
+    # Bias-corrected data, keyed by output file name. The maximum wind speed
+    # is calculated for all of these in one batch once the corrections are
+    # complete:
+    bcdata = {}
     for s, e in zip(STARTS, ENDS):
         LOGGER.info(f"Processing time period {s} - {e}")
         for i, (m, df) in enumerate(tclvdata.items()):
             LOGGER.info(f"Processing {m}")
-            refdf = filter_tracks(df, 1981, 2010)
-            futdf = filter_tracks(df, s, e)
+            refdf = filter_tracks(df, 1981, 2010, summary=summaries[m])
+            futdf = filter_tracks(df, s, e, summary=summaries[m])
 
             # Determine LMI for each event in the reference and projected data
             try:
@@ -464,12 +334,9 @@ if __name__ == '__main__':
             futdf['pmin'] = futdf['poci'] - futdf['pdiff']
             LOGGER.debug(
                 f"Median bias-corrected future pressure deficit: {futdf['pdiff'].median():.2f}")
-            # Calculate maximum wind speed (this will replace existing values)
-            futdf = calculateMaxWind(futdf, 'datetime')
-            # Save to file
             fname = pjoin(OUTPUTPATH, FUTFILETEMPLATE.format(
                 m.replace(' ', '_'), s, e))
-            futdf.to_csv(fname, sep=',',  float_format="%.3f", index=False)
+            bcdata[fname] = futdf
 
             # Finished processing all the
             refdf.set_index('num')
@@ -478,6 +345,10 @@ if __name__ == '__main__':
             refdf['pmin'] = refdf['poci'] - refdf['pdiff']
             LOGGER.debug(
                 f"Median bias-corrected reference pressure deficit: {refdf['pdiff'].median():.2f}")
-            refdf = calculateMaxWind(refdf, 'datetime')
             fname = pjoin(OUTPUTPATH, FILETEMPLATE.format(m.replace(' ', '_')))
-            refdf.to_csv(fname, sep=',',  float_format="%.3f", index=False)
+            bcdata[fname] = refdf
+
+    # Calculate maximum wind speed (this will replace existing values)
+    bcdata = calculateMaxWind(bcdata, 'datetime')
+    for fname, df in bcdata.items():
+        df.to_csv(fname, sep=',',  float_format="%.3f", index=False)
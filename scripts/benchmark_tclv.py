@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `benchmark_tclv` -- Benchmarks for the TCLV processing pipeline
+=====================================================================
+
+.. module:: benchmark_tclv
+    :synopsis: Time and profile the memory use of each stage of the TCLV
+    load/filter/bias correction pipeline, using synthetic track catalogues.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+Synthetic catalogues are written in the same 17-column layout as the TCLV
+track files, so the complete pipeline (including parsing the text files) is
+exercised. Each stage is run for each catalogue size: the execution time is
+the best of a number of repeats, and the peak memory allocated during the
+stage is measured (in a separate run) with :mod:`tracemalloc`.
+
+Results can be saved as a baseline, and later runs compared to that baseline.
+A stage is flagged as a regression if it is slower, or uses more memory, than
+the baseline by more than the given tolerance. Baselines are specific to the
+machine they were recorded on, so they are not kept in the repository.
+
+Stages that need a dependency that is not installed (e.g. TCRM for the
+maximum wind speed, or a Parquet engine for the cached load) are skipped.
+
+Example::
+
+    python benchmark_tclv.py --sizes 1000 100000 --save baseline.json
+    python benchmark_tclv.py --sizes 1000 100000 --compare baseline.json
+
+"""
+
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from os.path import join as pjoin
+
+import numpy as np
+import pandas as pd
+
+import tclv
+
+LOGGER = logging.getLogger()
+
+SIZES = [1000, 10000, 100000, 1000000]
+DOMAIN = (135, 160, -25, -10)
+
+
+def make_catalogue(npoints, seed=None):
+    """
+    Generate a synthetic TCLV track catalogue with (exactly) `npoints` track
+    points, in the 17-column layout of the TCLV track files. Tracks are 6-hourly
+    with 8-60 points, starting in a random year between 1981 and 2100.
+
+    :param int npoints: Number of track points
+    :param int seed: Seed for the random number generator
+
+    :returns: :class:`pandas.DataFrame` with columns :data:`tclv.TCLV_COLUMNS`
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(8, 61, size=npoints // 8 + 1)
+    lengths = lengths[:np.searchsorted(np.cumsum(lengths), npoints) + 1]
+    lengths[-1] -= lengths.sum() - npoints
+    ntracks = len(lengths)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    num = np.repeat(np.arange(1, ntracks + 1), lengths)
+    step = np.arange(npoints) - np.repeat(starts, lengths)
+
+    # Time of each point:
+    t0 = (pd.to_datetime(rng.integers(1981, 2101, ntracks).astype(str)) +
+          pd.to_timedelta(rng.integers(0, 120, ntracks) * 24, unit='h'))
+    times = pd.DatetimeIndex(np.repeat(t0.to_numpy(), lengths) +
+                             step * np.timedelta64(6, 'h'))
+
+    # Random walk of the track position from a random genesis point:
+    def walk(start, scale, drift):
+        incr = rng.normal(drift, scale, npoints)
+        incr[starts] = 0
+        pos = np.cumsum(incr)
+        return np.repeat(start - pos[starts], lengths) + pos
+
+    lon = walk(rng.uniform(130, 170, ntracks), 0.5, -0.1)
+    lat = walk(rng.uniform(-30, -5, ntracks), 0.5, -0.2)
+
+    # Intensity increases to a peak at a random point in the lifetime, then
+    # decays:
+    frac = step / np.repeat(lengths, lengths)
+    peak = np.repeat(rng.uniform(0.3, 0.7, ntracks), lengths)
+    lmi = np.repeat(rng.lognormal(2.5, 0.6, ntracks), lengths)
+    shape = np.where(frac < peak, frac / peak, (1 - frac) / (1 - peak))
+    poci = 1008 + rng.normal(0, 1, npoints)
+    pmin = poci - lmi * shape - rng.uniform(0, 1, npoints)
+
+    return pd.DataFrame({
+        'num': num, 'year': times.year, 'month': times.month,
+        'day': times.day, 'hour': times.hour,
+        'lon': lon.round(2), 'lat': lat.round(2), 'pmin': pmin.round(2),
+        'vorticity': -rng.uniform(1e-5, 1e-3, npoints),
+        'vmax': rng.uniform(10, 60, npoints).round(2),
+        'tanomsum': rng.uniform(0, 10, npoints).round(2),
+        'tanomdiff': rng.uniform(0, 5, npoints).round(2),
+        'pmslanom': rng.uniform(0, 20, npoints).round(2),
+        'poci': poci.round(2),
+        'reff': rng.uniform(100, 500, npoints).round(2),
+        'ravg': rng.uniform(100, 500, npoints).round(2),
+        'asym': rng.uniform(0, 1, npoints).round(3)})[tclv.TCLV_COLUMNS]
+
+
+def write_catalogue(df, filename):
+    """
+    Write a synthetic catalogue as a whitespace-delimited TCLV track file.
+
+    :param df: :class:`pandas.DataFrame` from :func:`make_catalogue`
+    :param str filename: Output file path
+    """
+    df.to_csv(filename, sep=' ', header=False, index=False)
+
+
+class SkipStage(Exception):
+    """Raised when a stage cannot be run in this environment"""
+
+
+def _stage_qdm(df):
+    try:
+        from qdm import qdm
+    except ImportError as err:
+        raise SkipStage(str(err))
+    ref = df['pdiff'].to_numpy()
+    ref = ref[ref > 0]
+    obs = ref[::2] * 1.2
+    fut = ref * 1.1
+    return lambda: qdm(obs, ref, fut)
+
+
+def _stage_qdm_empirical(df):
+    from qdm import qdm_empirical
+    ref = df['pdiff'].to_numpy()
+    ref = ref[ref > 0]
+    obs = ref[::2] * 1.2
+    fut = ref * 1.1
+    return lambda: qdm_empirical(obs, ref, fut)
+
+
+def _stage_max_wind(df):
+    try:
+        import Utilities.loadData  # noqa: F401
+    except ImportError as err:
+        raise SkipStage(str(err))
+    return lambda: tclv.calculate_max_wind(df.copy())
+
+
+def _stage_load_cached(filename, cachedir):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as err:
+        raise SkipStage(str(err))
+    tclv.load_track_file(filename, cachedir=cachedir)
+    return lambda: tclv.load_track_file(filename, cachedir=cachedir)
+
+
+def stages(filename, cachedir):
+    """
+    The stages of the pipeline to benchmark. Each stage is a function that
+    prepares the inputs and returns a callable to time.
+
+    :param str filename: Path to the synthetic TCLV track file
+    :param str cachedir: Cache directory for the cached load
+
+    :returns: list of (name, setup function) tuples
+    """
+    df = tclv.load_track_file(filename, cache=False)
+    return [
+        ('read_track_file', lambda: (lambda: tclv.read_track_file(filename))),
+        ('load_track_file',
+         lambda: (lambda: tclv.load_track_file(filename, cache=False))),
+        ('load_track_file_cached',
+         lambda: _stage_load_cached(filename, cachedir)),
+        ('filter_tracks',
+         lambda: (lambda: tclv.filter_tracks(df, 1981, 2010))),
+        ('filter_tracks_domain',
+         lambda: (lambda: tclv.filter_tracks_domain(df, *DOMAIN))),
+        ('max_wind_inputs',
+         lambda: (lambda: tclv.max_wind_inputs(df))),
+        ('calculate_max_wind', lambda: _stage_max_wind(df)),
+        ('qdm', lambda: _stage_qdm(df)),
+        ('qdm_empirical', lambda: _stage_qdm_empirical(df)),
+    ]
+
+
+def measure(func, repeat=3):
+    """
+    Time a function and measure the peak memory allocated while it runs.
+
+    :param func: Callable with no arguments
+    :param int repeat: Number of timed runs
+
+    :returns: :class:`dict` with the best and median time (seconds) and the
+        peak memory allocated (MB)
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'time': min(times), 'median': float(np.median(times)),
+            'peak_mb': peak / 2**20}
+
+
+def run(sizes=SIZES, repeat=3, only=None, seed=1234):
+    """
+    Run the benchmarks for each catalogue size.
+
+    :param list sizes: Catalogue sizes (number of track points)
+    :param int repeat: Number of timed runs of each stage
+    :param list only: Only run the stages with these names
+    :param int seed: Seed for the synthetic catalogues
+
+    :returns: :class:`dict` of results, keyed by "<stage>/<size>"
+    """
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for npoints in sizes:
+            filename = pjoin(tmpdir, f"all_tracks_SYNTHETIC{npoints}_rcp45.dat")
+            write_catalogue(make_catalogue(npoints, seed), filename)
+            for name, setup in stages(filename, pjoin(tmpdir, 'cache')):
+                if only and name not in only:
+                    continue
+                key = f"{name}/{npoints}"
+                try:
+                    func = setup()
+                except SkipStage as err:
+                    LOGGER.info(f"Skipping {key}: {err}")
+                    continue
+                results[key] = measure(func, repeat)
+                LOGGER.info(f"{key:<32} {results[key]['time']:10.4f} s "
+                            f"{results[key]['peak_mb']:10.1f} MB")
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, memtolerance=0.25,
+            mintime=0.01):
+    """
+    Compare benchmark results to a baseline.
+
+    :param dict results: Results from :func:`run`
+    :param dict baseline: Baseline results
+    :param float tolerance: Fractional increase in time that is flagged
+    :param float memtolerance: Fractional increase in peak memory that is
+        flagged
+    :param float mintime: Increases in time smaller than this (seconds) are
+        not flagged, as timings of very short stages are dominated by noise
+
+    :returns: list of (key, metric, baseline value, new value) tuples for
+        each regression
+    """
+    regressions = []
+    for key, new in results.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        if (new['time'] > old['time'] * (1 + tolerance) and
+                new['time'] - old['time'] > mintime):
+            regressions.append((key, 'time', old['time'], new['time']))
+        if new['peak_mb'] > old['peak_mb'] * (1 + memtolerance):
+            regressions.append((key, 'peak_mb', old['peak_mb'],
+                                new['peak_mb']))
+    return regressions
+
+
+def environment():
+    """Versions of the main components, stored with a baseline"""
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.node(),
+            'date': time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES,
+                        help="Catalogue sizes (number of track points)")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Number of timed runs of each stage")
+    parser.add_argument('--stages', nargs='+',
+                        help="Only run these stages")
+    parser.add_argument('--save', help="Save the results as a baseline")
+    parser.add_argument('--compare', help="Compare to a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Fractional slow-down flagged as a regression")
+    parser.add_argument('--memtolerance', type=float, default=0.25,
+                        help="Fractional increase in memory flagged as a "
+                             "regression")
+    parser.add_argument('--mintime', type=float, default=0.01,
+                        help="Smallest increase in time (seconds) flagged "
+                             "as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level='INFO', format="%(message)s")
+    # Only report the benchmark results:
+    logging.getLogger('tclv').setLevel(logging.WARNING)
+
+    results = run(args.sizes, args.repeat, args.stages)
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({'environment': environment(), 'results': results},
+                      fh, indent=2)
+        LOGGER.info(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline['results'], args.tolerance,
+                              args.memtolerance, args.mintime)
+        for key, metric, old, new in regressions:
+            LOGGER.warning(f"REGRESSION {key} {metric}: "
+                           f"{old:.4f} -> {new:.4f} ({new / old:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        LOGGER.info(f"No regressions compared to {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
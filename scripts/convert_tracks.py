@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `convert_tracks` -- Convert a catalogue of TCRM track files
+=================================================================
+
+.. module:: convert_tracks
+    :synopsis: Convert all the TCRM track files of the group/RCP/period
+    scenarios to csv (or vector) files, and pack each scenario into a
+    gzipped tar file.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+The track files of every scenario (`<basepath>/<group>_<rcp>_<period>/tracks`)
+are found first, then converted by a pool of worker processes, one file per
+task. The number of processes is set by the `NCPUS` environment variable
+(set automatically by PBS) or the `--ncpus` option, so the conversion runs
+the same way on a desktop as in a batch job.
+
+Each scenario has a manifest (`manifest.json`) in its output folder, which
+records the checksum of each source file that has been converted. Files
+whose checksum matches the manifest (and whose output exists) are not
+converted again. Converted files are added to the archive of the scenario as
+they are completed, with the archive written as a gzip stream. The checksums
+of the files in the archive are recorded in `archive.json` once the archive
+is complete, and the archive is rebuilt whenever these differ from the
+manifest (e.g. after a run with `--no-archive`, or one that was interrupted).
+
+Example::
+
+    $ NCPUS=16 python convert_tracks.py -i /scratch/w85/swhaq/hazard/output/QLD \\
+        -o /scratch/w85/cxa547/swhaq/tracks2csv -g GROUP2
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tarfile
+import argparse
+from os.path import join as pjoin
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from trackcollection import TrackCollection
+from trackexport import export_tracks
+
+LOGGER = logging.getLogger(__name__)
+
+GROUPS = ["GROUP1", "GROUP2"]
+RCPS = ["RCP45", "RCP85"]
+PERIODS = ["1981-2020", "2021-2040", "2041-2060", "2061-2080", "2081-2100"]
+
+BASEPATH = "/scratch/w85/swhaq/hazard/output/QLD"
+OUTPUTPATH = "/scratch/w85/cxa547/swhaq/tracks2csv"
+
+NCPUS = int(os.environ.get('NCPUS', 1))
+
+MANIFEST = "manifest.json"
+ARCHIVE_STATE = "archive.json"
+
+# Format of the times in csv output (as for TCRM track files):
+ISO_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+FORMATS = ('csv', 'parquet', 'fgb')
+
+BLOCKSIZE = 1 << 20
+
+
+def checksum(filename):
+    """
+    Calculate the SHA-256 checksum of a file, reading it in blocks.
+
+    :param str filename: Path to the file
+
+    :returns: Hexadecimal digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(BLOCKSIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover(basepath=BASEPATH, groups=GROUPS, rcps=RCPS, periods=PERIODS):
+    """
+    Find the track files of each scenario.
+
+    :param str basepath: Folder containing the scenario folders
+    :param list groups: Names of the model groups
+    :param list rcps: Names of the emission scenarios
+    :param list periods: Time periods
+
+    :returns: :class:`dict` of sorted lists of track files, keyed by the
+        name of the scenario (e.g. "GROUP1_RCP45_2021-2040")
+    """
+    scenarios = {}
+    for group in groups:
+        for rcp in rcps:
+            for period in periods:
+                name = f"{group}_{rcp}_{period}"
+                trackpath = pjoin(basepath, name, 'tracks')
+                if not os.path.isdir(trackpath):
+                    LOGGER.warning(f"Appears that {trackpath} is missing, "
+                                   "skipping...")
+                    continue
+                scenarios[name] = sorted(
+                    pjoin(trackpath, f) for f in os.listdir(trackpath)
+                    if f.endswith('.nc'))
+    return scenarios
+
+
+def output_name(trackfile, outputpath, fmt='csv'):
+    """Name of the converted file for a track file"""
+    stem = os.path.splitext(os.path.basename(trackfile))[0]
+    return pjoin(outputpath, f"{stem}.{fmt}")
+
+
+def convert_file(trackfile, outputfile, known=None):
+    """
+    Convert a single TCRM track file. The format is determined by the
+    extension of the output file: csv files have one row for each track
+    point, and other formats are written by :func:`trackexport.export_tracks`
+    (as track segments).
+
+    :param str trackfile: Path to the TCRM track file
+    :param str outputfile: Path to the output file
+    :param str known: Checksum of the track file when it was last converted.
+        If the checksum is unchanged and the output file exists, the file is
+        not converted again.
+
+    :returns: tuple of the output file, the checksum of the track file and
+        whether the file was converted
+    """
+    digest = checksum(trackfile)
+    if digest == known and os.path.exists(outputfile):
+        return outputfile, digest, False
+    tracks = TrackCollection.from_file(trackfile)
+    base, ext = os.path.splitext(outputfile)
+    tmpfile = f"{base}.{os.getpid()}.tmp{ext}"
+    if ext == '.csv':
+        df = pd.DataFrame(tracks.fields)
+        df.to_csv(tmpfile, index=False, date_format=ISO_FORMAT)
+    else:
+        export_tracks(tracks, tmpfile)
+    os.replace(tmpfile, outputfile)
+    return outputfile, digest, True
+
+
+def read_manifest(outputpath, filename=MANIFEST):
+    """
+    Read the manifest of a scenario (or, with `filename=ARCHIVE_STATE`, the
+    checksums of the files in its archive).
+
+    :returns: :class:`dict` of the checksum of each converted source file,
+        keyed by the name of the source file
+    """
+    try:
+        with open(pjoin(outputpath, filename)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(outputpath, manifest, filename=MANIFEST):
+    """Write the manifest of a scenario, replacing any existing manifest"""
+    tmpfile = pjoin(outputpath, f"{filename}.{os.getpid()}.tmp")
+    with open(tmpfile, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmpfile, pjoin(outputpath, filename))
+
+
+def convert_all(basepath=BASEPATH, outputpath=OUTPUTPATH, groups=GROUPS,
+                rcps=RCPS, periods=PERIODS, fmt='csv', processes=None,
+                archive=True):
+    """
+    Convert the track files of all scenarios, and pack the converted files
+    of each scenario into `<outputpath>/<scenario>.tar.gz`.
+
+    The archive of a scenario is only rewritten if any of its files are
+    converted, or the archive does not exist or was built from different
+    source files (as recorded in `ARCHIVE_STATE`). Once the first file of a
+    scenario has been converted, each file is added to the archive as soon
+    as it is completed.
+
+    :param str basepath: Folder containing the scenario folders
+    :param str outputpath: Folder for the converted files and archives
+    :param list groups: Names of the model groups
+    :param list rcps: Names of the emission scenarios
+    :param list periods: Time periods
+    :param str fmt: Output format (one of `FORMATS`)
+    :param int processes: Number of worker processes. Default is to convert
+        the files in this process.
+    :param bool archive: If True, write an archive for each scenario
+
+    :returns: :class:`dict` of the number of files converted in each
+        scenario
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}: must be one of {FORMATS}")
+    scenarios = discover(basepath, groups, rcps, periods)
+    manifests, jobs = {}, []
+    for name, trackfiles in scenarios.items():
+        scenariopath = pjoin(outputpath, name)
+        os.makedirs(scenariopath, exist_ok=True)
+        manifests[name] = read_manifest(scenariopath)
+        jobs.extend((name, f, output_name(f, scenariopath, fmt),
+                     manifests[name].get(os.path.basename(f)))
+                    for f in trackfiles)
+    LOGGER.info(f"Checking {len(jobs)} files in {len(scenarios)} scenarios")
+
+    counts = {name: 0 for name in scenarios}
+    completed = {name: [] for name in scenarios}
+    current = {name: {} for name in scenarios}
+    archives = {}
+    try:
+        for name, trackfile, result in _run(jobs, processes):
+            outputfile, digest, converted = result
+            manifests[name][os.path.basename(trackfile)] = digest
+            current[name][os.path.basename(trackfile)] = digest
+            completed[name].append(outputfile)
+            counts[name] += converted
+            if not archive:
+                continue
+            if name in archives:
+                _add(archives[name], outputfile)
+            elif converted:
+                archives[name] = _open_archive(outputpath, name)
+                for f in completed[name]:
+                    _add(archives[name], f)
+    except BaseException:
+        # Leave any existing archives in place:
+        for tar in archives.values():
+            tar.close()
+        raise
+    finally:
+        for name, manifest in manifests.items():
+            write_manifest(pjoin(outputpath, name), manifest)
+
+    for name in scenarios:
+        scenariopath = pjoin(outputpath, name)
+        tarname = pjoin(outputpath, f"{name}.tar.gz")
+        if not archive:
+            continue
+        if name not in archives and os.path.exists(tarname) and \
+                read_manifest(scenariopath, ARCHIVE_STATE) == current[name]:
+            continue
+        if name not in archives:
+            archives[name] = _open_archive(outputpath, name)
+            for f in completed[name]:
+                _add(archives[name], f)
+        archives[name].close()
+        os.replace(f"{tarname}.tmp", tarname)
+        write_manifest(scenariopath, current[name], ARCHIVE_STATE)
+        LOGGER.info(f"Created {tarname}")
+    return counts
+
+
+def _add(tar, filename):
+    """Add a file to an archive, without the folder name"""
+    tar.add(filename, arcname=os.path.basename(filename))
+
+
+def _open_archive(outputpath, name):
+    """
+    Open a gzipped tar stream for a scenario. The archive is written to a
+    temporary file, which replaces the archive once it is complete.
+    """
+    return tarfile.open(pjoin(outputpath, f"{name}.tar.gz.tmp"), mode='w|gz')
+
+
+def _run(jobs, processes=None):
+    """
+    Convert files, yielding the results as they are completed.
+
+    :param list jobs: tuples of (scenario, track file, output file, known
+        checksum)
+    :param int processes: Number of worker processes
+    """
+    if not processes or processes <= 1:
+        for name, trackfile, outputfile, known in jobs:
+            yield name, trackfile, convert_file(trackfile, outputfile, known)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(convert_file, trackfile, outputfile,
+                                   known): (name, trackfile)
+                   for name, trackfile, outputfile, known in jobs}
+        for future in as_completed(futures):
+            name, trackfile = futures[future]
+            yield name, trackfile, future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-i', '--input', default=BASEPATH,
+                        help="Folder containing the scenario folders")
+    parser.add_argument('-o', '--output', default=OUTPUTPATH,
+                        help="Folder for the converted files and archives")
+    parser.add_argument('-g', '--groups', default=','.join(GROUPS))
+    parser.add_argument('-r', '--rcps', default=','.join(RCPS))
+    parser.add_argument('-p', '--periods', default=','.join(PERIODS))
+    parser.add_argument('-f', '--format', default='csv', choices=FORMATS)
+    parser.add_argument('-n', '--ncpus', type=int, default=NCPUS,
+                        help="Number of worker processes")
+    parser.add_argument('--no-archive', dest='archive', action='store_false',
+                        help="Do not pack the converted files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s: %(levelname)s: %(message)s")
+    counts = convert_all(args.input, args.output,
+                         [g for g in args.groups.split(',') if g],
+                         [r for r in args.rcps.split(',') if r],
+                         [p for p in args.periods.split(',') if p],
+                         args.format, args.ncpus, args.archive)
+    LOGGER.info(f"Converted {sum(counts.values())} files")
+
+
+if __name__ == '__main__':
+    main()
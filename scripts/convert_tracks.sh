@@ -12,12 +12,10 @@
 # Bash script to convert track files from TCRM format to CSV format for a
 # full hazard simulation (hence the PBS job script)
 # 
-# The script iterates through a collection of output directories
-# corresponding to group, RCP and time period scenarios and calls the
-# tracks2csv.py script to convert all track files in a given input path
-# to csv format. 
-# 
-# CSV files for each group/RCP/time period are then packed into gzipped
+# The script converts the track files in a collection of output directories
+# corresponding to group, RCP and time period scenarios to csv format.
+#
+# CSV files for each group/RCP/time period are packed into gzipped
 # tar files to be sent to other users.
 module purge
 module load pbs
@@ -42,42 +40,13 @@ export HDF5_DISABLE_VERSION_CHECK=2
 
 export PYTHONPATH=$PYTHONPATH:$HOME/tcrm:$HOME/tcrm/Utilities
 
-GROUPLIST="GROUP2,"
-RCPLIST="RCP45,RCP85"
-PERIODS="1981-2020,2021-2040,2041-2060,2061-2080,2081-2100"
-IFS=","
+# The conversion is done by convert_tracks.py, which converts the track
+# files of all the scenarios in a pool of NCPUS processes (NCPUS is set by
+# PBS), skipping files that have not changed since they were last converted.
+# Run the same command outside of PBS, setting NCPUS as required.
 BASEPATH=/scratch/w85/swhaq/hazard/output/QLD
-TMPPATH=${PBS_JOBFS}/TMP 
-if [ ! -d $TMPPATH ]; then
-    mkdir $TMPPATH
-    mkdir $TMPPATH/tracks
-fi
-
 BASEOUTPUT=/scratch/w85/cxa547/swhaq/tracks2csv
-if [ ! -d $BASEOUTPUT ]; then
-    mkdir $BASEOUTPUT
-fi
-
-for G in $GROUPLIST; do
-    for R in $RCPLIST; do
-        for P in $PERIODS; do
-        INPUTPATH=$BASEPATH/$G\_$R\_$P/
-        if [ ! -d $INPUTPATH ]; then
-            echo "Appears that $INPUTPATH is missing, skipping..."
-            continue
-        fi
-        echo $INPUTPATH
-        OUTPUTPATH=$TMPPATH
-        echo "Running tracks2csv.py for files in $INPUTPATH"
-        # Note the Python script adds "tracks" to both the input and output paths
-        python3 $HOME/tcrm/Utilities/tracks2csv.py -i $INPUTPATH -o $OUTPUTPATH
 
-        cd $TMPPATH/tracks
-        echo "Creating tar file $G\_$R\_$P.tar.gz"
-        tar czf $G\_$R\_$P.tar.gz *.csv
-        rm -rf *.csv
-	mv $G\_$R\_$P.tar.gz $BASEOUTPUT
-        done
-    done
-done
-#rm -rf $TMPPATH
+python3 $HOME/SWHAQ/scripts/convert_tracks.py -i $BASEPATH -o $BASEOUTPUT \
+    -g GROUP2 -r RCP45,RCP85 -p 1981-2020,2021-2040,2041-2060,2061-2080,2081-2100 \
+    -n $NCPUS
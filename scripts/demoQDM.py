@@ -26,16 +26,15 @@ import statsmodels.api as sm
 from datetime import timedelta, datetime
 
 import shapely.geometry as sg
-from shapely.geometry import box as sbox
-from shapely.geometry import LineString
 
 from scipy.optimize import curve_fit
 import scipy.stats as stats
 
 from qdm import qdm
-
-# From TCRM codebase
-from Utilities.loadData import maxWindSpeed
+from distfit import fit_table, stack_models
+from tclv import (load_track_file, filter_tracks, filter_tracks_domain,
+                  calculate_max_wind)
+from ibtracs import load_ibtracs
 
 from builtins import str
 sns.set_style('whitegrid')
@@ -65,87 +64,6 @@ LOGGER.addHandler(console)
 LOGGER.info(f"Started {sys.argv[0]} (pid {os.getpid()})")
 LOGGER.info(f"Code version: {commit}")
 
-def load_track_file(filename):
-    """
-    Load a TCLV file into a :class:`pandas.DataFrame`, and add a field 
-    representing the age of each TCLV in hours, and the pressure difference.
-    
-    :param str filename: Path to a TCLV data file
-    
-    :returns: :class:`pandas.DataFrame`
-    """
-    # This assumes the format of the TCLV files is identical
-    LOGGER.info(f"Loading TCLV data from {filename}")
-    columns = ['num', 'year', 'month', 'day', 'hour', 'lon', 'lat',
-               'pmin', 'vorticity', 'vmax', 'tanomsum','tanomdiff',
-               'pmslanom', 'poci', 'reff','ravg','asym']
-    try:
-        df = pd.read_csv(filename, delimiter=' ', skipinitialspace=True,
-                         names=columns, parse_dates={'datetime':[1,2,3,4]},
-                         keep_date_col=True, 
-                         dtype={'year':int, 'month':int, 'day':int})
-    except:
-        LOGGER.exception(f"Failed to load {filename}")
-        raise
-    df['dt'] = df.groupby('num')['datetime'].apply(lambda x: x.diff())
-    df['dt'] = df['dt'].transform(lambda x: x.total_seconds())
-
-    df['age'] = df.groupby('num')['dt'].apply(np.cumsum).fillna(0)/3600.
-    # Throw in the pressure deficit for good measure:
-    df['pdiff'] = df['poci'] - df['pmin']
-
-    # And normalised intensity. This is the intensity at any given time,
-    # dividied by the lifetime maximum intensity for each unique event
-    df['ni'] = df.pdiff / df.groupby('num').pdiff.transform(np.max)
-    return df
-
-def filter_tracks(df, start_year=1980, end_year=2010, zeta=0, age=36):
-    """
-    Takes a `DataFrame` and filters on the basis of a prescribed vorticity 
-    threshold, lifetime and a given time period.
-    
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param int start_year: Starting year of the time period to filter
-    :param int end_year: End year of the period to filter
-    :param float zeta: Vorticity threshold to filter the TCLV data. 
-                       This can be a positive value, as we filter on the
-                       absolute value of the field.
-    :param int age: Minimum age of the TCLVs in hours
-    
-    """
-    tracks = df.groupby('num')
-    filterdf = tracks.filter(lambda x: (x['datetime'].dt.year.min() >= start_year) &
-                             (x['datetime'].dt.year.max() <= end_year) &
-                             (x['age'].max() >= age) &
-                             (np.abs(x['vorticity'].min()) > zeta))
-    return filterdf
-
-def filter_tracks_domain(df, minlon=90, maxlon=180, minlat=-40, maxlat=0):
-    """
-    Takes a `DataFrame` and filters on the basis of whether the track interscts
-    the given domain, which is specified by the minimum and maximum longitude and 
-    latitude.
-    
-    NOTE: This assumes the tracks and bounding box are in the same geographic 
-    coordinate system (i.e. generally a latitude-longitude coordinate system). 
-    It will NOT support different projections (e.g. UTM data for the bounds and
-    geographic for the tracks).
-    
-    NOTE: This doesn't work if there is only one point for the track. 
-    
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param float minlon: minimum longitude of the bounding box
-    :param float minlat: minimum latitude of the bounding box
-    :param float maxlon: maximum longitude of the bounding box
-    :param float maxlat: maximum latitude of the bounding box
-    """
-
-    domain = sbox(minlon, minlat, maxlon, maxlat, ccw=False)
-    tracks = df.groupby('num')
-    tempfilter = tracks.filter(lambda x: len(x) > 1)
-    filterdf = tempfilter.groupby('num').filter(lambda x: LineString(zip(x['lon'], x['lat'])).intersects(domain))
-    return filterdf
-
 def calculateMaxWind(df, dtname='ISO_TIME'):
     """
     Calculate a maximum gust wind speed based on the central pressure deficit and the 
@@ -156,15 +74,7 @@ def calculateMaxWind(df, dtname='ISO_TIME'):
     This returns a `DataFrame` with an additional column (`vmax`), which represents an estimated
     0.2 second maximum gust wind speed.
     """
-    LOGGER.debug("Calculating maximum wind speed")
-    idx = df.num.values
-    varidx = np.ones(len(idx))
-    varidx[1:][idx[1:]==idx[:-1]] = 0
-    
-    dt = (df[dtname] - df[dtname].shift()).fillna(pd.Timedelta(seconds=0)).apply(lambda x: x / np.timedelta64(1,'h')).astype('int64') % (24*60)
-    df['vmax'] = maxWindSpeed(varidx, dt.values, df.lon.values, df.lat.values,
-                              df.pmin.values, df.poci.values, gustfactor=1.223)
-    return df
+    return calculate_max_wind(df, dtname, gustfactor=1.223)
 
 def loadTCLVdata(dataPath, model, start_year, end_year, domain):
     """ 
@@ -198,13 +108,7 @@ def loadObsData(obsfile, domain):
     :param tuple domain: Tuple containing min/max lon/lat values
     """
     LOGGER.info(f"Loading obsered TC data from {obsfile}")
-    best = pd.read_csv(obsfile, skiprows=[1],
-                       usecols=[0,6,8,9,11,95,113],
-                       na_values=[' '],
-                       parse_dates=[1])
-    best.rename(columns={'SID':'num', 'LAT': 'lat', 'LON':'lon',
-                        'WMO_PRES':'pmin', 'BOM_WIND':'vmax',
-                        'BOM_POCI':'poci'}, inplace=True)
+    best = load_ibtracs(obsfile, domain)
     best = best[best.poci.notnull() & best.pmin.notnull()]
     best['pdiff'] = best.poci - best.pmin
     best = best[best.pdiff > 1]
@@ -218,23 +122,15 @@ regex = r'all_tracks_(.+)_(rcp\d+)\.dat'
 model = 'CNRM-CM5Q RCP85'
 
 dist = stats.lognorm
-binvals = np.arange(0, 100, 5)
-params = pd.DataFrame(columns=['Model', 'RCP', 'period',
-    'bc', 'mu', 'sigma', 'zeta'].append(binvals.tolist()))
 
 LOGGER.info("Processing observations...")
 domain = (135, 160, -25, -10)
 bins = np.arange(0, 100, 5)
 obstc = loadObsData("../data/ibtracs.since1980.list.v04r00.csv", domain)
 obslmi = obstc.loc[obstc.groupby(["num"])["pdiff"].idxmax()]
-h, b = np.histogram(obslmi.pdiff, bins=bins, density=True)
-histdict = {b:h for b, h in zip(b, h)}
-obsparams = stats.lognorm.fit(obslmi.pdiff, loc=0, scale=1)
-params = params.append({"Model": "Obs", "RCP": "Obs", 
-                        'period': '1981-2019', 'bc': False,
-                        "mu": obsparams[0], "sigma": obsparams[1],
-                        "zeta": obsparams[2], **histdict},
-                        ignore_index=True)
+params = fit_table(stack_models({'Obs Obs': obslmi}, period='1981-2019',
+                                bc=False),
+                   bins=bins, loc=0, scale=1)
 
 LOGGER.info("Processing the reference period 1981 - 2010")
 refdf = loadTCLVdata(path, model, 1981, 2019, domain)
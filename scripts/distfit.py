@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `distfit` -- Memoised distribution fits
+=============================================
+
+.. module:: distfit
+    :synopsis: Cache the parameters of distributions fitted to samples of
+    data, so the same sample is only fitted once.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+Fitting a distribution with `scipy.stats.rv_continuous.fit` is a numerical
+optimisation, and costs much more than evaluating the fitted distribution.
+The same samples (e.g. the observed LMI values, or the reference period
+values for each model) are fitted many times when bias correcting and
+plotting the TCLV data, so the fitted parameters are cached.
+
+Some fits have a closed-form maximum likelihood solution, which is used in
+place of the optimiser (see :func:`fit_distribution`):
+
+* lognormal with a fixed location (`floc`): the shape and log of the scale
+  are the standard deviation and mean of `log(x - floc)` (or the shape
+  alone, if the scale is also fixed)
+* exponential with a fixed location: the scale is the mean of `x - floc`
+* normal: the location and scale are the mean and standard deviation
+
+Note that `loc` and `scale` keyword arguments are starting guesses for the
+optimiser, not fixed values, so a fit with `loc=0` is not a fixed-location
+fit.
+
+The cache key is a hash of the content of the sample, the distribution and
+the arguments passed to `fit` (starting guesses and fixed parameters), so a
+cached fit is only reused for an identical fit. The most recently used fits
+are kept in memory. Optionally, the fits are also stored as json files in a
+directory, so they can be reused by later sessions.
+
+Example::
+
+    >>> from distfit import fit
+    >>> params = fit(stats.lognorm, data, loc=0, scale=1)
+
+:func:`fit_table` builds a table of fitted parameters and histograms for
+each group in a long-format table of values (e.g. model, RCP, period and
+bias correction flag). :func:`stack_models` creates that table from the
+dicts of model data used in the TCLV scripts.
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict, Counter
+from os.path import join as pjoin
+
+import numpy as np
+import pandas as pd
+import scipy
+from scipy import stats
+
+LOGGER = logging.getLogger(__name__)
+
+# Increment this when the layout of the stored fits changes:
+CACHE_VERSION = 2
+
+ANALYTIC = 'analytic'
+OPTIMISER = 'optimiser'
+
+# Column names for the (shape, location, scale) parameters of the lognormal
+# distribution in the fit tables:
+PARAM_NAMES = ['mu', 'sigma', 'zeta']
+
+
+def _fit_key(dist, data, args, kwds):
+    """
+    Hash of the sample values, the distribution and the arguments to `fit`.
+    """
+    values = np.ascontiguousarray(data, dtype=float)
+    h = hashlib.sha1(values.tobytes())
+    h.update(str(values.shape).encode())
+    text = json.dumps({'dist': f"{type(dist).__module__}."
+                               f"{type(dist).__qualname__}:{dist.name}",
+                       'args': args, 'kwds': kwds,
+                       'scipy': scipy.__version__,
+                       'version': CACHE_VERSION},
+                      sort_keys=True, default=repr)
+    h.update(text.encode())
+    return h.hexdigest()
+
+
+def _closed_form(dist, data, args, kwds):
+    """
+    Closed-form maximum likelihood estimates of the parameters, for the
+    cases listed in the module documentation.
+
+    :returns: tuple of the fitted parameters, or `None` if there is no
+        closed-form solution for this fit
+    """
+    name = getattr(dist, 'name', None)
+    # Fixed values of the shape parameter can be given as `f0` or by name:
+    fixed = set(kwds) & {'floc', 'fscale', 'f0', 'fs', 'fix_s'}
+    if args or set(kwds) - fixed - {'loc', 'scale', 's'}:
+        return None
+    x = np.asarray(data, dtype=float).ravel()
+    if x.size == 0 or not np.isfinite(x).all():
+        return None
+
+    if name == 'lognorm' and 'floc' in kwds:
+        y = x - kwds['floc']
+        if (y <= 0).any():
+            return None
+        logy = np.log(y)
+        shape = [kwds[k] for k in ('f0', 'fs', 'fix_s') if k in kwds]
+        if 'fscale' in kwds:
+            if shape:
+                return None
+            s = np.sqrt(np.mean((logy - np.log(kwds['fscale'])) ** 2))
+            return (float(s), kwds['floc'], kwds['fscale'])
+        mu = logy.mean()
+        s = shape[0] if shape else np.sqrt(np.mean((logy - mu) ** 2))
+        return (float(s), kwds['floc'], float(np.exp(mu)))
+
+    if name == 'expon' and 'floc' in kwds and 'fscale' not in kwds:
+        y = x - kwds['floc']
+        if (y < 0).any():
+            return None
+        return (kwds['floc'], float(y.mean()))
+
+    if name == 'norm' and not fixed:
+        return (float(x.mean()), float(x.std()))
+
+    return None
+
+
+def fit_distribution(dist, data, *args, **kwds):
+    """
+    Fit a distribution to a sample, using the closed-form solution where
+    there is one, and `dist.fit` otherwise.
+
+    :param dist: Distribution to fit (e.g. `scipy.stats.lognorm`)
+    :param data: `numpy.array` (or array-like) of sample values
+    :param args: Starting guesses for the shape parameters
+    :param kwds: Other arguments to `dist.fit`
+
+    :returns: tuple of (parameters, method), where method is either
+        :data:`ANALYTIC` or :data:`OPTIMISER`
+    """
+    params = _closed_form(dist, data, args, kwds)
+    if params is not None:
+        return params, ANALYTIC
+    params = tuple(float(p) for p in dist.fit(data, *args, **kwds))
+    return params, OPTIMISER
+
+
+class FitCache(object):
+    """
+    Cache of fitted distribution parameters, with least recently used
+    eviction and an optional persistent store.
+
+    :param int maxsize: Maximum number of fits held in memory
+    :param str cachedir: Optional directory to store the fits in. Default
+        is to keep the fits in memory only.
+    """
+
+    def __init__(self, maxsize=256, cachedir=None):
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self.hits = 0
+        self.misses = 0
+        self.methods = Counter()
+        self._fits = OrderedDict()
+
+    def __len__(self):
+        return len(self._fits)
+
+    def _path(self, key):
+        return pjoin(self.cachedir, f"{key}.json")
+
+    def _load(self, key):
+        if self.cachedir is None:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as fh:
+                stored = json.load(fh)
+            return tuple(stored['params']), stored['method']
+        except (OSError, ValueError, KeyError, TypeError):
+            LOGGER.warning(f"Cannot read cached fit {path}")
+            return None
+
+    def _store(self, key, result):
+        """
+        Write to a temporary file and move into place, so a partially written
+        file is never read. Failure to write the store is not fatal.
+        """
+        if self.cachedir is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(self.cachedir, exist_ok=True)
+            tmpfile = f"{path}.{os.getpid()}.tmp"
+            with open(tmpfile, 'w') as fh:
+                json.dump({'params': list(result[0]),
+                           'method': result[1]}, fh)
+            os.replace(tmpfile, path)
+        except OSError:
+            LOGGER.warning(f"Unable to write {path}")
+
+    def _remember(self, key, result):
+        self._fits[key] = result
+        self._fits.move_to_end(key)
+        while len(self._fits) > self.maxsize:
+            self._fits.popitem(last=False)
+
+    def fit(self, dist, data, *args, full_output=False, **kwds):
+        """
+        Fit a distribution to a sample, or return the cached fit.
+
+        :param dist: Distribution to fit (e.g. `scipy.stats.lognorm`). This
+            must have a `fit` method, as used in
+            `scipy.stats.rv_continuous` distributions.
+        :param data: `numpy.array` (or array-like) of sample values
+        :param args: Starting guesses for the shape parameters
+        :param bool full_output: Also return the method used for the fit
+        :param kwds: Other arguments to `dist.fit` (e.g. `loc`, `scale`,
+            `floc`, `fscale`)
+
+        :returns: tuple of the fitted parameters or, if `full_output` is
+            True, a tuple of (parameters, method) (see
+            :func:`fit_distribution`)
+        """
+        key = _fit_key(dist, data, args, kwds)
+        if key in self._fits:
+            self.hits += 1
+            self._fits.move_to_end(key)
+            result = self._fits[key]
+        else:
+            result = self._load(key)
+            if result is None:
+                self.misses += 1
+                result = fit_distribution(dist, data, *args, **kwds)
+                self.methods[result[1]] += 1
+                LOGGER.debug(f"Fitted {dist.name} using the {result[1]}")
+                self._store(key, result)
+            else:
+                self.hits += 1
+            self._remember(key, result)
+        return result if full_output else result[0]
+
+    def clear(self):
+        """Remove all fits held in memory (the stored fits are kept)"""
+        self._fits.clear()
+        self.hits = 0
+        self.misses = 0
+        self.methods.clear()
+
+
+# Shared by all callers in a session:
+DEFAULT_CACHE = FitCache()
+
+
+def fit(dist, data, *args, cache=None, full_output=False, **kwds):
+    """
+    Fit a distribution to a sample, using a cache of previous fits.
+
+    :param dist: Distribution to fit (e.g. `scipy.stats.lognorm`)
+    :param data: `numpy.array` (or array-like) of sample values
+    :param args: Starting guesses for the shape parameters
+    :param cache: :class:`FitCache` to use. Default is the cache shared by
+        all callers in the session (:data:`DEFAULT_CACHE`).
+    :param bool full_output: Also return the method used for the fit
+    :param kwds: Other arguments to `dist.fit`
+
+    :returns: tuple of the fitted parameters or, if `full_output` is True,
+        a tuple of (parameters, method)
+    """
+    if cache is None:
+        cache = DEFAULT_CACHE
+    return cache.fit(dist, data, *args, full_output=full_output, **kwds)
+
+
+def stack_models(datadict, column='pdiff', **labels):
+    """
+    Stack the data for a collection of models into a long-format table.
+
+    :param datadict: :class:`dict` of `pandas.DataFrame`, with keys of model
+        name/scenario (e.g. "ACCESS1-0Q RCP45")
+    :param str column: Name of the column that holds the values
+    :param labels: Additional columns with a constant value for all the
+        data (e.g. `period="1981-2010", bc=False`)
+
+    :returns: :class:`pandas.DataFrame` with columns `Model`, `RCP`, the
+        labels and `value`
+    """
+    keys = list(datadict)
+    sizes = [len(datadict[k]) for k in keys]
+    model, rcp = zip(*[k.split(' ') for k in keys]) if keys else ((), ())
+    df = pd.DataFrame({'Model': np.repeat(model, sizes).astype(object),
+                       'RCP': np.repeat(rcp, sizes).astype(object)})
+    for name, label in labels.items():
+        df[name] = label
+    if keys:
+        df['value'] = np.concatenate(
+            [datadict[k][column].to_numpy(dtype=float) for k in keys])
+    else:
+        df['value'] = np.array([], dtype=float)
+    return df
+
+
+def fit_table(data, by=('Model', 'RCP', 'period', 'bc'), value='value',
+              bins=None, dist=stats.lognorm, names=PARAM_NAMES,
+              cache=None, **kwds):
+    """
+    Fit a distribution and calculate the histogram of the values in each
+    group of a long-format table.
+
+    The values are sorted by group once, and each group is fitted in turn
+    (through the fit cache, see :func:`fit`). The histograms for all groups
+    are calculated with a single `numpy.bincount` of the combined group and
+    bin indices, and are identical to `numpy.histogram(..., density=True)`
+    for each group.
+
+    :param data: :class:`pandas.DataFrame` with the group columns and values
+    :param by: Names of the columns that define the groups
+    :param str value: Name of the column of values
+    :param bins: Bin edges for the histograms. Default is no histograms.
+    :param dist: Distribution to fit (default `scipy.stats.lognorm`)
+    :param names: Column names for the fitted parameters
+    :param cache: :class:`FitCache` to use for the fits
+    :param kwds: Other arguments to `dist.fit` (e.g. `loc=0, scale=1`)
+
+    :returns: :class:`pandas.DataFrame` with a row for each group (in order
+        of first appearance), with the group columns, the fitted parameters
+        and the histogram density of each bin (with the left edge of the
+        bin as the column name)
+    """
+    by = list(by)
+    codes = data.groupby(by, sort=False, dropna=False).ngroup().to_numpy()
+    values = data[value].to_numpy(dtype=float)
+    ngroups = codes.max() + 1 if len(codes) else 0
+    _, first = np.unique(codes, return_index=True)
+    table = data[by].iloc[first].reset_index(drop=True)
+
+    order = np.argsort(codes, kind='stable')
+    offsets = np.r_[0, np.cumsum(np.bincount(codes, minlength=ngroups))]
+    params = [fit(dist, values[order[offsets[i]:offsets[i + 1]]],
+                  cache=cache, **kwds) for i in range(ngroups)]
+    for j, name in enumerate(names):
+        table[name] = [p[j] for p in params]
+
+    if bins is not None:
+        bins = np.asarray(bins)
+        nbins = len(bins) - 1
+        # Same bins as `numpy.histogram`: the last bin includes its right
+        # edge, and values outside the bins are ignored:
+        idx = np.searchsorted(bins, values, side='right') - 1
+        idx[values == bins[-1]] = nbins - 1
+        valid = (idx >= 0) & (idx < nbins)
+        counts = np.bincount(codes[valid] * nbins + idx[valid],
+                             minlength=ngroups * nbins)
+        counts = counts.reshape(ngroups, nbins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density = (counts / np.diff(bins).astype(float) /
+                       counts.sum(axis=1, keepdims=True))
+        hist = pd.DataFrame(density, columns=bins[:-1].tolist())
+        table = pd.concat([table, hist], axis=1)
+    return table
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `ibtracs` -- Cached, filtered extracts of IBTrACS best track data
+======================================================================
+
+.. module:: ibtracs
+    :synopsis: Load the observed TC tracks from an IBTrACS v04 csv file,
+    using a typed columnar extract of the file and predicate pushdown to
+    select the tracks in a basin, range of seasons or geographic domain.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+The IBTrACS v04 csv files have more than 160 columns, of which only a handful
+are used here. The first time a file is loaded, the required columns are
+parsed and written to a Parquet file in a cache directory alongside the csv
+file. The extract includes the bounding box of each track, so the tracks
+that might intersect a domain can be selected when the extract is read,
+without loading the rest of the data. Each filtered subset is also cached,
+keyed on the source file and the filter arguments.
+
+Cache files are named using a hash of the size and modification time of the
+source file, so they are rebuilt whenever the source file changes. Reading
+and writing the cache requires `pyarrow`. If it is not available, the csv
+file is parsed on every load.
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+from os.path import join as pjoin
+
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+# Columns read from the IBTrACS file, and the names used for the TC track
+# data (consistent with the TCLV data):
+IBTRACS_COLUMNS = {'SID': 'num', 'SEASON': 'season', 'BASIN': 'basin',
+                   'ISO_TIME': 'ISO_TIME', 'LAT': 'lat', 'LON': 'lon',
+                   'WMO_PRES': 'pmin', 'BOM_WIND': 'vmax',
+                   'BOM_POCI': 'poci'}
+
+IBTRACS_DTYPES = {'SID': 'str', 'SEASON': 'int64', 'BASIN': 'str',
+                  'ISO_TIME': 'str', 'LAT': 'float64', 'LON': 'float64',
+                  'WMO_PRES': 'float64', 'BOM_WIND': 'float64',
+                  'BOM_POCI': 'float64'}
+
+# Bounding box of the track each point belongs to:
+BBOX_COLUMNS = ['tminlon', 'tmaxlon', 'tminlat', 'tmaxlat']
+
+CACHE_DIR = ".ibtracscache"
+
+# Increment this when the layout of the extract changes:
+CACHE_VERSION = 1
+
+
+def read_ibtracs(filename):
+    """
+    Parse the required columns of an IBTrACS v04 csv file, and add the
+    bounding box of each track.
+
+    :param str filename: Path to the IBTrACS csv file
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    LOGGER.info(f"Loading observed TC tracks from {filename}")
+    # The second row of the file holds the units of each column. Basin "NA"
+    # (North Atlantic) must not be treated as a missing value.
+    df = pd.read_csv(filename, skiprows=[1], usecols=list(IBTRACS_COLUMNS),
+                     dtype=IBTRACS_DTYPES, keep_default_na=False,
+                     na_values={c: [' ', ''] for c in IBTRACS_COLUMNS})
+    df = df[list(IBTRACS_COLUMNS)].rename(columns=IBTRACS_COLUMNS)
+    df['ISO_TIME'] = pd.to_datetime(df['ISO_TIME'],
+                                    format="%Y-%m-%d %H:%M:%S")
+
+    grouped = df.groupby('num', sort=False)
+    for col, var, func in [('tminlon', 'lon', 'min'),
+                           ('tmaxlon', 'lon', 'max'),
+                           ('tminlat', 'lat', 'min'),
+                           ('tmaxlat', 'lat', 'max')]:
+        df[col] = grouped[var].transform(func)
+    return df
+
+
+def filter_ibtracs(df, domain=None, basins=None, seasons=None):
+    """
+    Select the records from an IBTrACS extract (from :func:`read_ibtracs`)
+    that are in the given basins and seasons, and belong to tracks with a
+    bounding box that overlaps the domain.
+
+    :param df: :class:`pandas.DataFrame` of IBTrACS data
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+    :param list basins: List of basin codes (e.g. ["SP", "SI"])
+    :param tuple seasons: Tuple of (first, last) season
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if domain is not None:
+        minlon, maxlon, minlat, maxlat = domain
+        mask &= ((df['tmaxlon'] >= minlon) & (df['tminlon'] <= maxlon) &
+                 (df['tmaxlat'] >= minlat) & (df['tminlat'] <= maxlat))
+    if basins is not None:
+        mask &= df['basin'].isin(basins)
+    if seasons is not None:
+        mask &= df['season'].between(*seasons)
+    return df[mask]
+
+
+def _pushdown_filters(domain=None, basins=None, seasons=None):
+    """
+    Equivalent of :func:`filter_ibtracs` as predicates for
+    :func:`pandas.read_parquet`.
+    """
+    filters = []
+    if domain is not None:
+        minlon, maxlon, minlat, maxlat = domain
+        filters += [('tmaxlon', '>=', minlon), ('tminlon', '<=', maxlon),
+                    ('tmaxlat', '>=', minlat), ('tminlat', '<=', maxlat)]
+    if basins is not None:
+        filters.append(('basin', 'in', list(basins)))
+    if seasons is not None:
+        filters += [('season', '>=', seasons[0]),
+                    ('season', '<=', seasons[1])]
+    return filters or None
+
+
+def _cache_key(filename, **kwargs):
+    """
+    Hash of the source file signature and any additional (filter) arguments.
+    """
+    st = os.stat(filename)
+    key = {'source': os.path.abspath(filename), 'size': st.st_size,
+           'mtime_ns': st.st_mtime_ns, 'version': CACHE_VERSION}
+    key.update({k: v for k, v in kwargs.items() if v is not None})
+    text = json.dumps(key, sort_keys=True, default=list)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def _cache_file(filename, cachedir, key):
+    if cachedir is None:
+        cachedir = pjoin(os.path.dirname(os.path.abspath(filename)), CACHE_DIR)
+    return pjoin(cachedir, f"{os.path.basename(filename)}.{key}.parquet")
+
+
+def _write_parquet(df, path):
+    """
+    Write to a temporary file and move into place, so a partially written
+    file is never read. Failure to write the cache is not fatal.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpfile = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmpfile, index=False)
+        os.replace(tmpfile, path)
+    except ImportError:
+        LOGGER.debug("No parquet engine available - cache disabled")
+    except OSError:
+        LOGGER.warning(f"Unable to write {path}")
+
+
+def load_ibtracs(filename, domain=None, basins=None, seasons=None,
+                 cache=True, cachedir=None):
+    """
+    Load the observed TC tracks from an IBTrACS v04 csv file.
+
+    All records of the tracks with a bounding box that overlaps the domain
+    are returned. This is a superset of the tracks that intersect the domain,
+    so :func:`tclv.filter_tracks_domain` should still be applied (after any
+    filtering of the individual records) to select those tracks.
+
+    :param str filename: Path to the IBTrACS csv file
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+        that describes the bounding domain.
+    :param list basins: Only return records in these basins
+    :param tuple seasons: Only return tracks from the (first, last) season
+    :param bool cache: Use (and update) the cached extracts of the data
+    :param str cachedir: Optional cache directory. Default is a
+        `.ibtracscache` directory in the same directory as `filename`.
+
+    :returns: :class:`pandas.DataFrame` with fields `num` (the storm ID),
+        `season`, `basin`, `ISO_TIME`, `lat`, `lon`, `pmin`, `vmax` and
+        `poci`
+    """
+    if not os.path.isfile(filename):
+        LOGGER.error(f"{filename} does not exist")
+        raise FileNotFoundError(f"{filename} does not exist")
+
+    filters = dict(domain=domain, basins=basins, seasons=seasons)
+    if not cache:
+        df = filter_ibtracs(read_ibtracs(filename), **filters)
+        return df.drop(columns=BBOX_COLUMNS).reset_index(drop=True)
+
+    subset = _cache_file(filename, cachedir, _cache_key(filename, **filters))
+    if os.path.isfile(subset):
+        try:
+            LOGGER.info(f"Loading observed TC tracks from {subset}")
+            return pd.read_parquet(subset)
+        except ImportError:
+            LOGGER.debug("No parquet engine available - cache disabled")
+        except Exception:
+            LOGGER.warning(f"Cannot read cached data {subset}")
+
+    extract = _cache_file(filename, cachedir, _cache_key(filename))
+    df = None
+    if os.path.isfile(extract):
+        try:
+            df = pd.read_parquet(extract, filters=_pushdown_filters(**filters))
+        except ImportError:
+            LOGGER.debug("No parquet engine available - cache disabled")
+        except Exception:
+            LOGGER.warning(f"Cannot read cached data {extract}")
+    if df is None:
+        df = read_ibtracs(filename)
+        _write_parquet(df, extract)
+        df = filter_ibtracs(df, **filters)
+
+    df = df.drop(columns=BBOX_COLUMNS).reset_index(drop=True)
+    _write_parquet(df, subset)
+    return df
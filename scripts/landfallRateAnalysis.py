@@ -29,59 +29,130 @@
 import os
 from os import walk
 from os.path import join as pjoin
-import matplotlib.pyplot as plt
-import geopandas as gpd
-from Utilities import track
-from shapely.geometry import LineString, Point
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
-import seaborn as sns
-sns.set_style('whitegrid')
+import geopandas as gpd
+import shapely
+from shapely.geometry import Point
+
+from trackcollection import TrackCollection
+from streamstats import QuantileSketch, RunningStats
+
+GATES_FILE = "C:/WorkSpace/tcha/data/gates.shp"
+DATAPATH = r"C:\WorkSpace\tcrm\output\port_hedland\tracks"
+PLOTPATH = r"C:\WorkSpace\tcrm\output\port_hedland\plots\stats"
+
+NCPUS = int(os.environ.get('NCPUS', 1))
+
+# Central pressure bins (hPa) of each intensity category. Pressures outside
+# the bins have no category (-1):
+CATEGORY_BINS = [0, 930, 955, 970, 985, 990, 1020]
+CATEGORY_LABELS = [5, 4, 3, 2, 1, 0]
+
+# Number of track segments tested against the gates at a time:
+CHUNKSIZE = 100000
+
+# Summary statistics of the landfall statistics of each gate:
+SUMMARY_STATS = {'count': ['sum', 'nanmean', 'nanstd', 'min', 'max', 'q10', 'q90'],
+                 'cat1': ['sum', 'nanmean', 'nanstd'],
+                 'cat2': ['sum', 'nanmean', 'nanstd'],
+                 'cat3': ['sum', 'nanmean', 'nanstd'],
+                 'cat4': ['sum', 'nanmean', 'nanstd'],
+                 'cat5': ['sum', 'nanmean', 'nanstd'],
+                 'meanlfintensity': ['nanmean', 'q10', 'q25', 'q75', 'q90'],
+                 'minlfintensity': ['nanmean', 'min', 'nanstd']}
+
+QUANTILES = {'q10': 0.1, 'q25': 0.25, 'q75': 0.75, 'q90': 0.9}
+
+# Start with reading in the gates into a `GeoDataFrame`. The landfall
+# statistics of each simulation are calculated as arrays with one value per
+# gate, and added to running accumulators (a `GateSummary`) as each simulation
+# is completed, so the gates themselves are only read once.
+
+def readGates(gateFile=GATES_FILE):
+    """
+    Read the gates.
+
+    :param str gateFile: Path to the vector file of gates
+
+    :returns: `GeoPandas.GeoDataFrame` of gates
+    """
+    return gpd.read_file(gateFile)
+
 
+def pressureCategory(pressure):
+    """
+    Assign a nominal intensity category to central pressure values, using
+    the bins in `CATEGORY_BINS` (each bin includes its upper edge).
 
-# Start with reading in the gates into a `GeoDataFrame`,
-# and adding some additional attributes. This `GeoDataFrame` will be duplicated
-# for each simulation, then aggregated for the summary statistics.
+    :param pressure: `numpy.array` of central pressure values (hPa)
 
-gates = gpd.read_file("C:/WorkSpace/tcha/data/gates.shp")
-gates['sim'] = 0
-gates['count'] = 0
-gates['meanlfintensity'] = np.nan
-gates['minlfintensity'] = np.nan
-gates['cat1'] = 0
-gates['cat2'] = 0
-gates['cat3'] = 0
-gates['cat4'] = 0
-gates['cat5'] = 0
+    :returns: `numpy.array` of categories, with -1 for pressures outside
+        the bins
+    """
+    labels = np.r_[-1, CATEGORY_LABELS, -1]
+    return labels[np.digitize(pressure, CATEGORY_BINS, right=True)]
 
 
-# Define a function to read in the track files. The track files are the TCRM format files, which are netCDF files, with a heirarchical structure. The `tracks.ncReadTrackData` function does this, but we still need to convert each track to a `GeoDataFrame` and add a `geometry` attribute that represents the line of each time step in the track history. We also assign a category attribute to each segment, which at this point in time is simply based on categorising the central pressure according to the Bureau of Meteorology's TC intensity scale.
+# Define a function to read in the track files. The track files are the TCRM
+# format files, which are netCDF files, with a heirarchical structure. All the
+# tracks in a file are read into a `TrackCollection`, and the segments (each
+# time step in the track history) are described by the coordinates of their
+# start and end points, with the attributes of the start point. We also assign
+# a category attribute to each segment, which at this point in time is simply
+# based on categorising the central pressure according to the Bureau of
+# Meteorology's TC intensity scale. Segment geometries are only created when
+# they are needed (see `toGeoDataFrame`).
 
 def readTracks(trackFile):
     """
-    Read a track file and create a `GeoPandas.GeoDataFrame` from the data, with
-    separate polyline features for each unique track in the file. Also adds a
-    nominal intensity category based on the central pressure value.
+    Read a track file and create a table of the segments of every track in
+    the file, with the coordinates of the start (`x0`, `y0`) and end (`x1`,
+    `y1`) of each segment, the attributes of the start point, the index of
+    the track (`track`), and a nominal intensity category based on the
+    central pressure value.
 
     :param str trackFile: Path to a TCRM-format track file
 
-    :returns: `GeoPandas.GeoDataFrame` of tracks
-    """
-    tracks = track.ncReadTrackData(trackFile)
-    trackgdf = []
-    for t in tracks:
-        segments = []
-        for n in range(len(t.data) - 1):
-            segment = LineString([[t.Longitude[n], t.Latitude[n]],[t.Longitude[n+1], t.Latitude[n+1]]])
-            segments.append(segment)
-        gdf = gpd.GeoDataFrame.from_records(t.data[:-1])
-        gdf['geometry'] = segments
-        gdf['category'] = pd.cut(gdf['CentralPressure'],
-                                bins=[0, 930, 955, 970, 985, 990, 1020],
-                                labels=[5,4,3,2,1,0])
-        trackgdf.append(gdf)
-    trackgdf = pd.concat(trackgdf)
-    return trackgdf
+    :returns: `pandas.DataFrame` of track segments
+    """
+    tracks = TrackCollection.from_file(trackFile)
+    seg = tracks.segments()
+    segments = pd.DataFrame({name: values[seg['index']]
+                             for name, values in tracks.fields.items()})
+    segments['track'] = seg['track']
+    for key in ['x0', 'y0', 'x1', 'y1']:
+        segments[key] = seg[key]
+    segments['category'] = pressureCategory(
+        segments['CentralPressure'].to_numpy())
+    return segments
+
+
+def segmentGeometry(segments):
+    """
+    Create the line geometry of each track segment.
+
+    :param segments: `pandas.DataFrame` of track segments (see `readTracks`)
+
+    :returns: `numpy.array` of :class:`shapely.geometry.LineString` objects
+    """
+    coords = segments[['x0', 'y0', 'x1', 'y1']].to_numpy(dtype=float)
+    return shapely.linestrings(coords.reshape(-1, 2, 2))
+
+
+def toGeoDataFrame(segments):
+    """
+    Convert a table of track segments to a `GeoPandas.GeoDataFrame`, with a
+    `LineString` geometry for each segment.
+
+    :param segments: `pandas.DataFrame` of track segments (see `readTracks`)
+
+    :returns: `GeoPandas.GeoDataFrame` of track segments
+    """
+    return gpd.GeoDataFrame(segments, geometry=segmentGeometry(segments))
 
 def isLeft(line, point):
     """
@@ -99,24 +170,142 @@ def isLeft(line, point):
     if det > 0: return True
     if det <= 0: return False
 
-def isLandfall(gate, tracks):
+def orientation(ax, ay, bx, by, px, py):
     """
-    Determine the count of tracks crossing a gate segment.
+    Orientation of points relative to directed lines, as the determinant
+    of (b - a, p - a). Positive values are to the left of the line.
 
-    :param gate: `shapely.Geometry.LineSegment`
-    :param tracks: `GeoPandas.GeoDataFrame` of tracks, where the `geometry` field is a
-                   `LineSegment`
+    :param ax, ay: `numpy.array` of the coordinates of the line starts
+    :param bx, by: `numpy.array` of the coordinates of the line ends
+    :param px, py: `numpy.array` of the coordinates of the points
 
+    :returns: `numpy.array` of determinants
     """
-    crossings = tracks.crosses(gate.geometry)
-    landfall = []
-    for t in tracks[crossings].itertuples():
-        if isLeft(gate.geometry, Point(t.geometry.coords[0])):
-            landfall.append(True)
-        else:
-            landfall.append(False)
+    return (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+
 
-    return tracks[crossings][landfall]
+def gateSegments(gates):
+    """
+    Describe the gates as arrays of straight line segments. Gates are
+    usually a single segment, but gates with more vertices are split into
+    their segments.
+
+    :param gates: `GeoPandas.GeoDataFrame` of gates
+
+    :returns: tuple of the index of the gate of each segment, and an array
+        of the segment coordinates (x0, y0, x1, y1) (one row per segment)
+    """
+    coords, index = shapely.get_coordinates(gates.geometry.values,
+                                            return_index=True)
+    # Segments join consecutive vertices of the same gate:
+    same = index[1:] == index[:-1]
+    return index[:-1][same], np.column_stack([coords[:-1][same],
+                                              coords[1:][same]])
+
+
+def findCrossings(gates, tracks, chunksize=CHUNKSIZE):
+    """
+    Find the track segments that cross each gate from left to right, i.e.
+    where the start of the track segment is to the left of the (first segment
+    of the) gate.
+
+    Track segments are first filtered by the combined bounding box of the
+    gates, then paired with the gates whose bounding boxes they overlap.
+    The crossings of the pairs are tested with determinants: the segments
+    cross if the ends of each are strictly on opposite sides of the other
+    (i.e. touching or collinear segments do not cross).
+
+    :param gates: `GeoPandas.GeoDataFrame` of gates
+    :param tracks: `pandas.DataFrame` of track segments (see `readTracks`)
+    :param int chunksize: Number of track segments tested at a time
+
+    :returns: tuple of `numpy.array` of the (positional) index of the gate
+        and of the track segment of each crossing, sorted by gate
+    """
+    gid, gseg = gateSegments(gates)
+    gx0, gy0, gx1, gy1 = gseg.T
+    gxmin, gxmax = np.minimum(gx0, gx1), np.maximum(gx0, gx1)
+    gymin, gymax = np.minimum(gy0, gy1), np.maximum(gy0, gy1)
+
+    x0, y0, x1, y1 = tracks[['x0', 'y0', 'x1', 'y1']].to_numpy(dtype=float).T
+    xmin, xmax = np.minimum(x0, x1), np.maximum(x0, x1)
+    ymin, ymax = np.minimum(y0, y1), np.maximum(y0, y1)
+    candidates = np.flatnonzero((xmax >= gxmin.min()) & (xmin <= gxmax.max()) &
+                                (ymax >= gymin.min()) & (ymin <= gymax.max()))
+
+    gatepairs, segpairs = [], []
+    for start in range(0, len(candidates), chunksize):
+        seg = candidates[start:start + chunksize]
+        overlap = ((xmax[seg] >= gxmin[:, None]) &
+                   (xmin[seg] <= gxmax[:, None]) &
+                   (ymax[seg] >= gymin[:, None]) &
+                   (ymin[seg] <= gymax[:, None]))
+        g, s = np.nonzero(overlap)
+        gatepairs.append(g)
+        segpairs.append(seg[s])
+    g = np.concatenate(gatepairs) if gatepairs else np.zeros(0, dtype=int)
+    s = np.concatenate(segpairs) if segpairs else np.zeros(0, dtype=int)
+
+    d1 = orientation(gx0[g], gy0[g], gx1[g], gy1[g], x0[s], y0[s])
+    d2 = orientation(gx0[g], gy0[g], gx1[g], gy1[g], x1[s], y1[s])
+    d3 = orientation(x0[s], y0[s], x1[s], y1[s], gx0[g], gy0[g])
+    d4 = orientation(x0[s], y0[s], x1[s], y1[s], gx1[g], gy1[g])
+    crosses = (d1 * d2 < 0) & (d3 * d4 < 0)
+    g, s = gid[g[crosses]], s[crosses]
+
+    # Direction of the crossing, relative to the first segment of each gate:
+    first = np.unique(gid, return_index=True)[1]
+    fx0, fy0, fx1, fy1 = gseg[first].T
+    left = orientation(fx0[g], fy0[g], fx1[g], fy1[g], x0[s], y0[s]) > 0
+
+    # A track segment may cross more than one segment of a gate:
+    pairs = np.unique(np.column_stack([g[left], s[left]]), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def gateStatistics(ngates, gateindex, pressure, category):
+    """
+    Calculate the landfall statistics of each gate.
+
+    :param int ngates: Number of gates
+    :param gateindex: `numpy.array` of the gate of each crossing
+    :param pressure: `numpy.array` of the central pressure of each crossing
+    :param category: `numpy.array` of the category of each crossing
+
+    :returns: :class:`dict` of `numpy.array` (one value per gate) of the
+        number of crossings ("count"), mean and minimum central pressure
+        ("meanlfintensity" and "minlfintensity", NaN for gates with no
+        crossings) and the number of crossings of each category ("cat1" to
+        "cat5")
+    """
+    count = np.bincount(gateindex, minlength=ngates)
+    total = np.bincount(gateindex, weights=pressure, minlength=ngates)
+    minimum = np.full(ngates, np.inf)
+    np.minimum.at(minimum, gateindex, pressure)
+    valid = (category >= 0) & (category <= 5)
+    cathist = np.bincount(6 * gateindex[valid] + category[valid],
+                          minlength=6 * ngates).reshape(ngates, 6)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {'count': count,
+                 'meanlfintensity': np.where(count > 0, total / count, np.nan),
+                 'minlfintensity': np.where(count > 0, minimum, np.nan)}
+    for cat in range(1, 6):
+        stats[f'cat{cat}'] = cathist[:, cat]
+    return stats
+
+
+def isLandfall(gate, tracks):
+    """
+    Determine the track segments crossing a gate segment.
+
+    :param gate: Gate, with a `geometry` attribute (a `shapely.geometry.LineString`)
+    :param tracks: `pandas.DataFrame` of track segments (see `readTracks`)
+
+    :returns: the rows of `tracks` that cross the gate from left to right
+    """
+    gdf = gpd.GeoDataFrame(geometry=[gate.geometry])
+    _, seg = findCrossings(gdf, tracks)
+    return tracks.iloc[seg]
 
 
 # This function counts the number of track segments that cross the coastal gates.
@@ -125,23 +314,19 @@ def countCrossings(gates, tracks, sim):
     """
     Count the crossing rate of all gates for all tracks in a given simulation.
 
+    :param gates: `GeoPandas.GeoDataFrame` of gates
+    :param tracks: `pandas.DataFrame` of track segments (see `readTracks`)
+    :param int sim: Simulation number
+
+    :returns: `gates`, with the landfall statistics of the simulation
     """
+    gateindex, seg = findCrossings(gates, tracks)
+    stats = gateStatistics(len(gates), gateindex,
+                           tracks['CentralPressure'].to_numpy()[seg],
+                           tracks['category'].to_numpy()[seg])
     gates['sim'] = sim
-    for i, gate in enumerate(gates.itertuples(index=False)):
-        ncrossings = 0
-        l = isLandfall(gate, tracks)
-        ncrossings = len(l)
-        if ncrossings > 0:
-            gates.loc[i, 'count'] = ncrossings
-            gates.loc[i, 'meanlfintensity'] = l['CentralPressure'].mean()
-            gates.loc[i, 'minlfintensity'] = l['CentralPressure'].min()
-            cathist, bins = np.histogram(l['category'].values, bins=[0,1,2,3,4,5, 6])
-            gates.loc[i, ['cat1', 'cat2','cat3', 'cat4', 'cat5']] = cathist[1:]
-        else:
-            gates.loc[i, 'count'] = 0
-            gates.loc[i, 'meanlfintensity'] = np.nan
-            gates.loc[i, 'minlfintensity'] = np.nan
-            gates.loc[i, ['cat1', 'cat2','cat3', 'cat4', 'cat5']] = 0
+    for key, values in stats.items():
+        gates[key] = values
 
     return gates
 
@@ -151,137 +336,256 @@ def countCrossings(gates, tracks, sim):
 # directory that end with "nc" - assume that you're pointing to a directory that
 # only has track files.
 
+def listTrackFiles(datapath=DATAPATH):
+    """
+    List the track files in a directory (all files ending with "nc").
 
-filelist = []
-datapath = r"C:\WorkSpace\tcrm\output\port_hedland\tracks"
-plotpath = r"C:\WorkSpace\tcrm\output\port_hedland\plots\stats"
-
-for (dirpath, dirnames, filenames) in walk(datapath):
-    filelist.extend([fn for fn in filenames if fn.endswith('nc')])
-    break
-nfiles = len(filelist)
-print(f"There are {nfiles} track files")
-
-# Now we loop through all the gates and determine the landfall rates for each simulation.
-
-gatedflist = []
-for sim, f in enumerate(filelist):
-    print(f"Processing {f}")
-    gatedf = gates.copy()
-    tracks = readTracks(pjoin(datapath,f))
-    gatedf = countCrossings(gatedf, tracks, sim)
-    gatedflist.append(gatedf)
-
-gatesummary = pd.concat(gatedflist)
-
-def q10(x): return x.quantile(0.1)
-def q90(x): return x.quantile(0.9)
-def q25(x): return x.quantile(0.25)
-def q75(x): return x.quantile(0.75)
-
-gs = gatesummary.groupby('gate').agg({'count':['sum',np.nanmean, np.nanstd, 'min', 'max', q10, q90],
-                                      'cat1': ['sum',np.nanmean, np.nanstd],
-                                      'cat2': ['sum',np.nanmean, np.nanstd],
-                                      'cat3': ['sum',np.nanmean, np.nanstd],
-                                      'cat4': ['sum',np.nanmean, np.nanstd],
-                                      'cat5': ['sum',np.nanmean, np.nanstd],
-                                      'meanlfintensity':[np.nanmean, q10, q25, q75, q90],
-                                      'minlfintensity':[np.nanmean,'min', np.nanstd]}, as_index=False)
-
-gs.columns = ['_'.join(col).strip() for col in gs.columns.values]
-gs.reset_index(col_level=1)
-gs.columns = gs.columns.get_level_values(0)
-
-gatedata = gates[['gate', 'longitude', 'latitude', 'label', 'geometry']].join(gs)
-gatedata.columns
-
-
-#gatedata = pd.read_csv("C:/WorkSpace/data/tcha/sim_landfall.csv")
-#gatedata.columns
-
-
-width=0.4
-fig, ax = plt.subplots(3,1,figsize=(12,16),sharex=True)
-cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
-cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
-cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
-ax[0].bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
-ax[0].bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
-ax[0].bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
-ax[0].bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
-ax[0].bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
-
-ax[0].legend()
-ax[0].set_ylabel("Mean number of TCs")
-ax[1].plot(gatedata['gate'], gatedata['minlfintensity_nanmean'], label='Minimum landfall intensity')
-ax[1].plot(gatedata['gate'], gatedata['meanlfintensity_nanmean'], color='r', label='Mean landfall intensity')
-ax[1].fill_between(gatedata['gate'], gatedata['meanlfintensity_q10'],
-                   gatedata['meanlfintensity_q90'],color='r', alpha=0.25)
-
-ax[1].legend(loc=2)
-ax[1].set_ylim((900, 1020))
-ax[1].set_ylabel("Pressure (hPa)")
-ax[2].plot(gatedata['gate'], gatedata['count_sum']/100)
-ax[2].fill_between(gatedata['gate'], gatedata['count_q90']/100, gatedata['count_q10']/100, alpha=0.25)
-ax[2].set_xlim((0,48))
-ax[2].set_xticks(np.arange(0,49,2))
-ax[2].set_yticks(np.arange(0,0.25,.02))
-ax[2].set_xticklabels(gatedata['label'][::2], rotation='vertical')
-ax[2].set_ylabel("Mean proportion of landfall")
-plt.show()
-
-width=0.4
-fig, ax = plt.subplots(1,1, figsize=(12,6), sharex=True)
-cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
-cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
-cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
-ax.bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
-ax.bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
-ax.bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
-ax.bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
-ax.bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
-
-
-
-ax.legend()
-ax.set_ylabel("Number of TCs")
-ax.set_xlim((0,48))
-ax.set_xticks(np.arange(0,49,2))
-ax.set_yticks(np.arange(0,1,.2))
-ax.set_xticklabels(gatedata['label'][::2], rotation='vertical')
-ax.set_ylabel("Mean rate of landfall")
-plt.savefig(os.path.join(plotpath, "mean_landfall_rate_intensity.png"), bbox_inches='tight')
-
-width=0.4
-fig, ax = plt.subplots(1,1, figsize=(12,6), sharex=True)
-cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
-cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
-cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
-ax.bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
-ax.bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
-ax.bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
-ax.bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
-ax.bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
-
-ax.legend()
-ax.set_ylabel("Number of TCs")
-ax.set_xlim((0,48))
-ax.set_xticks(np.arange(0,49,2))
-#ax.set_yticks(np.arange(0,0.11,.02))
-ax.set_xticklabels(gatedata['label'][::2], rotation='vertical')
-ax.set_ylabel("Mean rate of landfall")
-plt.savefig(os.path.join(plotpath, "mean_landfall_rate_intensity.png"), bbox_inches='tight')
-
-
-gatedata.to_file(os.path.join(plotpath, "sim_landfall.shp"))
-
-
-gatedata
-
-gatedata_nogeom = pd.DataFrame(gatedata.drop(columns='geometry'))
-gatedata_nogeom.to_csv(os.path.join(plotpath,"sim_landfall.csv"), index=False)
+    :param str datapath: Path to the directory of track files
 
+    :returns: list of file names
+    """
+    filelist = []
+    for (dirpath, dirnames, filenames) in walk(datapath):
+        filelist.extend([fn for fn in filenames if fn.endswith('nc')])
+        break
+    return filelist
+
+
+def simulationStatistics(trackFile, gates):
+    """
+    Calculate the landfall statistics of each gate for a single simulation.
+
+    :param str trackFile: Path to a TCRM-format track file
+    :param gates: `GeoPandas.GeoDataFrame` of gates
+
+    :returns: :class:`dict` of `numpy.array` of the statistics of each gate
+        (see `gateStatistics`)
+    """
+    tracks = readTracks(trackFile)
+    gateindex, seg = findCrossings(gates, tracks)
+    return gateStatistics(len(gates), gateindex,
+                          tracks['CentralPressure'].to_numpy()[seg],
+                          tracks['category'].to_numpy()[seg])
 
 
+class GateSummary(object):
+    """
+    Summary statistics of the landfall statistics of each gate, over a
+    collection of simulations. The statistics of each simulation are added
+    to running accumulators (and quantile sketches), so the memory used does
+    not depend on the number of simulations, and summaries of separate sets
+    of simulations can be merged.
+
+    The statistics are listed in `SUMMARY_STATS`. As with `numpy.nanmean`,
+    gates with no landfalls in a simulation (where the landfall intensity is
+    NaN) are excluded from the intensity statistics. Standard deviations use
+    one degree of freedom.
+
+    :param int ngates: Number of gates
+    :param int size: Size of the quantile sketches. Quantiles are exact for
+        up to 10 times this number of simulations.
+    """
+
+    def __init__(self, ngates, size=1000):
+        self.ngates = ngates
+        self.nsims = 0
+        self.stats = {key: RunningStats(ngates) for key in SUMMARY_STATS}
+        self.sketches = {key: [QuantileSketch(size) for _ in range(ngates)]
+                         for key, names in SUMMARY_STATS.items()
+                         if any(name in QUANTILES for name in names)}
+
+    def update(self, stats):
+        """
+        Add the statistics of a simulation.
+
+        :param dict stats: `numpy.array` of each statistic, with one value
+            for each gate (see `gateStatistics`)
+        """
+        self.nsims += 1
+        for key, accumulator in self.stats.items():
+            accumulator.update(stats[key])
+        for key, sketches in self.sketches.items():
+            for sketch, value in zip(sketches, stats[key]):
+                sketch.update([value])
+        return self
+
+    def merge(self, other):
+        """
+        Combine the summary of another set of simulations into this one.
+
+        :param other: :class:`GateSummary`
+        """
+        self.nsims += other.nsims
+        for key, accumulator in self.stats.items():
+            accumulator.merge(other.stats[key])
+        for key, sketches in self.sketches.items():
+            for sketch, othersketch in zip(sketches, other.sketches[key]):
+                sketch.merge(othersketch)
+        return self
+
+    def _quantile(self, key, prob):
+        return np.array([s.quantile(prob) if s.count else np.nan
+                         for s in self.sketches[key]])
+
+    def summary(self):
+        """
+        Summary statistics of each gate.
+
+        :returns: `pandas.DataFrame` with a column for each statistic of each
+            variable (e.g. "count_nanmean", "meanlfintensity_q90")
+        """
+        columns = {}
+        for key, names in SUMMARY_STATS.items():
+            accumulator = self.stats[key]
+            for name in names:
+                if name in QUANTILES:
+                    values = self._quantile(key, QUANTILES[name])
+                elif name == 'sum':
+                    values = accumulator.sum
+                elif name == 'nanmean':
+                    values = accumulator.nanmean
+                elif name == 'nanstd':
+                    values = accumulator.std(ddof=1)
+                else:
+                    values = getattr(accumulator, name)
+                columns[f"{key}_{name}"] = values
+        return pd.DataFrame(columns)
+
+
+def landfallStatistics(filelist, gates, processes=None):
+    """
+    Calculate the landfall statistics of a collection of simulations. The
+    simulations are processed by a pool of worker processes, and the
+    statistics of each are added to a :class:`GateSummary` as they are
+    returned.
 
+    :param list filelist: Paths to the TCRM-format track files
+    :param gates: `GeoPandas.GeoDataFrame` of gates
+    :param int processes: Number of worker processes. Default is to process
+        the simulations in this process.
 
+    :returns: :class:`GateSummary`
+    """
+    summary = GateSummary(len(gates))
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for stats in executor.map(simulationStatistics, filelist,
+                                      repeat(gates)):
+                summary.update(stats)
+    else:
+        for f in filelist:
+            print(f"Processing {f}")
+            summary.update(simulationStatistics(f, gates))
+    return summary
+
+
+def plotLandfall(gatedata, plotpath=PLOTPATH):
+    """
+    Plot the mean landfall rates and intensity at each gate.
+
+    :param gatedata: `GeoPandas.GeoDataFrame` of gate summary statistics
+    :param str plotpath: Path to save the figures to
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style('whitegrid')
+
+    width=0.4
+    fig, ax = plt.subplots(3,1,figsize=(12,16),sharex=True)
+    cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
+    cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
+    cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
+    ax[0].bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
+    ax[0].bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
+    ax[0].bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
+    ax[0].bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
+    ax[0].bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
+
+    ax[0].legend()
+    ax[0].set_ylabel("Mean number of TCs")
+    ax[1].plot(gatedata['gate'], gatedata['minlfintensity_nanmean'], label='Minimum landfall intensity')
+    ax[1].plot(gatedata['gate'], gatedata['meanlfintensity_nanmean'], color='r', label='Mean landfall intensity')
+    ax[1].fill_between(gatedata['gate'], gatedata['meanlfintensity_q10'],
+                       gatedata['meanlfintensity_q90'],color='r', alpha=0.25)
+
+    ax[1].legend(loc=2)
+    ax[1].set_ylim((900, 1020))
+    ax[1].set_ylabel("Pressure (hPa)")
+    ax[2].plot(gatedata['gate'], gatedata['count_sum']/100)
+    ax[2].fill_between(gatedata['gate'], gatedata['count_q90']/100, gatedata['count_q10']/100, alpha=0.25)
+    ax[2].set_xlim((0,48))
+    ax[2].set_xticks(np.arange(0,49,2))
+    ax[2].set_yticks(np.arange(0,0.25,.02))
+    ax[2].set_xticklabels(gatedata['label'][::2], rotation='vertical')
+    ax[2].set_ylabel("Mean proportion of landfall")
+    plt.show()
+
+    width=0.4
+    fig, ax = plt.subplots(1,1, figsize=(12,6), sharex=True)
+    cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
+    cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
+    cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
+    ax.bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
+    ax.bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
+    ax.bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
+    ax.bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
+    ax.bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
+
+
+
+    ax.legend()
+    ax.set_ylabel("Number of TCs")
+    ax.set_xlim((0,48))
+    ax.set_xticks(np.arange(0,49,2))
+    ax.set_yticks(np.arange(0,1,.2))
+    ax.set_xticklabels(gatedata['label'][::2], rotation='vertical')
+    ax.set_ylabel("Mean rate of landfall")
+    plt.savefig(os.path.join(plotpath, "mean_landfall_rate_intensity.png"), bbox_inches='tight')
+
+    width=0.4
+    fig, ax = plt.subplots(1,1, figsize=(12,6), sharex=True)
+    cat12 = np.add(gatedata['cat1_nanmean'], gatedata['cat2_nanmean']).tolist()
+    cat123 = np.add(cat12, gatedata['cat3_nanmean']).tolist()
+    cat1234 = np.add(cat123, gatedata['cat4_nanmean']).tolist()
+    ax.bar(gatedata['gate'], gatedata['cat1_nanmean'], color='b', label="Cat 1")
+    ax.bar(gatedata['gate'], gatedata['cat2_nanmean'], bottom=gatedata['cat1_nanmean'], color='g', label='Cat 2')
+    ax.bar(gatedata['gate'], gatedata['cat3_nanmean'], bottom=cat12, color='y', label='Cat 3')
+    ax.bar(gatedata['gate'], gatedata['cat4_nanmean'], bottom=cat123, color='orange', label='Cat 4')
+    ax.bar(gatedata['gate'], gatedata['cat5_nanmean'], bottom=cat1234, color='r', label='Cat 5')
+
+    ax.legend()
+    ax.set_ylabel("Number of TCs")
+    ax.set_xlim((0,48))
+    ax.set_xticks(np.arange(0,49,2))
+    #ax.set_yticks(np.arange(0,0.11,.02))
+    ax.set_xticklabels(gatedata['label'][::2], rotation='vertical')
+    ax.set_ylabel("Mean rate of landfall")
+    plt.savefig(os.path.join(plotpath, "mean_landfall_rate_intensity.png"), bbox_inches='tight')
+
+
+def main(datapath=DATAPATH, plotpath=PLOTPATH, gateFile=GATES_FILE,
+         processes=NCPUS):
+    gates = readGates(gateFile)
+    filelist = listTrackFiles(datapath)
+    nfiles = len(filelist)
+    print(f"There are {nfiles} track files")
+
+    # Now we determine the landfall rates for each simulation, and accumulate
+    # the summary statistics of each gate.
+    summary = landfallStatistics([pjoin(datapath, f) for f in filelist],
+                                 gates, processes)
+    gatedata = gates[['gate', 'longitude', 'latitude', 'label',
+                      'geometry']].join(summary.summary())
+
+    #gatedata = pd.read_csv("C:/WorkSpace/data/tcha/sim_landfall.csv")
+
+    plotLandfall(gatedata, plotpath)
+
+    gatedata.to_file(os.path.join(plotpath, "sim_landfall.shp"))
+
+    gatedata_nogeom = pd.DataFrame(gatedata.drop(columns='geometry'))
+    gatedata_nogeom.to_csv(os.path.join(plotpath,"sim_landfall.csv"), index=False)
+
+
+if __name__ == '__main__':
+    main()
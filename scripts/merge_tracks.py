@@ -3,16 +3,26 @@
 merge_tracks.py - merge (bias-corrected) TCLV track datasets into two groups
 
 The individual TCLV datasets are merged into two ensembles. The groups are
-hard-coded here, but could readily be updated as needed. 
+hard-coded here, but could readily be updated as needed.
+
+The input folder is scanned once, to build an index of the files for each
+group, emission scenario and time period. The ensembles are then written in
+parallel (set the number of processes with the `NCPUS` environment
+variable), each reading only its own files. Each member is appended to the
+output as it is read, as csv and an Arrow file that can be memory-mapped
+(see :func:`tclv.read_merged_tracks`).
 
 Author: Craig Arthur
 Date: 2022-11-30
 """
+import os
 from os.path import join as pjoin
-from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
+from tclv import TrackWriter, shift_years
+
 TIMES = ["1981-2010","2021-2040","2041-2060","2061-2080","2081-2100"]
 
 EMISSION_SCENARIOS = ["RCP45","RCP85"]
@@ -25,95 +35,168 @@ GROUPS = {
 INPUT_FOLDER = Path(r"X:\georisk\HaRIA_B_Wind\projects\qfes_swha\data\derived\TCLV\tracks\corrected\20211124")
 OUTPUT_FOLDER = Path(r"X:\georisk\HaRIA_B_Wind\projects\qfes_swha\data\derived\TCLV\tracks\ensemble\20211124")
 
+NCPUS = int(os.environ.get('NCPUS', 1))
+
+# Output formats for the merged ensembles:
+FORMATS = ['csv', 'feather']
+
+
+def parse_name(f):
+    """
+    Extract the ensemble member, emission scenario and time period from the
+    name of a corrected track file (e.g. "ACCESS1-0Q_RCP45_2021-2040.csv").
+    Files of the bias-corrected reference period ("..._bc_...") belong to
+    the first time period.
+
+    :param f: `str` or `Path` object representing the file
+
+    :returns: tuple of (member, emission scenario, time period), or `None`
+    if the name does not have the correct structure
+    """
+    try:
+        g, es, t, *_ = Path(f).stem.split('_')
+    except ValueError as verr:
+        # Handle case of a path listing that's not a file of the correct
+        # name structure
+        print(verr)
+        return None
+    if t == 'bc':
+        t = TIMES[0]
+    return g, es, t
+
 
 def belongs(group, emission_scenario, time, f):
     """
     Determine if a given file name matches the required group, emission scenario
     and time period combination.
 
-    :param list group: List of ensemble member names
+    :param str group: Name of the group (a key of `GROUPS`)
     :param str emission_scenario: Either "RCP45" or "RCP85"
     :param str time: A string like "2021-2040"
     :param f: `str` or `Path` object representing the file
 
     :returns: :class:`bool` - True if it matches, False otherwise
     """
-    try:
-        g, es, t, *_ = f.stem.split('_')
-    except ValueError as verr:
-        # Handle case of a path listing that's not a file of the correct
-        # name structure
-        print(verr)
+    parts = parse_name(f)
+    if parts is None:
         return False
+    g, es, t = parts
+    return g in GROUPS[group] and es == emission_scenario and t == time
 
-    if g not in GROUPS[group]:
-        return False
-    if es != emission_scenario:
-        return False
-    if t == 'bc':
-        return time == TIMES[0]
-    return t == time
 
+def build_index(folder=INPUT_FOLDER):
+    """
+    Scan the input folder once, and assign each file to a group, emission
+    scenario and time period.
+
+    The files for each ensemble are ordered by the position of the member in
+    the group (then by file name), so the year offsets applied when merging
+    do not depend on the order of the directory listing.
 
-def find_missing():
+    :param folder: `Path` of the folder of corrected track files
+
+    :returns: :class:`dict` of lists of files, keyed by (group, emission
+    scenario, time period), and a list of the files that do not belong to any
+    ensemble
     """
-    Redundant function
+    members = {m: (group, i) for group, names in GROUPS.items()
+               for i, m in enumerate(names)}
+    index = {(group, es, t): [] for group in GROUPS
+             for es in EMISSION_SCENARIOS for t in TIMES}
+    unmatched = []
+    for f in Path(folder).iterdir():
+        parts = parse_name(f)
+        if parts is None or parts[0] not in members:
+            unmatched.append(f)
+            continue
+        g, es, t = parts
+        group, position = members[g]
+        if (group, es, t) not in index:
+            unmatched.append(f)
+            continue
+        index[(group, es, t)].append((position, f.name, f))
+    index = {key: [f for *_, f in sorted(files)]
+             for key, files in index.items()}
+    return index, sorted(unmatched)
+
+
+def find_missing(folder=INPUT_FOLDER):
     """
-    for f in INPUT_FOLDER.iterdir():
-        found = False
-
-        for group in GROUPS:
-            for emission_scenario in EMISSION_SCENARIOS:
-                for time in TIMES:
-                    if belongs(GROUPS[group], emission_scenario, time, f):
-                        found = True
-        
-        if not found:
-            print(f)
+    Print the files in the input folder that do not belong to any ensemble.
+    """
+    _, unmatched = build_index(folder)
+    for f in unmatched:
+        print(f)
 
 
-def merge_tracks(group, emission_scenario, time):
+def merge_tracks(group, emission_scenario, time, files=None,
+                 output_folder=OUTPUT_FOLDER, formats=FORMATS):
     """
     Given a list of ensemble members, the emission scenario and the time period,
-    merge all the relevant files into a single file. The function loops over all
-    files in the `INPUT_FOLDER`, evaluates if it belongs to the group based on
-    the list of members, emission scenario and time period (this info is
-    contained in the file name). If it belongs in the ensemble, then it reads
-    the data, does some manipulation of the dates and finally writes the full
-    ensemble to a csv file. 
-
-    :param list group: List of ensemble member names
+    merge all the relevant files into a single file. Each member is offset
+    in time by a whole number of periods (in the order of the files), so the
+    members form a continuous sequence of years. Each member is appended to
+    the output files as it is read, so only one member is held in memory.
+
+    :param str group: Name of the group (a key of `GROUPS`)
     :param str emission_scenario: Either "RCP45" or "RCP85"
     :param str time: A string like "2021-2040"
+    :param list files: Files to merge, from :func:`build_index`. Default is
+    to scan the input folder.
+    :param output_folder: Folder to write the ensemble to
+    :param list formats: Output formats ("csv" and/or "feather")
+
+    :returns: :class:`dict` of the output files, keyed by format
     """
+    if files is None:
+        index, _ = build_index()
+        files = index[(group, emission_scenario, time)]
 
-    output_file = '{}_{}_{}.dat'.format(group, emission_scenario, time)
-    HEADER = None
+    if not files:
+        print(f"No files for {group} {emission_scenario} {time}")
+        return None
+
+    output_file = '{}_{}_{}'.format(group, emission_scenario, time)
 
     start_time, end_time = time.split('-')
     inc = int(end_time) - int(start_time) + 1
     timeinc = 0
-    start_time = datetime(int(start_time), 1, 1)
-    end_time = datetime(int(end_time) + 1, 1, 1)
-
-    # Empty list to store the dataframes as they are loaded
-    alltracks = []
 
-    for f in INPUT_FOLDER.iterdir():
-        if belongs(group, emission_scenario, time, f):
+    with TrackWriter(pjoin(output_folder, output_file), formats) as writer:
+        for f in files:
             df = pd.read_csv(f)
-            df['datetime'] = pd.to_datetime(df.datetime) + pd.offsets.DateOffset(years=timeinc)
+            df['datetime'] = shift_years(
+                pd.to_datetime(df['datetime']).to_numpy(), timeinc)
             df['year'] += timeinc
-            alltracks.append(df)
+            writer.write(df)
             timeinc += inc
-        else:
-            pass
+    return writer.filenames
+
+
+def merge_all(folder=INPUT_FOLDER, output_folder=OUTPUT_FOLDER,
+              processes=None, formats=FORMATS):
+    """
+    Merge the files for every group, emission scenario and time period.
+    The input folder is scanned once, and each ensemble is written by a
+    separate worker process.
+
+    :param folder: `Path` of the folder of corrected track files
+    :param output_folder: Folder to write the ensembles to
+    :param int processes: Number of worker processes. Default is to merge
+    the ensembles sequentially.
+    :param list formats: Output formats ("csv" and/or "feather")
+
+    :returns: list of the output files of each ensemble (see
+    :func:`merge_tracks`)
+    """
+    index, _ = build_index(folder)
+    jobs = [(group, es, t, files, output_folder, formats)
+            for (group, es, t), files in index.items()]
+    if processes and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(merge_tracks, *zip(*jobs)))
+    return [merge_tracks(*job) for job in jobs]
 
-    outdf = pd.concat(alltracks)
-    outdf.to_csv(pjoin(OUTPUT_FOLDER, output_file),index=False)
 
 if __name__ == '__main__':
-    for group in GROUPS:
-        for emission_scenario in EMISSION_SCENARIOS:
-            for time in TIMES:
-                merge_tracks(group, emission_scenario, time)
+    merge_all(processes=NCPUS)
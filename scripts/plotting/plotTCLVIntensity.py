@@ -11,9 +11,6 @@ import datetime as dt
 
 from datetime import timedelta, datetime
 
-from shapely.geometry import box as sbox
-from shapely.geometry import LineString
-
 import scipy.stats as stats
 
 from builtins import str
@@ -22,6 +19,11 @@ from git import Repo
 
 import seaborn as sns
 
+# The shared TCLV functions are in the parent `scripts` directory
+sys.path.insert(0, pjoin(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tclv import load_track_file, calculate_max_wind
+from distfit import fit_table, stack_models
+
 
 r = Repo('')
 commit = str(r.commit('HEAD'))
@@ -49,67 +51,6 @@ catpal = sns.blend_palette([(0.000, 0.627, 0.235), (0.412, 0.627, 0.235),
                             (0.925, 0.643, 0.016), (0.835, 0.314, 0.118),
                             (0.780, 0.086, 0.118)], 6)
 
-def load_track_file(filename):
-    """
-    Load a TCLV file into a :class:`pandas.DataFrame`, and add a field 
-    representing the age of each TCLV in hours, and the pressure difference.
-    
-    :param str filename: Path to a TCLV data file
-    
-    :returns: :class:`pandas.DataFrame`
-    """
-    # This assumes the format of the TCLV files is identical
-    columns = ['num', 'year', 'month', 'day', 'hour', 'lon', 'lat',
-               'pmin', 'vorticity', 'vmax', 'tanomsum','tanomdiff',
-               'pmslanom', 'poci', 'reff','ravg','asym']
-
-    LOGGER.info(f"Loading TCLV data from {filename}")
-    try:
-        df = pd.read_csv(filename, delimiter=' ', skipinitialspace=True,
-                         names=columns, parse_dates={'datetime':[1,2,3,4]},
-                         keep_date_col=True, 
-                         dtype={'year':int, 'month':int, 'day':int})
-    except:
-        LOGGER.exception(f"Failed to load {filename}")
-        raise
-    df['dt'] = df.groupby('num')['datetime'].apply(lambda x: x.diff())
-    df['dt'] = df['dt'].transform(lambda x: x.total_seconds())
-
-    df['age'] = df.groupby('num')['dt'].apply(np.cumsum).fillna(0)/3600.
-    # Throw in the pressure deficit for good measure:
-    df['pdiff'] = df['poci'] - df['pmin']
-
-    # And normalised intensity. This is the intensity at any given time,
-    # dividied by the lifetime maximum intensity for each unique event
-    df['ni'] = df.pdiff / df.groupby('num').pdiff.transform(np.max)
-    return df
-
-def filter_tracks_domain(df, minlon=90, maxlon=180, minlat=-40, maxlat=0):
-    """
-    Takes a `DataFrame` and filters on the basis of whether the track interscts
-    the given domain, which is specified by the minimum and maximum longitude and 
-    latitude.
-    
-    NOTE: This assumes the tracks and bounding box are in the same geographic 
-    coordinate system (i.e. generally a latitude-longitude coordinate system). 
-    It will NOT support different projections (e.g. UTM data for the bounds and
-    geographic for the tracks).
-    
-    NOTE: This doesn't work if there is only one point for the track. 
-    
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param float minlon: minimum longitude of the bounding box
-    :param float minlat: minimum latitude of the bounding box
-    :param float maxlon: maximum longitude of the bounding box
-    :param float maxlat: maximum latitude of the bounding box
-    """
-
-    domain = sbox(minlon, minlat, maxlon, maxlat, ccw=False)
-    tracks = df.groupby('num')
-    tempfilter = tracks.filter(lambda x: len(x) > 1)
-    filterdf = tempfilter.groupby('num').filter(lambda x: LineString(zip(x['lon'], x['lat'])).intersects(domain))
-    return filterdf
-
 def calculateMaxWind(df, dtname='ISO_TIME'):
     """
     Calculate a maximum gust wind speed based on the central pressure deficit and the 
@@ -120,15 +61,7 @@ def calculateMaxWind(df, dtname='ISO_TIME'):
     This returns a `DataFrame` with an additional column (`vmax`), which represents an estimated
     0.2 second maximum gust wind speed.
     """
-
-    idx = df.num.values
-    varidx = np.ones(len(idx))
-    varidx[1:][idx[1:]==idx[:-1]] = 0
-    
-    dt = (df[dtname] - df[dtname].shift()).fillna(pd.Timedelta(seconds=0)).apply(lambda x: x / np.timedelta64(1,'h')).astype('int64') % (24*60)
-    df['vmax'] = maxWindSpeed(varidx, dt.values, df.lon.values, df.lat.values,
-                              df.pmin.values, df.poci.values, gustfactor=1.223)
-    return df
+    return calculate_max_wind(df, dtname, gustfactor=1.223)
     
 def calculateFitParams(datadict, dist=stats.lognorm):
     """
@@ -145,12 +78,5 @@ def calculateFitParams(datadict, dist=stats.lognorm):
 
     """
 
-    params = pd.DataFrame(columns=['Model', 'RCP', 'mu', 'sigma', 'zeta'])
-    for m, df in datadict.items():
-        model, rcp = m.split(' ')
-        popt = dist.fit(df.pdiff, loc=0, scale=1)
-        params = params.append({'Model':model, 'RCP':rcp,
-                                'mu':popt[0], 'sigma':popt[1],
-                                'zeta':popt[2]},
-                               ignore_index=True)
-    return params
+    return fit_table(stack_models(datadict), by=['Model', 'RCP'],
+                     dist=dist, loc=0, scale=1)
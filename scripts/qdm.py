@@ -17,14 +17,26 @@ future climate regimes. Called Quantile Delta Mapping (QDM), the method ensures
 that climate sensitivity of the underlying climate model remains unaffected by
 the correction process.
 
-This is a Python wrapper for the QDM function in the `MBC` package for R, see
-https://rdrr.io/cran/MBC/man/MBC-package.html for details on the `MBC` package.
+This module provides a native NumPy implementation of the QDM function in the
+`MBC` package for R (see https://rdrr.io/cran/MBC/man/MBC-package.html for
+details on the `MBC` package), and a wrapper for the R function itself. The
+NumPy implementation is used by default. The R implementation can be selected
+with `engine='r'`, e.g. to validate the two against each other.
+
+:func:`qdm_batch` corrects a collection of ensemble members in a single pass,
+and :func:`bootstrap_qdm` uses it to estimate confidence intervals for the
+quantiles of the corrected data.
+
+For very large samples, :func:`qdm_empirical` uses fixed-size quantile
+tables (e.g. 1000 knots), estimated with :mod:`streamstats` sketches, so the
+cost of the mapping is linear in the number of values and the memory used is
+bounded. The tables can be built from chunks of data with
+:func:`qdm_tables`, and applied to chunks with :func:`qdm_apply`.
 
 Dependencies::
 
-* `rpy2`
-* `MBC`
 * `numpy`
+* `rpy2` and `MBC` (only for `engine='r'`)
 
 Cannon, A.J., Sobie, S.R., and Murdock, T.Q. 2015. Bias correction of simulated
 precipitation by quantile mapping: How well do methods preserve relative changes
@@ -33,19 +45,214 @@ doi:10.1175/JCLI-D-14-00754.1
 
 """
 
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import rpy2.robjects as ro
-from rpy2.robjects.packages import importr
+import pandas as pd
+
+from streamstats import QuantileSketch, chunks
+
+# The R interface and the MBC package are loaded on first use:
+_MBC = None
+
+
+def _mbc():
+    """
+    Return the R `MBC` package, starting the embedded R interpreter the first
+    time it is called.
+    """
+    global _MBC
+    if _MBC is None:
+        from rpy2.robjects.packages import importr
+        from rpy2.robjects import numpy2ri
+        numpy2ri.activate()
+        _MBC = importr("MBC")
+    return _MBC
 
-from rpy2.robjects import numpy2ri
-numpy2ri.activate()
 
-# Use the R implementation of QDM provided by the MBC package
-MBC = importr("MBC")
+def _approx(x, y, xout):
+    """
+    Linear interpolation equivalent to R's `approx(x, y, xout, rule=2,
+    ties='first')`: values outside the range of `x` take the value at the
+    nearest end, and only the first of a set of tied `x` values is used.
+    """
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:] = x[1:] != x[:-1]
+    return np.interp(xout, x[keep], y[keep])
+
+
+def _jitter(x, factor, rng):
+    """
+    Add a small amount of uniform noise to `x`, following R's `jitter`.
+    """
+    lo, hi = x.min(), x.max()
+    z = (hi - lo) or abs(lo) or 1.
+    xx = np.unique(np.round(x, int(3 - np.floor(np.log10(z)))))
+    d = np.diff(xx)
+    if len(d):
+        d = d.min()
+    elif xx[0] != 0:
+        d = xx[0] / 10
+    else:
+        d = z / 10
+    amount = factor / 5 * abs(d)
+    return x + rng.uniform(-amount, amount, len(x))
+
+
+def _tau(ntau):
+    """
+    Probabilities for `ntau` quantiles, evenly spaced over [0, 1]. This is
+    `seq(0, 1, length=ntau)` in R, for one or more numbers of quantiles.
+
+    :param ntau: `numpy.array` with the number of quantiles for each group
+
+    :returns: tuple of `numpy.array` of the probabilities, and the group
+        each belongs to
+    """
+    ntau = np.atleast_1d(ntau)
+    group = np.repeat(np.arange(len(ntau)), ntau)
+    offsets = np.r_[0, np.cumsum(ntau)]
+    pos = np.arange(offsets[-1]) - offsets[group]
+    tau = pos * (1. / np.maximum(ntau - 1, 1))[group]
+    tau[offsets[1:][ntau > 1] - 1] = 1.
+    return tau, group
+
+
+def _group_quantiles(values, offsets, tau, group):
+    """
+    Empirical quantiles of groups of values, calculated in the same way as
+    R's `quantile(x, tau, type=7)`.
+
+    :param values: `numpy.array` of values, sorted within each group
+    :param offsets: `numpy.array` of the start of each group in `values`,
+        with the total length as the last element
+    :param tau: `numpy.array` of probabilities
+    :param group: `numpy.array` of the group for each element of `tau`
+    """
+    n = np.diff(offsets)[group]
+    h = (n - 1) * tau
+    lo = np.floor(h).astype(int)
+    hi = np.ceil(h).astype(int)
+    base = offsets[group]
+    qs = values[base + lo]
+    xhi = values[base + hi]
+    interp = (h > lo) & (xhi != qs)
+    frac = (h - lo)[interp]
+    qs[interp] = (1 - frac) * qs[interp] + frac * xhi[interp]
+    return qs
+
+
+def _quantile(x, tau):
+    """Empirical (type 7) quantiles of `x`, see :func:`_group_quantiles`"""
+    return _group_quantiles(np.sort(x), np.array([0, len(x)]), tau,
+                            np.zeros(len(tau), dtype=int))
+
+
+def qdm_numpy(obs, ref, fut, ratio=True, trace=0.1, n_tau=None,
+              jitter_factor=0, ratio_max=2, seed=None):
+    """
+    Quantile delta mapping, following the `QDM` function in the R `MBC`
+    package (with the default values of the remaining arguments of that
+    function, and empirical quantiles calculated with the same (type 7)
+    definition).
+
+    As in `MBC.QDM`, random numbers are used to jitter the data if any of the
+    inputs has only a single unique value, and (for ratio variables) to
+    replace values less than half the trace value. Pass `seed` for
+    reproducible results in those cases.
 
+    :param obs: `numpy.array` of observed values
+    :param ref: `numpy.array` of reference period values (simulated)
+    :param fut: `numpy.array` of future period values (simulated)
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int n_tau: Number of quantiles; `None` equals the length of `fut`
+    :param float jitter_factor: Jitter added to the data to break ties
+    :param float ratio_max: Maximum relative change in the quantiles, applied
+        where the reference quantile is less than 10 times `trace`
+    :param seed: Seed or :class:`numpy.random.Generator` for the random
+        numbers
 
-def qdm(obs, ref, fut, ratio=True, trace=0.1, n=None):
+    :returns: tuple of `numpy.array` (`mhatc`, `mhatp`), the bias corrected
+        reference and future values
     """
+    rng = np.random.default_rng(seed)
+    o_c = np.array(obs, dtype=float)
+    m_c = np.array(ref, dtype=float)
+    m_p = np.array(fut, dtype=float)
+
+    # Add a small amount of random noise to break ties
+    if jitter_factor == 0 and (len(np.unique(o_c)) == 1 or
+                               len(np.unique(m_c)) == 1 or
+                               len(np.unique(m_p)) == 1):
+        jitter_factor = np.sqrt(np.finfo(float).eps)
+    if jitter_factor > 0:
+        o_c = _jitter(o_c, jitter_factor, rng)
+        m_c = _jitter(m_c, jitter_factor, rng)
+        m_p = _jitter(m_p, jitter_factor, rng)
+
+    # For ratio data, treat exact zeros as left censored values less than
+    # half the trace value
+    if ratio:
+        trace_calc = 0.5 * trace
+        eps = np.finfo(float).eps
+        for x in (o_c, m_c, m_p):
+            low = x < trace_calc
+            x[low] = rng.uniform(eps, trace_calc, low.sum())
+
+    if n_tau is None:
+        n_tau = len(m_p)
+    tau, _ = _tau(n_tau)
+    quant_o_c = _quantile(o_c, tau)
+    quant_m_c = _quantile(m_c, tau)
+    quant_m_p = _quantile(m_p, tau)
+
+    # Apply the quantile delta mapping bias correction
+    tau_m_p = _approx(quant_m_p, tau, m_p)
+    ref_m_p = _approx(tau, quant_m_c, tau_m_p)
+    if ratio:
+        delta_m = m_p / ref_m_p
+        delta_m[(delta_m > ratio_max) &
+                (ref_m_p < 10 * trace)] = ratio_max
+        mhat_p = _approx(tau, quant_o_c, tau_m_p) * delta_m
+    else:
+        delta_m = m_p - ref_m_p
+        mhat_p = _approx(tau, quant_o_c, tau_m_p) + delta_m
+    mhat_c = _approx(quant_m_c, quant_o_c, m_c)
+
+    # For ratio data, set values less than trace to zero
+    if ratio:
+        mhat_c[mhat_c < trace] = 0
+        mhat_p[mhat_p < trace] = 0
+    return mhat_c, mhat_p
+
+
+def qdm_r(obs, ref, fut, ratio=True, trace=0.1, n_tau=None):
+    """
+    Quantile delta mapping, using the `QDM` function in the R `MBC` package.
+
+    :param obs: `numpy.array` of observed values
+    :param ref: `numpy.array` of reference period values (simulated)
+    :param fut: `numpy.array` of future period values (simulated)
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int n_tau: Number of quantiles; `None` equals the length of `fut`
+
+    :returns: tuple of `numpy.array` (`mhatc`, `mhatp`)
+    """
+    if n_tau is None:
+        n_tau = len(fut)
+    mhatc, mhatp = _mbc().QDM(np.asarray(obs), np.asarray(ref),
+                              np.asarray(fut), ratio, trace, n_tau=n_tau)
+    return np.array(mhatc), np.array(mhatp)
+
+
+def qdm(obs, ref, fut, ratio=True, trace=0.1, n=None, engine="numpy"):
+    r"""
     Calculate the quantile delta mapping for a collection of simulated data. 
 
     This function is based on the formulation described in Cannon _et al._
@@ -80,9 +287,13 @@ def qdm(obs, ref, fut, ratio=True, trace=0.1, n=None):
     zeros.
     :param int n: Number of quantiles used in the quantile mapping; `None`
     equals the length of the `fut` series.
+    :param str engine: "numpy" (default) to use :func:`qdm_numpy`, "r" to
+    use the `QDM` function in the R `MBC` package, or "empirical" to use
+    :func:`qdm_empirical` (with `n` knots in the quantile tables, default
+    1000).
 
-
-    :returns: `mhatp` a `numpy.array` of bias corrected future values.
+    :returns: `mhatc`, `mhatp` - `numpy.array` of bias corrected reference
+    and future values.
 
     """
 
@@ -100,11 +311,457 @@ def qdm(obs, ref, fut, ratio=True, trace=0.1, n=None):
     if any(np.isnan(fut)):
         raise ValueError("Input future array contains NaN values")
 
+    if engine == "empirical":
+        return qdm_empirical(obs, ref, fut, ratio, trace, nknots=n or 1000)
+
     if n:
         n_tau = n
     else:
         n_tau = len(fut)
 
-    mhatc, mhatp = MBC.QDM(obs, ref, fut, ratio, trace, n_tau=n_tau)
+    if engine == "numpy":
+        return qdm_numpy(obs, ref, fut, ratio, trace, n_tau=n_tau)
+    elif engine == "r":
+        return qdm_r(obs, ref, fut, ratio, trace, n_tau=n_tau)
+    else:
+        raise ValueError(f"Unknown QDM engine: {engine}")
 
-    return np.array(mhatc), np.array(mhatp)
+
+def _grouped_approx(x, y, xgroup, xout, outgroup):
+    """
+    Apply :func:`_approx` to many groups of values at once. `x` must be
+    sorted within each group, and the groups contiguous and in order.
+
+    The interpolation interval for each value of `xout` is found with a
+    single `np.searchsorted` call over complex keys (group + 1j * value):
+    numpy orders complex numbers by the real then the imaginary part, so the
+    keys sort by group and then by value, with no loss of precision. The
+    values are then interpolated in the same way as `np.interp`.
+    """
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:] = (x[1:] != x[:-1]) | (xgroup[1:] != xgroup[:-1])
+    x, y, xgroup = x[keep], y[keep], xgroup[keep]
+
+    # First and last points of each group:
+    starts = np.flatnonzero(np.r_[True, xgroup[1:] != xgroup[:-1]])
+    ends = np.r_[starts[1:], len(x)] - 1
+    first = np.zeros(xgroup[-1] + 1, dtype=int)
+    last = np.zeros(xgroup[-1] + 1, dtype=int)
+    first[xgroup[starts]] = starts
+    last[xgroup[starts]] = ends
+
+    # Index of the last point in `x` (in the same group) that is less than
+    # or equal to each value of `xout`:
+    key = xgroup + 1j * x
+    j = np.searchsorted(key, outgroup + 1j * xout, side='right') - 1
+    lo, hi = first[outgroup], last[outgroup]
+    below = j < lo
+    j = np.clip(j, lo, hi)
+
+    jr = np.minimum(j + 1, hi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y[jr] - y[j]) / (x[jr] - x[j])
+        result = slope * (xout - x[j]) + y[j]
+    atend = (j == hi) | below
+    result[atend] = y[j[atend]]
+    return result
+
+
+def qdm_batch(obs, members, ratio=True, trace=0.1, n=None, seed=None):
+    """
+    Quantile delta mapping for a collection of ensemble members, with a
+    shared set of observations. All members are corrected together in single
+    vectorised operations over the concatenated (ragged) data, and give the
+    same result as calling :func:`qdm_numpy` for each member.
+
+    The random numbers used for ratio values less than half the trace value
+    are drawn once for the shared observations, rather than once for each
+    member. Members with a single unique value are jittered (see
+    :func:`qdm_numpy`), but the observations are only jittered if they have
+    a single unique value, so the results for those members are not
+    identical to :func:`qdm_numpy`.
+
+    :param obs: `numpy.array` of observed values
+    :param dict members: Ensemble members, with values of (`ref`, `fut`)
+        tuples of `numpy.array` of the reference and future period values.
+        The members can have different numbers of values.
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int n: Number of quantiles; `None` equals the length of `fut`
+        for each member
+    :param seed: Seed or :class:`numpy.random.Generator` for the random
+        numbers
+
+    :returns: :class:`pandas.DataFrame` with a row for each input value, with
+        the member (`member`), the period (`period`, either "ref" or "fut"),
+        the position of the value in the input array (`index`), the input
+        value (`value`) and the corrected value (`corrected`)
+    """
+    rng = np.random.default_rng(seed)
+    keys = list(members)
+    if not keys:
+        raise ValueError("No ensemble members to correct")
+    o_c = np.array(obs, dtype=float)
+    refs = [np.array(members[k][0], dtype=float) for k in keys]
+    futs = [np.array(members[k][1], dtype=float) for k in keys]
+    for k, ref, fut in zip(keys, refs, futs):
+        if len(ref) == 0 or len(fut) == 0:
+            raise ValueError(f"No data for ensemble member {k}")
+        if np.isnan(ref).any() or np.isnan(fut).any():
+            raise ValueError(f"Input data for {k} contains NaN values")
+    if np.isnan(o_c).any():
+        raise ValueError("Input observation array contains NaN values")
+    m_c_in, m_p_in = np.concatenate(refs), np.concatenate(futs)
+
+    # Add a small amount of random noise to break ties, for any member with
+    # a single unique value:
+    jitter_factor = np.sqrt(np.finfo(float).eps)
+    obstied = len(np.unique(o_c)) == 1
+    if obstied:
+        o_c = _jitter(o_c, jitter_factor, rng)
+    for i in range(len(keys)):
+        if (obstied or len(np.unique(refs[i])) == 1 or
+                len(np.unique(futs[i])) == 1):
+            refs[i] = _jitter(refs[i], jitter_factor, rng)
+            futs[i] = _jitter(futs[i], jitter_factor, rng)
+
+    nref = np.array([len(x) for x in refs])
+    nfut = np.array([len(x) for x in futs])
+    ngroups = len(keys)
+    m_c = np.concatenate(refs)
+    m_p = np.concatenate(futs)
+    gc = np.repeat(np.arange(ngroups), nref)
+    gp = np.repeat(np.arange(ngroups), nfut)
+
+    if ratio:
+        trace_calc = 0.5 * trace
+        eps = np.finfo(float).eps
+        for x in (o_c, m_c, m_p):
+            low = x < trace_calc
+            x[low] = rng.uniform(eps, trace_calc, low.sum())
+
+    # The values are sorted within each member. The mapping is calculated
+    # in this order (where the searches for the interpolation intervals are
+    # much faster), then returned to the original order at the end.
+    order_c = np.argsort(gc + 1j * m_c)
+    order_p = np.argsort(gp + 1j * m_p)
+    m_c, m_p = m_c[order_c], m_p[order_p]
+
+    # Probabilities for the quantiles of each member:
+    tau, gt = _tau(nfut if n is None else np.full(ngroups, n))
+    coffsets = np.r_[0, np.cumsum(nref)]
+    poffsets = np.r_[0, np.cumsum(nfut)]
+    quant_o_c = _quantile(o_c, tau)
+    quant_m_c = _group_quantiles(m_c, coffsets, tau, gt)
+    quant_m_p = _group_quantiles(m_p, poffsets, tau, gt)
+
+    # Apply the quantile delta mapping bias correction
+    tau_m_p = _grouped_approx(quant_m_p, tau, gt, m_p, gp)
+    ref_m_p = _grouped_approx(tau, quant_m_c, gt, tau_m_p, gp)
+    obs_m_p = _grouped_approx(tau, quant_o_c, gt, tau_m_p, gp)
+    if ratio:
+        delta_m = m_p / ref_m_p
+        delta_m[(delta_m > 2) & (ref_m_p < 10 * trace)] = 2
+        mhat_p = obs_m_p * delta_m
+    else:
+        mhat_p = obs_m_p + (m_p - ref_m_p)
+    mhat_c = _grouped_approx(quant_m_c, quant_o_c, gt, m_c, gc)
+
+    if ratio:
+        mhat_c[mhat_c < trace] = 0
+        mhat_p[mhat_p < trace] = 0
+    mhat_c[order_c] = mhat_c.copy()
+    mhat_p[order_p] = mhat_p.copy()
+
+    labels = pd.Index(keys, dtype=object, tupleize_cols=False)
+    return pd.DataFrame({
+        'member': pd.Categorical.from_codes(np.r_[gc, gp], labels),
+        'period': pd.Categorical.from_codes(
+            np.repeat([0, 1], [len(m_c), len(m_p)]), ['ref', 'fut']),
+        'index': np.r_[np.arange(len(m_c)) - coffsets[gc],
+                       np.arange(len(m_p)) - poffsets[gp]],
+        'value': np.r_[m_c_in, m_p_in],
+        'corrected': np.r_[mhat_c, mhat_p]})
+
+
+def _member_quantiles(values, codes, nmembers, probs):
+    """
+    Empirical (type 7) quantiles of the values of each member.
+
+    :param values: `numpy.array` of values
+    :param codes: `numpy.array` of the member (0 to `nmembers` - 1) of each
+        value
+
+    :returns: `numpy.array` with shape (members, quantiles)
+    """
+    order = np.lexsort((values, codes))
+    offsets = np.r_[0, np.cumsum(np.bincount(codes, minlength=nmembers))]
+    tau = np.tile(probs, nmembers)
+    group = np.repeat(np.arange(nmembers), len(probs))
+    qs = _group_quantiles(values[order], offsets, tau, group)
+    return qs.reshape(nmembers, len(probs))
+
+
+def _summarise(obs, members, probs, ratio, trace, n, rng):
+    """
+    Quantiles of the corrected future values, and the relative (or absolute)
+    change in the quantiles between the reference and future periods, for
+    each member.
+
+    :returns: tuple of two `numpy.array` with shape (members, quantiles)
+    """
+    nmembers = len(members)
+    df = qdm_batch(obs, members, ratio=ratio, trace=trace, n=n, seed=rng)
+    fut = (df['period'] == 'fut').to_numpy()
+    codes = df['member'].cat.codes.to_numpy()
+    values = df['value'].to_numpy()
+    corrected = _member_quantiles(df['corrected'].to_numpy()[fut],
+                                  codes[fut], nmembers, probs)
+    qref = _member_quantiles(values[~fut], codes[~fut], nmembers, probs)
+    qfut = _member_quantiles(values[fut], codes[fut], nmembers, probs)
+    if ratio:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = qfut / qref
+    else:
+        delta = qfut - qref
+    return corrected, delta
+
+
+def _bootstrap_replicates(obs, members, seeds, probs, ratio, trace, n):
+    """
+    Run a set of bootstrap replicates. Each replicate resamples (with
+    replacement) the observations and the reference and future values of
+    each member, using its own random number stream.
+
+    :param list seeds: :class:`numpy.random.SeedSequence` for each replicate
+
+    :returns: tuple of two `numpy.array` with shape
+        (replicates, members, quantiles)
+    """
+    corrected = np.empty((len(seeds), len(members), len(probs)))
+    delta = np.empty_like(corrected)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        bobs = rng.choice(obs, len(obs))
+        bmembers = {k: (rng.choice(ref, len(ref)), rng.choice(fut, len(fut)))
+                    for k, (ref, fut) in members.items()}
+        corrected[i], delta[i] = _summarise(bobs, bmembers, probs, ratio,
+                                            trace, n, rng)
+    return corrected, delta
+
+
+def bootstrap_qdm(obs, members, nboot=1000, probs=None, ci=0.9, ratio=True,
+                  trace=0.1, n=None, seed=None, processes=None):
+    """
+    Bootstrap confidence intervals for the quantiles of QDM corrected data.
+
+    Each replicate resamples the observations and the reference and future
+    values of each member, then corrects all members with
+    :func:`qdm_batch`. The replicates are split between a pool of worker
+    processes. Each replicate has an independent random number stream
+    (spawned from `seed`), so the results do not depend on the number of
+    processes.
+
+    :param obs: `numpy.array` of observed values
+    :param dict members: Ensemble members, with values of (`ref`, `fut`)
+        tuples of `numpy.array` of the reference and future period values
+    :param int nboot: Number of bootstrap replicates
+    :param probs: Probabilities of the quantiles to report. Default is
+        0.05, 0.1, ..., 0.95
+    :param float ci: Width of the (percentile) confidence interval
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int n: Number of quantiles used in the mapping; `None` equals the
+        length of `fut` for each member
+    :param int seed: Seed for the random numbers
+    :param int processes: Number of worker processes. Default is to run the
+        replicates in this process.
+
+    :returns: :class:`pandas.DataFrame` with a row for each member, statistic
+        and quantile. The statistic (`stat`) is either "corrected" (the
+        quantile of the corrected future values) or "delta" (the ratio of
+        the future and reference quantiles of the simulated data, or the
+        difference if `ratio` is False). The `estimate` is calculated from
+        the full data, and `lower` and `upper` are the limits of the
+        confidence interval.
+    """
+    if probs is None:
+        probs = np.linspace(0.05, 0.95, 19)
+    probs = np.asarray(probs, dtype=float)
+    if nboot < 1:
+        raise ValueError("Number of bootstrap replicates must be positive")
+    if not 0 < ci < 1:
+        raise ValueError("Confidence interval must be between 0 and 1")
+    obs = np.asarray(obs, dtype=float)
+    members = {k: (np.asarray(ref, dtype=float), np.asarray(fut, dtype=float))
+               for k, (ref, fut) in members.items()}
+
+    ss = np.random.SeedSequence(seed)
+    estimate = _summarise(obs, members, probs, ratio, trace, n,
+                          np.random.default_rng(ss.spawn(1)[0]))
+    seeds = ss.spawn(nboot)
+    args = (probs, ratio, trace, n)
+    if processes and processes > 1:
+        chunks = [c for c in np.array_split(np.arange(nboot), processes)
+                  if len(c)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_bootstrap_replicates, obs, members,
+                                       [seeds[i] for i in chunk], *args)
+                       for chunk in chunks]
+            results = [f.result() for f in futures]
+        corrected = np.concatenate([r[0] for r in results])
+        delta = np.concatenate([r[1] for r in results])
+    else:
+        corrected, delta = _bootstrap_replicates(obs, members, seeds, *args)
+
+    alpha = (1 - ci) / 2
+    frames = []
+    for stat, est, reps in [('corrected', estimate[0], corrected),
+                            ('delta', estimate[1], delta)]:
+        lower, upper = np.nanquantile(reps, [alpha, 1 - alpha], axis=0)
+        frames.append(pd.DataFrame({
+            'member': [k for k in members for _ in probs],
+            'stat': stat,
+            'quantile': np.tile(probs, len(members)),
+            'estimate': est.ravel(),
+            'lower': lower.ravel(),
+            'upper': upper.ravel()}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _censor(x, ratio, trace, rng):
+    """
+    Replace ratio values less than half the trace value with random values
+    between zero and half the trace value (see :func:`qdm_numpy`).
+    """
+    x = np.array(x, dtype=float)
+    if ratio:
+        trace_calc = 0.5 * trace
+        low = x < trace_calc
+        x[low] = rng.uniform(np.finfo(float).eps, trace_calc, low.sum())
+    return x
+
+
+def qdm_tables(obs, ref, fut, nknots=1000, ratio=True, trace=0.1,
+               size=None, seed=None):
+    """
+    Quantile tables of the observed, reference and future data for
+    :func:`qdm_apply`.
+
+    The data can be arrays, or iterables of arrays (e.g. chunks read from a
+    file), in which case the quantiles are estimated with a
+    :class:`streamstats.QuantileSketch`, and only one chunk is held in
+    memory at a time.
+
+    :param obs: Observed values
+    :param ref: Reference period values (simulated)
+    :param fut: Future period values (simulated)
+    :param int nknots: Number of quantiles in each table
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int size: Size of the quantile sketches. Default is 10 times
+        `nknots`.
+    :param seed: Seed or :class:`numpy.random.Generator` for the random
+        numbers used for ratio values less than half the trace value
+
+    :returns: :class:`dict` of `numpy.array` with keys `tau` (the
+        probabilities), `obs`, `ref` and `fut` (the quantiles)
+    """
+    if nknots < 2:
+        raise ValueError("Quantile tables need at least two knots")
+    rng = np.random.default_rng(seed)
+    tau = np.linspace(0, 1, nknots)
+    tables = {'tau': tau}
+    for name, data in [('obs', obs), ('ref', ref), ('fut', fut)]:
+        qs = QuantileSketch(size or 10 * nknots)
+        for chunk in chunks(data):
+            chunk = np.asarray(chunk, dtype=float)
+            if np.isnan(chunk).any():
+                raise ValueError(f"Input {name} data contains NaN values")
+            qs.update(_censor(chunk, ratio, trace, rng))
+        if qs.count == 0:
+            raise ValueError(f"No {name} data")
+        tables[name] = qs.quantile(tau)
+    return tables
+
+
+def qdm_apply(values, tables, period='fut', ratio=True, trace=0.1,
+              seed=None):
+    """
+    Apply the quantile delta mapping to values, using quantile tables from
+    :func:`qdm_tables`. Each value is mapped with a binary search of the
+    tables and linear interpolation, so the values can be corrected in
+    chunks of any size.
+
+    :param values: `numpy.array` of simulated values
+    :param dict tables: Quantile tables from :func:`qdm_tables`
+    :param str period: "ref" to map reference period values to the observed
+        distribution, or "fut" to apply the quantile delta mapping to future
+        period values
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param seed: Seed or :class:`numpy.random.Generator` for the random
+        numbers used for ratio values less than half the trace value
+
+    :returns: `numpy.array` of bias corrected values
+    """
+    rng = np.random.default_rng(seed)
+    x = _censor(values, ratio, trace, rng)
+    tau = tables['tau']
+    if period == 'ref':
+        mhat = _approx(tables['ref'], tables['obs'], x)
+    elif period == 'fut':
+        tau_x = _approx(tables['fut'], tau, x)
+        # The probabilities are evenly spaced, so the interpolation
+        # intervals can be calculated directly:
+        h = tau_x * (len(tau) - 1)
+        lo = np.clip(np.floor(h).astype(int), 0, len(tau) - 2)
+        frac = h - lo
+        ref_x = (1 - frac) * tables['ref'][lo] + frac * tables['ref'][lo + 1]
+        obs_x = (1 - frac) * tables['obs'][lo] + frac * tables['obs'][lo + 1]
+        if ratio:
+            delta = x / ref_x
+            delta[(delta > 2) & (ref_x < 10 * trace)] = 2
+            mhat = obs_x * delta
+        else:
+            mhat = obs_x + (x - ref_x)
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    if ratio:
+        mhat[mhat < trace] = 0
+    return mhat
+
+
+def qdm_empirical(obs, ref, fut, ratio=True, trace=0.1, nknots=1000,
+                  seed=None):
+    """
+    Quantile delta mapping using fixed-size empirical quantile tables.
+
+    This is the same mapping as :func:`qdm_numpy`, except that the
+    quantiles are calculated at `nknots` probabilities (rather than the
+    number of future values) and there is no jitter of tied values. For
+    samples larger than 10 times `nknots`, the quantiles are estimates (see
+    :mod:`streamstats`).
+
+    :param obs: `numpy.array` of observed values
+    :param ref: `numpy.array` of reference period values (simulated)
+    :param fut: `numpy.array` of future period values (simulated)
+    :param bool ratio: True if the variable is a ratio variable
+    :param float trace: Threshold below which values of a ratio quantity are
+        considered exact zeros
+    :param int nknots: Number of quantiles in the tables
+    :param seed: Seed or :class:`numpy.random.Generator` for the random
+        numbers
+
+    :returns: `mhatc`, `mhatp` - `numpy.array` of bias corrected reference
+        and future values.
+    """
+    rng = np.random.default_rng(seed)
+    tables = qdm_tables(obs, ref, fut, nknots, ratio, trace, seed=rng)
+    mhat_c = qdm_apply(ref, tables, 'ref', ratio, trace, seed=rng)
+    mhat_p = qdm_apply(fut, tables, 'fut', ratio, trace, seed=rng)
+    return mhat_c, mhat_p
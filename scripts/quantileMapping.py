@@ -49,22 +49,19 @@ from os.path import join as pjoin
 from matplotlib import pyplot as plt
 import matplotlib.patches as mpatches
 
-import re
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import cartopy.crs as ccrs
 import cartopy.feature as feature
-from shapely.geometry import box as sbox
-from shapely.geometry import LineString
 from git import Repo, InvalidGitRepositoryError
 
 import scipy.stats as stats
 
-from qdm import qdm
-
-# From TCRM codebase
-from Utilities.loadData import maxWindSpeed
+from qdm import qdm_batch, bootstrap_qdm
+from distfit import fit, fit_table, stack_models
+from tclv import filter_tracks_domain, load_ensemble, calculate_max_wind
+from ibtracs import load_ibtracs
 
 from builtins import str
 sns.set_style('whitegrid')
@@ -93,6 +90,13 @@ LOGGER.addHandler(console)
 LOGGER.info(f"Started {sys.argv[0]} (pid {os.getpid()})")
 LOGGER.info(f"Code version: {commit}")
 
+# Number of processes used to load the TCLV files (set by PBS on NCI)
+NCPUS = int(os.environ.get('NCPUS', 1))
+
+# Number of bootstrap replicates for the confidence intervals of the corrected
+# data (0 to skip the bootstrap)
+NBOOT = int(os.environ.get('NBOOT', 0))
+
 LABELS = ['TD', 'TC1', 'TC2', 'TC3', 'TC4', 'TC5']
 CATPAL = sns.blend_palette([(0.000, 0.627, 0.235), (0.412, 0.627, 0.235),
                             (0.663, 0.780, 0.282), (0.957, 0.812, 0.000),
@@ -118,93 +122,6 @@ CATPAL = sns.blend_palette([(0.000, 0.627, 0.235), (0.412, 0.627, 0.235),
 # simulated events.
 
 
-def load_track_file(filename):
-    """
-    Load a TCLV file into a :class:`pandas.DataFrame`, and add a field
-    representing the age of each TCLV in hours, and the pressure difference.
-
-    :param str filename: Path to a TCLV data file
-
-    :returns: :class:`pandas.DataFrame`
-    """
-    # This assumes the format of the TCLV files is identical
-    LOGGER.info(f"Loading TCLV data from {filename}")
-    columns = ['num', 'year', 'month', 'day', 'hour', 'lon', 'lat',
-               'pmin', 'vorticity', 'vmax', 'tanomsum','tanomdiff',
-               'pmslanom', 'poci', 'reff','ravg','asym']
-    try:
-        df = pd.read_csv(filename, delimiter=' ', skipinitialspace=True,
-                         names=columns, parse_dates={'datetime':[1,2,3,4]},
-                         keep_date_col=True, 
-                         dtype={'year':int, 'month':int, 'day':int})
-    except:
-        LOGGER.exception(f"Failed to load {filename}")
-        raise
-    df['dt'] = df.groupby('num')['datetime'].apply(lambda x: x.diff())
-    df['dt'] = df['dt'].transform(lambda x: x.total_seconds())
-
-    df['age'] = df.groupby('num')['dt'].apply(np.cumsum).fillna(0)/3600.
-    # Throw in the pressure deficit for good measure:
-    df['pdiff'] = df['poci'] - df['pmin']
-
-    # And normalised intensity. This is the intensity at any given time,
-    # dividied by the lifetime maximum intensity for each unique event
-    df['ni'] = df.pdiff / df.groupby('num').pdiff.transform(np.max)
-    return df
-
-
-def filter_tracks(df, start_year=1980, end_year=2010, zeta=0, age=36):
-    """
-    Takes a `DataFrame` and filters on the basis of a prescribed vorticity
-    threshold, lifetime and a given time period.
-
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param int start_year: Starting year of the time period to filter
-    :param int end_year: End year of the period to filter
-    :param float zeta: Vorticity threshold to filter the TCLV data.
-                       This can be a positive value, as we filter on the
-                       absolute value of the field.
-    :param int age: Minimum age of the TCLVs in hours
-
-    """
-    tracks = df.groupby('num')
-    filterdf = tracks.filter(
-        lambda x: (x['datetime'].dt.year.min() >= start_year) &
-        (x['datetime'].dt.year.max() <= end_year) &
-        (x['age'].max() >= age) &
-        (np.abs(x['vorticity'].min()) > zeta))
-    return filterdf
-
-
-def filter_tracks_domain(df, minlon=90, maxlon=180, minlat=-40, maxlat=0):
-    """
-    Takes a `DataFrame` and filters on the basis of whether the track interscts
-    the given domain, which is specified by the minimum and maximum longitude
-    and latitude.
-
-    NOTE: This assumes the tracks and bounding box are in the same geographic
-    coordinate system (i.e. generally a latitude-longitude coordinate system).
-    It will NOT support different projections (e.g. UTM data for the bounds and
-    geographic for the tracks).
-
-    NOTE: This doesn't work if there is only one point for the track.
-
-    :param df: :class:`pandas.DataFrame` that holds the TCLV data
-    :param float minlon: minimum longitude of the bounding box
-    :param float minlat: minimum latitude of the bounding box
-    :param float maxlon: maximum longitude of the bounding box
-    :param float maxlat: maximum latitude of the bounding box
-    """
-
-    domain = sbox(minlon, minlat, maxlon, maxlat, ccw=False)
-    tracks = df.groupby('num')
-    tempfilter = tracks.filter(lambda x: len(x) > 1)
-    filterdf = (tempfilter.groupby('num')
-                .filter(lambda x: LineString(zip(x['lon'], x['lat']))
-                .intersects(domain)))
-    return filterdf
-
-
 def calculateMaxWind(df, dtname='ISO_TIME'):
     """
     Calculate a maximum gust wind speed based on the central pressure deficit
@@ -214,20 +131,12 @@ def calculateMaxWind(df, dtname='ISO_TIME'):
 
     This returns a `DataFrame` with an additional column (`vmax`), which
     represents an estimated 1-minute sustained wind speed.
-    """
-    LOGGER.debug("Calculating maximum wind speed")
-    idx = df.num.values
-    varidx = np.ones(len(idx))
-    varidx[1:][idx[1:] == idx[:-1]] = 0
 
-    dt = ((df[dtname] - df[dtname].shift())
-          .fillna(pd.Timedelta(seconds=0))
-          .apply(lambda x: x / np.timedelta64(1, 'h'))
-          .astype('int64') % (24*60)
-          )
-    df['vmax'] = maxWindSpeed(varidx, dt.values, df.lon.values, df.lat.values,
-                              df.pmin.values, df.poci.values, gustfactor=1.0)
-    return df
+    `df` can also be a `dict` of `DataFrame`s (e.g. all ensemble members), in
+    which case the members are processed together in a single call and the
+    `dict` is returned.
+    """
+    return calculate_max_wind(df, dtname, gustfactor=1.0)
 
 
 def pyqdm(vobs, vref, vfut, dist=stats.lognorm):
@@ -286,9 +195,10 @@ def pyqdm(vobs, vref, vfut, dist=stats.lognorm):
     if any(np.isnan(vfut)):
         raise ValueError("Input future array contains NaN values")
 
-    pobs = dist.fit(vobs, loc=0, scale=1)
-    pref = dist.fit(vref, loc=0, scale=1)
-    pfut = dist.fit(vfut, loc=0, scale=1)
+    # The fits are cached, so the observations are only fitted once:
+    pobs = fit(dist, vobs, loc=0, scale=1)
+    pref = fit(dist, vref, loc=0, scale=1)
+    pfut = fit(dist, vfut, loc=0, scale=1)
 
     # CDF of future, at the value of the future data points
     Fsf = dist.cdf(vfut, *pfut)
@@ -304,7 +214,7 @@ def pyqdm(vobs, vref, vfut, dist=stats.lognorm):
     return vfutb
 
 
-def loadTCLVdata(dataPath, start_year, end_year, domain):
+def loadTCLVdata(dataPath, start_year, end_year, domain, processes=None):
     """
     Load TCLV data from a directory, for a given year range
     and a geographic domain
@@ -313,34 +223,17 @@ def loadTCLVdata(dataPath, start_year, end_year, domain):
     files
     :param int start_year: beginning of the time period (year)
     :param int end_year: end of the time period (year)
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+    that describes the bounding domain.
+    :param int processes: Number of worker processes used to load the files.
+    Default is to load the files sequentially.
 
     """
-    LOGGER.info(f"Loading TCLV data from {dataPath}")
-    datadict = {}
-    regex = r'all_tracks_(.+)_(rcp\d+)\.dat'
-    ens45 = []
-    ens85 = []
-    for fname in os.listdir(dataPath):
-        # Skip the ERA-Interim sourced TCLV set
-        if fname == "all_tracks_ERAIntQ_rcp85.dat":
-            continue
-
-        if re.search(regex, fname):
-            m = re.match(regex, fname)
-            model, rcp = m.group(1, 2)
-            filename = pjoin(dataPath, fname)
-            df = load_track_file(filename)
-            df = filter_tracks(df, start_year, end_year)
-            df = filter_tracks_domain(df, *domain)
-            if rcp.upper() == 'RCP45':
-                ens45.append(df)
-            else:
-                ens85.append(df)
-            label = f"{model} {rcp.upper()}"
-            datadict[label] = df
-        else:
-            LOGGER.debug(f"{fname} does not match the expected pattern.")
-            continue
+    datadict = load_ensemble(dataPath, start_year, end_year, domain,
+                             processes=processes)
+    ens45 = [df for m, df in datadict.items() if m.endswith('RCP45')]
+    ens85 = [df for m, df in datadict.items() if not m.endswith('RCP45')]
+
     # Create an ensemble set of data as well:
     datadict['ENS RCP45'] = pd.concat(ens45, ignore_index=True)
     datadict['ENS RCP85'] = pd.concat(ens85, ignore_index=True)
@@ -365,23 +258,14 @@ def calculateFitParams(datadict, params, start, end, bc, dist=stats.lognorm):
     `scipy.stats.lognorm`.
 
     :returns: a `pandas.DataFrame` of the parameters for the fitted
-    distribution.
+    distribution, and the histogram of the data, appended to `params`.
 
     """
     LOGGER.info("Fitting distributions to data")
     bins = np.arange(0, 100, 5)
-    for m, df in datadict.items():
-        model, rcp = m.split(' ')
-        popt = dist.fit(df.pdiff, loc=0, scale=1)
-        h, b = np.histogram(df.pdiff, bins=bins, density=True)
-        histdict = {b: h for b, h in zip(b, h)}
-        params = params.append(
-            {'Model': model, 'RCP': rcp,
-             'period': f"{start}-{end}", 'bc': bc,
-             'mu': popt[0], 'sigma': popt[1],
-             'zeta': popt[2], **histdict},
-            ignore_index=True)
-    return params
+    data = stack_models(datadict, period=f"{start}-{end}", bc=bc)
+    table = fit_table(data, bins=bins, dist=dist, loc=0, scale=1)
+    return pd.concat([params, table], ignore_index=True)
 
 
 def loadObsData(obsfile, domain):
@@ -394,13 +278,7 @@ def loadObsData(obsfile, domain):
     :param tuple domain: Tuple containing min/max lon/lat values
     """
     LOGGER.info(f"Loading obsered TC data from {obsfile}")
-    best = pd.read_csv(obsfile, skiprows=[1],
-                       usecols=[0, 6, 8, 9, 11, 95, 113],
-                       na_values=[' '],
-                       parse_dates=[1])
-    best.rename(columns={'SID': 'num', 'LAT': 'lat', 'LON': 'lon',
-                         'WMO_PRES': 'pmin', 'BOM_WIND': 'vmax',
-                         'BOM_POCI': 'poci'}, inplace=True)
+    best = load_ibtracs(obsfile, domain)
     best = best[best.poci.notnull() & best.pmin.notnull()]
     best['pdiff'] = best.poci - best.pmin
     best = best[best.pdiff > 1]
@@ -418,7 +296,7 @@ def plotDistribution(data, plotpath, title, start, end):
     for i, (m, df) in enumerate(data.items()):
         sns.distplot(df.pdiff, ax=ax[i], kde=False, norm_hist=True)
         model, rcp = m.split(' ')
-        popt = stats.lognorm.fit(df.pdiff, loc=0, scale=1)
+        popt = fit(stats.lognorm, df.pdiff, loc=0, scale=1)
         fitline = stats.lognorm.pdf(np.arange(0, 101), *popt)
         ax[i].plot(np.arange(0, 101), fitline, color='r')
         ax[i].set_title("{0}\n({1:.4f}, {2:.4f}, {3:.4f})".format(m, *popt))
@@ -559,8 +437,6 @@ if __name__ == '__main__':
 
     dist = stats.lognorm
     binvals = np.arange(0, 100, 5)
-    params = pd.DataFrame(columns=['Model', 'RCP', 'period',
-        'bc', 'mu', 'sigma', 'zeta'].append(binvals.tolist()))
 
     # The variables are referenced in the following way::
     #
@@ -581,14 +457,10 @@ if __name__ == '__main__':
     obslmi = obstc.loc[obstc.groupby(["num"])["pdiff"].idxmax()]
     obsdata = obslmi.pdiff.values[obslmi.pdiff.values > 0]
 
-    h, b = np.histogram(obslmi.pdiff, bins=bins, density=True)
-    histdict = {b:h for b, h in zip(b, h)}
-    obsparams = stats.lognorm.fit(obslmi.pdiff, loc=0, scale=1)
-    params = params.append({"Model": "Obs", "RCP": "Obs", 
-                            'period': '1981-2019', 'bc': False,
-                            "mu": obsparams[0], "sigma": obsparams[1],
-                            "zeta": obsparams[2], **histdict},
-                           ignore_index=True)
+    obsparams = fit(stats.lognorm, obslmi.pdiff, loc=0, scale=1)
+    params = fit_table(stack_models({'Obs Obs': obslmi}, period='1981-2019',
+                                    bc=False),
+                       bins=bins, loc=0, scale=1)
 
     # Plot the tracks of all the historical tracks that enter the selected domain
     # and have a $p_{oci}$ defined in the historical record. This variable was not
@@ -617,7 +489,7 @@ if __name__ == '__main__':
     # below shows the histogram of $\Delta p_c$, with a fitted lognormal
     # distribution to each.
     LOGGER.info("Processing the reference period 1981 - 2010")
-    refdata = loadTCLVdata(path, 1981, 2010, domain)
+    refdata = loadTCLVdata(path, 1981, 2010, domain, NCPUS)
     params = calculateFitParams(refdata, params, 1981, 2010, bc=False)
 
     plotDistribution(refdata, plotpath, "reference", 1981, 2010)
@@ -641,7 +513,7 @@ if __name__ == '__main__':
     start = 2081
     end = 2100
     LOGGER.info(f"Working with data for the period {start} - {end}")
-    futdata = loadTCLVdata(path, start, end, domain)
+    futdata = loadTCLVdata(path, start, end, domain, NCPUS)
     params = calculateFitParams(futdata, params, start, end, bc=False)
     plotDistribution(futdata, plotpath, "future", start, end)
 
@@ -683,17 +555,29 @@ if __name__ == '__main__':
     # observed data.
 
 
+    # All models are corrected in a single batch, for both the reference
+    # period (using the reference data as the 'future' data) and the future
+    # period:
+    LOGGER.info("Applying QDM for all models")
+    members = {}
+    for m, refdf in refdata.items():
+        members[(m, 'reference')] = (refdf.pdiff.values, refdf.pdiff.values)
+        members[(m, 'future')] = (refdf.pdiff.values, futdata[m].pdiff.values)
+    bcdata = qdm_batch(obsdata, members)
+    bcdata = bcdata[bcdata['period'] == 'fut']
+    corrected = {key: grp['corrected'].to_numpy() for key, grp in
+                 bcdata.groupby('member', observed=True, sort=False)}
+
     fig, axes = plt.subplots(6, 4, figsize=(20, 20), sharex=True)
     ax = axes.flatten()
     brefpdiff = {}
     brefparams = pd.DataFrame(columns=['Model', 'RCP', 'mu', 'sigma', 'zeta'])
     for i, (m, refdf) in enumerate(refdata.items()):
-        LOGGER.info(f"Applying QDM for model {m}")
         futdf = futdata[m]
         model, rcp = m.split(' ')
 
         srefdata = refdf.pdiff.values
-        brefpdiff[m] = qdm(obsdata, srefdata, srefdata)[1]
+        brefpdiff[m] = corrected[(m, 'reference')]
         # popt = stats.lognorm.fit(brefpdiff[m], loc=0, scale=1)
         # params = params.append({'Model':model, 'RCP':rcp, bc:True,
         #                         'mu':popt[0], 'sigma':popt[1], 'zeta':popt[2]},
@@ -720,7 +604,7 @@ if __name__ == '__main__':
         model, rcp = m.split(' ')
         srefdata = refdf.pdiff.values
         sfutdata = futdf.pdiff.values
-        bfutpdiff[m] = qdm(obsdata, srefdata, sfutdata)[1]
+        bfutpdiff[m] = corrected[(m, 'future')]
 
         ax[i].scatter(sfutdata, bfutpdiff[m], alpha=0.5)
         ax[i].plot([-5, 100], [-5, 100], '--')
@@ -732,6 +616,17 @@ if __name__ == '__main__':
 
     fig.tight_layout()
 
+    # Confidence intervals for the quantiles of the corrected future data and
+    # $\delta_{fut}$, by resampling the observed, reference and future data:
+    if NBOOT:
+        LOGGER.info(f"Bootstrapping QDM with {NBOOT} replicates")
+        futmembers = {m: (refdf.pdiff.values, futdata[m].pdiff.values)
+                      for m, refdf in refdata.items()}
+        bands = bootstrap_qdm(obsdata, futmembers, nboot=NBOOT, seed=1981,
+                              processes=NCPUS)
+        bands.to_csv(pjoin(plotpath, f"qdm_bootstrap.{start}-{end}.csv"),
+                     float_format="%.4f", index=False)
+
     # ### Applying the correction to derive new $p_c$ values
     #
     # In this section, we insert the updated $\Delta p_c$ values back into the
@@ -760,8 +655,10 @@ if __name__ == '__main__':
     for i, (m, refdf) in enumerate(refdata.items()):
         refdf['pmin'] = refdf['poci'] - brefpdiff[m]
         refdf['pdiff'] = brefpdiff[m]
-        refdf = calculateMaxWind(refdf, 'datetime')
         brefdata[m] = refdf
+    # All members are passed to `maxWindSpeed` in one call:
+    brefdata = calculateMaxWind(brefdata, 'datetime')
+    for m, refdf in brefdata.items():
         fname = pjoin(
             outputPath,
             fileTemplate.format(m.replace(' ', '_'))
@@ -775,8 +672,9 @@ if __name__ == '__main__':
     for i, (m, futdf) in enumerate(futdata.items()):
         futdf['pmin'] = futdf['poci'] - bfutpdiff[m]
         futdf['pdiff'] = bfutpdiff[m]
-        futdf = calculateMaxWind(futdf, 'datetime')
         bfutdata[m] = futdf
+    bfutdata = calculateMaxWind(bfutdata, 'datetime')
+    for m, futdf in bfutdata.items():
         fname = pjoin(
             outputPath,
             futfileTemplate.format(m.replace(' ', '_'), start, end)
@@ -785,6 +683,7 @@ if __name__ == '__main__':
 
     params = calculateFitParams(brefdata, params, 1981, 2010, bc=True)
     params = calculateFitParams(bfutdata, params, start, end, bc=True)
+    params.to_csv(pjoin(plotpath, "fitparameters.csv"), index=False)
 
     # Plot quantiles:
     plotQuantiles(brefdata, bfutdata, 'RCP45', start, end, plotpath, "bc")
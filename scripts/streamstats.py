@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `streamstats` -- Streaming estimates of distribution statistics
+====================================================================
+
+.. module:: streamstats
+    :synopsis: Estimate the quantiles of data that arrive in chunks (or are
+    too large to hold in memory), using a fixed amount of memory.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+A :class:`QuantileSketch` holds a weighted summary of the values it has been
+given. New values are buffered, and when the buffer is full the summary and
+buffer are compressed to `size` equally weighted points, placed at evenly
+spaced ranks of the combined (weighted) data. The minimum and maximum
+values are kept exactly. Until the first compression, the sketch holds all
+the values and the quantiles are exact (the same as `numpy.quantile`).
+
+The rank error of a compression is of the order of 1/`size`, and sketches
+of separate partitions of the data can be merged, so the quantiles of very
+large collections (e.g. millions of track points) can be estimated with
+bounded memory.
+
+:class:`RunningStats` accumulates the count, sum, mean, variance (with
+Welford's algorithm), minimum and maximum of a stream of arrays, element by
+element. Accumulators of separate partitions can be merged.
+
+"""
+
+import numpy as np
+
+
+class QuantileSketch(object):
+    """
+    Mergeable, fixed-memory summary of a distribution of values.
+
+    :param int size: Number of points the summary is compressed to
+    :param int buffersize: Number of values buffered before compressing.
+        Default is 10 times `size`.
+    """
+
+    def __init__(self, size=1000, buffersize=None):
+        if size < 2:
+            raise ValueError("Size of a quantile sketch must be at least 2")
+        self.size = size
+        self.buffersize = buffersize or 10 * size
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._values = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer = []
+        self._nbuffer = 0
+
+    @property
+    def exact(self):
+        """True if the sketch holds all the values it has been given"""
+        return len(self._weights) == 0 or bool((self._weights == 1).all())
+
+    def update(self, values):
+        """
+        Add values to the sketch. NaN values are ignored.
+
+        :param values: `numpy.array` (or array-like) of values
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buffer.append(values)
+        self._nbuffer += len(values)
+        if len(self._values) + self._nbuffer > self.buffersize:
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Combine another sketch into this one.
+
+        :param other: :class:`QuantileSketch`
+        """
+        if other.count == 0:
+            return self
+        values, weights = other._summary()
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._values, self._weights = self._combine(
+            self._values, self._weights, values, weights)
+        self._flush()
+        if len(self._values) > self.buffersize:
+            self._compress()
+        return self
+
+    @staticmethod
+    def _combine(v1, w1, v2, w2):
+        """
+        Merge two sorted sets of weighted values. The stable sort of two
+        sorted runs takes linear time.
+        """
+        values = np.concatenate([v1, v2])
+        weights = np.concatenate([w1, w2])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def _flush(self):
+        """Move the buffered values into the summary"""
+        if self._buffer:
+            values = np.sort(np.concatenate(self._buffer))
+            self._values, self._weights = self._combine(
+                self._values, self._weights, values, np.ones(len(values)))
+            self._buffer = []
+            self._nbuffer = 0
+
+    def _summary(self):
+        self._flush()
+        return self._values, self._weights
+
+    def _compress(self):
+        """
+        Replace the summary with `size` equally weighted points, at evenly
+        spaced ranks of the weighted values.
+        """
+        values, weights = self._summary()
+        if len(values) <= self.size:
+            return
+        total = weights.sum()
+        centres = np.cumsum(weights) - 0.5 * weights
+        ranks = (np.arange(self.size) + 0.5) * total / self.size
+        self._values = np.interp(ranks, centres, values)
+        self._weights = np.full(self.size, total / self.size)
+
+    def quantile(self, probs):
+        """
+        Estimate quantiles of the values.
+
+        :param probs: Probabilities (between 0 and 1)
+
+        :returns: `numpy.array` of quantiles (or a float for a scalar
+            probability)
+        """
+        if self.count == 0:
+            raise ValueError("Quantiles of an empty sketch are undefined")
+        values, weights = self._summary()
+        probs = np.asarray(probs, dtype=float)
+        if self.exact:
+            return np.quantile(values, probs)
+        total = weights.sum()
+        centres = np.r_[0, np.cumsum(weights) - 0.5 * weights, total]
+        return np.interp(probs * total, centres,
+                         np.r_[self.min, values, self.max])
+
+
+class RunningStats(object):
+    """
+    Running statistics of a stream of arrays of values (e.g. one value for
+    each gate, for each simulation). NaN values are ignored, so each element
+    has its own count.
+
+    :param shape: Shape of the arrays
+    """
+
+    def __init__(self, shape=()):
+        self.n = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+        self._min = np.full(shape, np.inf)
+        self._max = np.full(shape, -np.inf)
+
+    def update(self, values):
+        """
+        Add an array of values.
+
+        :param values: `numpy.array` of values, with the shape of the
+            accumulator
+        """
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.)
+        self.n += valid
+        delta = np.where(valid, values - self.mean, 0.)
+        self.mean += np.where(valid, delta / np.maximum(self.n, 1), 0.)
+        self._m2 += np.where(valid, delta * (values - self.mean), 0.)
+        self.sum += values
+        self._min = np.where(valid, np.minimum(self._min, values), self._min)
+        self._max = np.where(valid, np.maximum(self._max, values), self._max)
+        return self
+
+    def merge(self, other):
+        """
+        Combine another accumulator into this one.
+
+        :param other: :class:`RunningStats`
+        """
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, other.n / n, 0.)
+        self.mean = self.mean + delta * weight
+        self._m2 = self._m2 + other._m2 + delta ** 2 * self.n * weight
+        self.n = n
+        self.sum = self.sum + other.sum
+        self._min = np.minimum(self._min, other._min)
+        self._max = np.maximum(self._max, other._max)
+        return self
+
+    def std(self, ddof=0):
+        """
+        Standard deviation of the values (NaN where there are no more than
+        `ddof` values).
+
+        :param int ddof: Delta degrees of freedom
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > ddof,
+                            np.sqrt(self._m2 / (self.n - ddof)), np.nan)
+
+    @property
+    def min(self):
+        """Minimum of the values (NaN where there are no values)"""
+        return np.where(self.n > 0, self._min, np.nan)
+
+    @property
+    def max(self):
+        """Maximum of the values (NaN where there are no values)"""
+        return np.where(self.n > 0, self._max, np.nan)
+
+    @property
+    def nanmean(self):
+        """Mean of the values (NaN where there are no values)"""
+        return np.where(self.n > 0, self.mean, np.nan)
+
+
+def chunks(data):
+    """
+    Iterate over the chunks of a collection of values. A single array (or
+    any one-dimensional array-like, e.g. a `pandas.Series`) is treated as
+    one chunk.
+
+    :param data: `numpy.array` of values, or an iterable of arrays
+    """
+    if hasattr(data, '__array__') and np.ndim(data) == 1:
+        return [data]
+    if isinstance(data, (np.ndarray, list, tuple)) and (
+            len(data) == 0 or np.ndim(data[0]) == 0):
+        return [data]
+    return data
+
+
+def sketch(data, size=1000):
+    """
+    Build a :class:`QuantileSketch` of a collection of values.
+
+    :param data: `numpy.array` of values, or an iterable of arrays (e.g.
+        chunks read from a file)
+    :param int size: Size of the sketch
+
+    :returns: :class:`QuantileSketch`
+    """
+    qs = QuantileSketch(size)
+    for chunk in chunks(data):
+        qs.update(chunk)
+    return qs
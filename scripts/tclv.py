@@ -0,0 +1,865 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `tclv` -- Loading, caching and filtering of TCLV track data
+=================================================================
+
+.. module:: tclv
+    :synopsis: Shared functions to load tropical cyclone-like vortex (TCLV)
+    track files produced by the regional downscaling simulations.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+The TCLV track files (`all_tracks_<model>_<rcp>.dat`) are whitespace-delimited
+text files with 17 columns. Parsing these files (and building the `datetime`
+field from the separate year, month, day and hour columns) accounts for most
+of the time spent loading the data, so the first time a file is loaded a typed
+columnar copy is written to a cache directory alongside the source file. The
+cached copy is reused on subsequent loads, provided the size and modification
+time of the source file are unchanged.
+
+The cache uses the Parquet format, which requires either `pyarrow` or
+`fastparquet` to be installed. If neither is available, the track files are
+parsed on every load.
+
+Files that are too large to hold in memory (e.g. merged ensembles) can be
+processed a batch of complete tracks at a time with :func:`iter_tracks`.
+
+Merged ensembles are written incrementally with :class:`TrackWriter`, as csv
+and/or an uncompressed Arrow IPC ("feather") file. The Arrow file can be
+memory-mapped by :func:`read_merged_tracks`, rather than parsed as text.
+
+"""
+
+import os
+import re
+import json
+import logging
+from os.path import join as pjoin
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+# This assumes the format of the TCLV files is identical
+TCLV_COLUMNS = ['num', 'year', 'month', 'day', 'hour', 'lon', 'lat',
+                'pmin', 'vorticity', 'vmax', 'tanomsum', 'tanomdiff',
+                'pmslanom', 'poci', 'reff', 'ravg', 'asym']
+
+TCLV_DTYPES = {'num': 'int64', 'year': 'int64', 'month': 'int64',
+               'day': 'int64', 'hour': 'int64'}
+
+TCLV_REGEX = r'all_tracks_(.+)_(rcp\d+)\.dat$'
+
+# Skip the ERA-Interim sourced TCLV set
+TCLV_EXCLUDE = ("all_tracks_ERAIntQ_rcp85.dat",)
+
+CACHE_DIR = ".tclvcache"
+
+# Increment this if the layout of the cached data changes, so that existing
+# cache files are rebuilt:
+CACHE_VERSION = 1
+
+
+def read_track_file(filename):
+    """
+    Parse a TCLV track file into a :class:`pandas.DataFrame`. The `datetime`
+    field is constructed from the year, month, day and hour columns, which are
+    retained in the returned `DataFrame`.
+
+    :param str filename: Path to a TCLV data file
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    LOGGER.info(f"Loading TCLV data from {filename}")
+    try:
+        df = pd.read_csv(filename, sep=r'\s+', header=None,
+                         names=TCLV_COLUMNS, dtype=TCLV_DTYPES)
+    except:
+        LOGGER.exception(f"Failed to load {filename}")
+        raise
+    return _insert_datetime(df)
+
+
+def _insert_datetime(df):
+    """
+    Insert a `datetime` field (built from the year, month, day and hour
+    columns) at the start of the TCLV data.
+    """
+    df.insert(0, 'datetime',
+              pd.to_datetime(df[['year', 'month', 'day', 'hour']]))
+    return df
+
+
+def _cache_paths(filename, cachedir=None):
+    """
+    Return the paths of the cached data and the associated metadata for a
+    TCLV track file.
+
+    :param str filename: Path to a TCLV data file
+    :param str cachedir: Optional cache directory. Default is a `.tclvcache`
+        directory in the same directory as `filename`.
+    """
+    if cachedir is None:
+        cachedir = pjoin(os.path.dirname(os.path.abspath(filename)), CACHE_DIR)
+    basename = os.path.basename(filename)
+    return (pjoin(cachedir, f"{basename}.parquet"),
+            pjoin(cachedir, f"{basename}.json"))
+
+
+def _source_signature(filename):
+    """
+    Signature of a source file used to determine if a cached copy is stale.
+
+    :param str filename: Path to a TCLV data file
+    """
+    st = os.stat(filename)
+    return {'source': os.path.abspath(filename), 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns, 'version': CACHE_VERSION}
+
+
+def _read_cache(filename, cachedir=None):
+    """
+    Read the cached copy of a TCLV track file, if it exists and is current.
+
+    :returns: :class:`pandas.DataFrame`, or `None` if there is no valid cache
+    """
+    datafile, metafile = _cache_paths(filename, cachedir)
+    if not (os.path.isfile(datafile) and os.path.isfile(metafile)):
+        return None
+    try:
+        with open(metafile, 'r') as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        LOGGER.warning(f"Cannot read cache metadata {metafile}")
+        return None
+    if meta != _source_signature(filename):
+        LOGGER.debug(f"Cached copy of {filename} is out of date")
+        return None
+    try:
+        df = pd.read_parquet(datafile)
+    except ImportError:
+        LOGGER.debug("No parquet engine available - cache disabled")
+        return None
+    except Exception:
+        LOGGER.warning(f"Cannot read cached data {datafile}")
+        return None
+    LOGGER.info(f"Loading TCLV data for {filename} from {datafile}")
+    return df
+
+
+def _write_cache(df, filename, cachedir=None):
+    """
+    Write a typed columnar copy of the TCLV data to the cache. Failure to write
+    the cache is not fatal - the data is simply parsed again on the next load.
+    """
+    datafile, metafile = _cache_paths(filename, cachedir)
+    signature = _source_signature(filename)
+    try:
+        os.makedirs(os.path.dirname(datafile), exist_ok=True)
+        # Write to a temporary file and move into place, so a partially
+        # written file is never read as a valid cache:
+        tmpfile = f"{datafile}.{os.getpid()}.tmp"
+        df.to_parquet(tmpfile, index=False)
+        os.replace(tmpfile, datafile)
+        with open(metafile, 'w') as fh:
+            json.dump(signature, fh)
+    except ImportError:
+        LOGGER.debug("No parquet engine available - cache disabled")
+    except OSError:
+        LOGGER.warning(f"Unable to write cached copy of {filename}")
+
+
+def track_index(num):
+    """
+    Describe the individual tracks in an array of track numbers as contiguous
+    segments, so that per-track quantities can be calculated with single
+    passes over the data (e.g. `numpy.ufunc.reduceat`) rather than grouped
+    Python callbacks.
+
+    If the points for each track are not already contiguous, `order` is the
+    (stable) permutation that makes them contiguous - i.e. `num[order]` is
+    grouped by track, with the points of each track in their original order.
+
+    :param num: `numpy.ndarray` of track numbers for each point
+
+    :returns: tuple of (`order`, `starts`, `lengths`). `order` is `None` if the
+        tracks are already contiguous. `starts` is the index of the first
+        point of each track (in the ordered array) and `lengths` the number of
+        points in each track.
+    """
+    num = np.asarray(num)
+    if len(num) == 0:
+        return None, np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    order = None
+    starts = np.flatnonzero(num[1:] != num[:-1]) + 1
+    if len(starts) + 1 != len(np.unique(num)):
+        # At least one track is split into separate blocks of rows:
+        order = np.argsort(num, kind='stable')
+        snum = num[order]
+        starts = np.flatnonzero(snum[1:] != snum[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(num)))
+    return order, starts, lengths
+
+
+def _unorder(values, order):
+    """
+    Return values calculated on the track-ordered arrays to the original
+    order of the points.
+    """
+    if order is None:
+        return values
+    out = np.empty_like(values)
+    out[order] = values
+    return out
+
+
+def derive_track_fields(df):
+    """
+    Add the time step (`dt`, seconds), age (`age`, hours), pressure deficit
+    (`pdiff`) and normalised intensity (`ni`) fields to the TCLV data. All
+    tracks are processed together in single array passes over the track
+    segments.
+
+    :param df: :class:`pandas.DataFrame` of TCLV data, with `num`,
+        `datetime`, `poci` and `pmin` fields.
+
+    :returns: :class:`pandas.DataFrame` with the additional fields.
+    """
+    order, starts, lengths = track_index(df['num'].to_numpy())
+    times = df['datetime'].to_numpy()
+    pdiff = (df['poci'] - df['pmin']).to_numpy()
+    if order is not None:
+        times = times[order]
+        pdiff = pdiff[order]
+
+    # Time step from the previous point - undefined for the first point of
+    # each track:
+    dt = np.empty(len(times))
+    dt[1:] = np.diff(times) / np.timedelta64(1, 's')
+    dt[starts] = np.nan
+
+    # Age is the time since the first point of the track:
+    t0 = np.repeat(times[starts], lengths)
+    age = (times - t0) / np.timedelta64(1, 's') / 3600.
+
+    # Normalised intensity is the intensity at any given time,
+    # divided by the lifetime maximum intensity for each unique event
+    if len(pdiff):
+        lmi = np.repeat(np.fmax.reduceat(pdiff, starts), lengths)
+    else:
+        lmi = pdiff
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ni = pdiff / lmi
+
+    df['dt'] = _unorder(dt, order)
+    df['age'] = _unorder(age, order)
+    # Throw in the pressure deficit for good measure:
+    df['pdiff'] = _unorder(pdiff, order)
+    df['ni'] = _unorder(ni, order)
+    return df
+
+
+def load_track_file(filename, cache=True, cachedir=None):
+    """
+    Load a TCLV file into a :class:`pandas.DataFrame`, and add a field
+    representing the age of each TCLV in hours, and the pressure difference.
+
+    If `cache` is True, a cached columnar copy of the file is used if it is
+    current, otherwise the file is parsed and the cache is (re)built.
+
+    :param str filename: Path to a TCLV data file
+    :param bool cache: Use (and update) the cached copy of the data
+    :param str cachedir: Optional cache directory. Default is a `.tclvcache`
+        directory in the same directory as `filename`.
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    if cache:
+        df = _read_cache(filename, cachedir)
+        if df is not None:
+            return df
+
+    df = read_track_file(filename)
+    df = derive_track_fields(df)
+
+    if cache:
+        _write_cache(df, filename, cachedir)
+    return df
+
+
+def track_summary(df):
+    """
+    Summarise each track in a collection of TCLV data. The summary is
+    calculated with grouped reductions over all tracks, and can be reused to
+    filter the same data many times (e.g. for different time periods).
+
+    :param df: :class:`pandas.DataFrame` that holds the TCLV data
+
+    :returns: :class:`pandas.DataFrame`, indexed by track number, with the
+        start and end year, lifetime (maximum age, hours), minimum vorticity,
+        bounding box and number of points of each track.
+    """
+    grouped = df.assign(tyear=df['datetime'].dt.year).groupby('num')
+    summary = grouped.agg(start_year=('tyear', 'min'),
+                          end_year=('tyear', 'max'),
+                          lifetime=('age', 'max'),
+                          vorticity=('vorticity', 'min'),
+                          minlon=('lon', 'min'),
+                          maxlon=('lon', 'max'),
+                          minlat=('lat', 'min'),
+                          maxlat=('lat', 'max'),
+                          npoints=('lon', 'size'))
+    return summary
+
+
+def filter_tracks(df, start_year=1980, end_year=2010, zeta=0, age=36,
+                  summary=None):
+    """
+    Takes a `DataFrame` and filters on the basis of a prescribed vorticity
+    threshold, lifetime and a given time period.
+
+    :param df: :class:`pandas.DataFrame` that holds the TCLV data
+    :param int start_year: Starting year of the time period to filter
+    :param int end_year: End year of the period to filter
+    :param float zeta: Vorticity threshold to filter the TCLV data.
+                       This can be a positive value, as we filter on the
+                       absolute value of the field.
+    :param int age: Minimum age of the TCLVs in hours
+    :param summary: Optional :class:`pandas.DataFrame` of track summaries for
+        `df`, from :func:`track_summary`. Passing this in avoids recalculating
+        the summary when the same data is filtered repeatedly.
+
+    """
+    if summary is None:
+        summary = track_summary(df)
+    keep = ((summary['start_year'] >= start_year) &
+            (summary['end_year'] <= end_year) &
+            (summary['lifetime'] >= age) &
+            (np.abs(summary['vorticity']) > zeta))
+    filterdf = df[df['num'].isin(summary.index[keep])]
+    return filterdf
+
+
+def segments_intersect_box(x0, y0, x1, y1, minx, maxx, miny, maxy):
+    """
+    Determine whether line segments intersect (or touch) an axis-aligned
+    box, using the Liang-Barsky clipping algorithm evaluated for all
+    segments at once. Degenerate segments (where the start and end points are
+    the same) are treated as points.
+
+    :param x0: `numpy.ndarray` of x-coordinates of the segment start points
+    :param y0: `numpy.ndarray` of y-coordinates of the segment start points
+    :param x1: `numpy.ndarray` of x-coordinates of the segment end points
+    :param y1: `numpy.ndarray` of y-coordinates of the segment end points
+    :param float minx: minimum x-coordinate of the box
+    :param float maxx: maximum x-coordinate of the box
+    :param float miny: minimum y-coordinate of the box
+    :param float maxy: maximum y-coordinate of the box
+
+    :returns: `numpy.ndarray` of `bool` values, True where the segment
+        intersects the box.
+    """
+    x0, y0, x1, y1 = (np.asarray(a, dtype=float) for a in (x0, y0, x1, y1))
+    dx = x1 - x0
+    dy = y1 - y0
+    tmin = np.zeros(x0.shape)
+    tmax = np.ones(x0.shape)
+    hit = np.ones(x0.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, x0 - minx), (dx, maxx - x0),
+                     (-dy, y0 - miny), (dy, maxy - y0)):
+            # Segments parallel to this edge, and outside of it:
+            hit &= ~((p == 0) & (q < 0))
+            r = q / p
+            tmin = np.where(p < 0, np.maximum(tmin, r), tmin)
+            tmax = np.where(p > 0, np.minimum(tmax, r), tmax)
+    return hit & (tmin <= tmax)
+
+
+def filter_tracks_domain(df, minlon=90, maxlon=180, minlat=-40, maxlat=0):
+    """
+    Takes a `DataFrame` and filters on the basis of whether the track interscts
+    the given domain, which is specified by the minimum and maximum longitude
+    and latitude.
+
+    NOTE: This assumes the tracks and bounding box are in the same geographic
+    coordinate system (i.e. generally a latitude-longitude coordinate system).
+    It will NOT support different projections (e.g. UTM data for the bounds and
+    geographic for the tracks).
+
+    Tracks with only one point are retained if the point lies within (or on
+    the boundary of) the domain.
+
+    :param df: :class:`pandas.DataFrame` that holds the TCLV data
+    :param float minlon: minimum longitude of the bounding box
+    :param float minlat: minimum latitude of the bounding box
+    :param float maxlon: maximum longitude of the bounding box
+    :param float maxlat: maximum latitude of the bounding box
+    """
+    num = df['num'].to_numpy()
+    order, starts, lengths = track_index(num)
+    lon = df['lon'].to_numpy(dtype=float)
+    lat = df['lat'].to_numpy(dtype=float)
+    if order is not None:
+        num, lon, lat = num[order], lon[order], lat[order]
+    if len(num) == 0:
+        return df
+
+    # Segment from each point to the next point of the same track. The last
+    # point of each track becomes a degenerate segment, which only counts for
+    # single-point tracks:
+    ends = starts + lengths - 1
+    nxt = np.arange(1, len(num) + 1)
+    nxt[ends] = ends
+    hit = segments_intersect_box(lon, lat, lon[nxt], lat[nxt],
+                                 minlon, maxlon, minlat, maxlat)
+    hit[ends[lengths > 1]] = False
+    keep = np.logical_or.reduceat(hit, starts)
+    filterdf = df[df['num'].isin(num[starts][keep])]
+    return filterdf
+
+
+def max_wind_inputs(df, dtname='datetime'):
+    """
+    Build the track index and time step arrays passed to the TCRM
+    `maxWindSpeed` function.
+
+    The index is 1 at the first point of each track (where `num` changes) and
+    0 elsewhere. The time step is the time since the previous record in whole
+    hours (zero for the first record), calculated with array arithmetic
+    rather than per-row conversion of the timedeltas.
+
+    :param df: :class:`pandas.DataFrame` with `num` and `dtname` fields
+    :param str dtname: Name of the datetime field
+
+    :returns: tuple of (index, time step) :class:`numpy.ndarray`
+    """
+    idx = df['num'].to_numpy()
+    varidx = np.ones(len(idx))
+    varidx[1:][idx[1:] == idx[:-1]] = 0
+
+    times = pd.to_datetime(df[dtname]).to_numpy()
+    dt = np.zeros(len(times), dtype='int64')
+    dt[1:] = (np.diff(times) / np.timedelta64(1, 'h')).astype('int64')
+    return varidx, dt % (24*60)
+
+
+def calculate_max_wind(data, dtname='datetime', gustfactor=1.0):
+    """
+    Calculate a maximum wind speed based on the central pressure deficit and
+    the wind-pressure relation defined in Holland (2008), using the
+    `maxWindSpeed` function from the TCRM code base.
+
+    `data` can be a single :class:`pandas.DataFrame`, or a :class:`dict` of
+    them (e.g. all members of an ensemble). All members are concatenated so
+    `maxWindSpeed` is called once, and the resulting `vmax` values are
+    assigned back to each member. The first record of each member always
+    starts a new track.
+
+    :param data: :class:`pandas.DataFrame` or :class:`dict` of
+        :class:`pandas.DataFrame` with `num`, `lon`, `lat`, `pmin`, `poci`
+        and `dtname` fields
+    :param str dtname: Name of the datetime field
+    :param float gustfactor: Gust factor passed to `maxWindSpeed`
+
+    :returns: `data`, with an additional (or updated) `vmax` field in each
+        :class:`pandas.DataFrame`
+    """
+    from Utilities.loadData import maxWindSpeed
+
+    if isinstance(data, pd.DataFrame):
+        return calculate_max_wind({None: data}, dtname, gustfactor)[None]
+
+    LOGGER.debug(f"Calculating maximum wind speed for {len(data)} member(s)")
+    members = list(data.values())
+    lengths = [len(df) for df in members]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    if offsets[-1] == 0:
+        for df in members:
+            df['vmax'] = np.zeros(0)
+        return data
+
+    inputs = [max_wind_inputs(df, dtname) for df in members]
+    varidx = np.concatenate([i[0] for i in inputs])
+    dt = np.concatenate([i[1] for i in inputs])
+    cols = {col: np.concatenate([df[col].to_numpy(dtype=float)
+                                 for df in members])
+            for col in ['lon', 'lat', 'pmin', 'poci']}
+
+    vmax = maxWindSpeed(varidx, dt, cols['lon'], cols['lat'],
+                        cols['pmin'], cols['poci'], gustfactor=gustfactor)
+
+    for df, i0, i1 in zip(members, offsets[:-1], offsets[1:]):
+        df['vmax'] = vmax[i0:i1]
+    return data
+
+
+def find_track_files(dataPath, exclude=TCLV_EXCLUDE):
+    """
+    Find the TCLV track files in a directory.
+
+    :param str dataPath: Path to the directory that contains the TCLV track
+        files
+    :param exclude: Collection of file names to ignore
+
+    :returns: list of (label, filename) tuples, sorted by label. Labels are
+        "<model> <RCP>", e.g. "CNRM-CM5Q RCP85".
+    """
+    trackfiles = []
+    for fname in os.listdir(dataPath):
+        if fname in exclude:
+            continue
+        m = re.match(TCLV_REGEX, fname)
+        if m:
+            model, rcp = m.group(1, 2)
+            trackfiles.append((f"{model} {rcp.upper()}",
+                               pjoin(dataPath, fname)))
+        else:
+            LOGGER.debug(
+                f"{fname} does not match the expected pattern. Skipping...")
+    return sorted(trackfiles)
+
+
+def load_filtered_track_file(filename, start_year=None, end_year=None,
+                             domain=None):
+    """
+    Load a TCLV track file and apply the time period and domain filters.
+
+    :param str filename: Path to a TCLV data file
+    :param int start_year: beginning of the time period (year)
+    :param int end_year: end of the time period (year)
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+        that describes the bounding domain.
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    df = load_track_file(filename)
+    if start_year is not None:
+        df = filter_tracks(df, start_year, end_year)
+    if domain is not None:
+        df = filter_tracks_domain(df, *domain)
+    return df
+
+
+def load_ensemble(dataPath, start_year=None, end_year=None, domain=None,
+                  processes=None):
+    """
+    Load all TCLV track files in a directory, for a given year range and a
+    geographic domain.
+
+    If `processes` is greater than one, the files are loaded and filtered by
+    a pool of worker processes. Results are collected as each file is
+    completed, but are always returned in the same (sorted) model order.
+
+    :param str dataPath: Path to the directory that contains the TCLV track
+        files
+    :param int start_year: beginning of the time period (year)
+    :param int end_year: end of the time period (year)
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+        that describes the bounding domain.
+    :param int processes: Number of worker processes. `None` or 1 loads the
+        files sequentially in this process.
+
+    :returns: :class:`dict` of :class:`pandas.DataFrame`, with keys of
+        "<model> <RCP>"
+
+    :raises RuntimeError: if any of the files could not be loaded. Each
+        failure is logged individually.
+    """
+    if not os.path.isdir(dataPath):
+        LOGGER.error(f"{dataPath} is not a valid directory")
+        raise OSError(f"{dataPath} is not a valid directory")
+
+    if start_year is not None or end_year is not None:
+        if start_year is None or end_year is None:
+            raise ValueError(
+                "must supply both start year and end year or none")
+        if start_year > end_year:
+            raise ValueError(
+                f"Start year {start_year} is greater than end year {end_year}")
+
+    LOGGER.info(f"Loading TCLV data from {dataPath}")
+    trackfiles = find_track_files(dataPath)
+    results = {}
+    failed = []
+    if processes is None or processes <= 1:
+        for label, filename in trackfiles:
+            try:
+                results[label] = load_filtered_track_file(
+                    filename, start_year, end_year, domain)
+            except Exception:
+                LOGGER.exception(f"Failed to load {filename}")
+                failed.append(filename)
+    else:
+        LOGGER.info(f"Loading {len(trackfiles)} files "
+                    f"with {processes} processes")
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(load_filtered_track_file, filename,
+                                       start_year, end_year, domain):
+                       (label, filename)
+                       for label, filename in trackfiles}
+            for future in as_completed(futures):
+                label, filename = futures[future]
+                try:
+                    results[label] = future.result()
+                except Exception:
+                    LOGGER.exception(f"Failed to load {filename}")
+                    failed.append(filename)
+                else:
+                    LOGGER.debug(f"Loaded {label} "
+                                 f"({len(results[label])} records)")
+
+    if failed:
+        raise RuntimeError(f"Failed to load {len(failed)} TCLV file(s): "
+                           f"{', '.join(sorted(failed))}")
+
+    return {label: results[label] for label, _ in trackfiles}
+
+
+def _read_chunks(filename, chunksize):
+    """
+    Read a track file in chunks of rows. Both the whitespace-delimited TCLV
+    track files and the comma-delimited files (with a header row) written by
+    the bias correction and `merge_tracks.py` are supported.
+    """
+    with open(filename) as fh:
+        header = fh.readline()
+    if ',' in header:
+        reader = pd.read_csv(filename, chunksize=chunksize)
+    else:
+        reader = pd.read_csv(filename, sep=r'\s+', header=None,
+                             names=TCLV_COLUMNS, dtype=TCLV_DTYPES,
+                             chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            if 'datetime' in chunk:
+                chunk['datetime'] = pd.to_datetime(chunk['datetime'])
+            else:
+                chunk = _insert_datetime(chunk)
+            yield chunk
+
+
+def _process_batch(batch, derive, start_year, end_year, domain):
+    """
+    Add derived fields to, and filter, a batch of complete tracks.
+
+    Tracks in a batch are contiguous runs of `num`, but the same track
+    number can be used by more than one track (e.g. for different members of
+    a merged ensemble). The runs are relabelled while the fields are derived
+    and the tracks filtered, then the original track numbers are restored.
+    """
+    num = batch['num'].to_numpy()
+    newtrack = np.ones(len(num), dtype=bool)
+    newtrack[1:] = num[1:] != num[:-1]
+    original = pd.Series(num, index=batch.index)
+    batch['num'] = np.cumsum(newtrack)
+
+    if derive:
+        batch = derive_track_fields(batch)
+    if start_year is not None:
+        batch = filter_tracks(batch, start_year, end_year)
+    if domain is not None:
+        batch = filter_tracks_domain(batch, *domain)
+
+    batch = batch.copy()
+    batch['num'] = original.loc[batch.index].to_numpy()
+    return batch
+
+
+def iter_tracks(filename, ntracks=1, chunksize=100000, derive=True,
+                start_year=None, end_year=None, domain=None):
+    """
+    Read a track file incrementally, yielding complete tracks. This keeps
+    the memory used to process very large files (such as the merged ensemble
+    files written by `merge_tracks.py`) bounded by the chunk and batch size,
+    rather than the size of the file.
+
+    The file is read in chunks of `chunksize` rows. Each track is a
+    contiguous run of rows with the same track number (`num`), and a track
+    is never split across batches - the rows of a track that continues into
+    the next chunk are held over until the track is complete. The derived
+    fields and the time period and domain filters are applied to each batch.
+    Batches where all tracks are removed by the filters are not yielded.
+
+    Unlike :func:`load_track_file`, the points of a track must be contiguous
+    in the file.
+
+    :param str filename: Path to a track file, either a TCLV data file or a
+        comma-delimited file with a header row
+    :param int ntracks: Number of tracks in each batch. The last batch may
+        have fewer tracks.
+    :param int chunksize: Number of rows to read from the file at a time
+    :param bool derive: Add the `dt`, `age`, `pdiff` and `ni` fields (see
+        :func:`derive_track_fields`) to each batch. This is required for
+        filtering by time period.
+    :param int start_year: beginning of the time period (year)
+    :param int end_year: end of the time period (year)
+    :param tuple domain: Tuple of (min(lon), max(lon), min(lat), max(lat))
+        that describes the bounding domain.
+
+    :returns: generator of :class:`pandas.DataFrame`, each holding up to
+        `ntracks` complete tracks. The index is the row number in the file.
+    """
+    if ntracks < 1:
+        raise ValueError("Number of tracks per batch must be positive")
+    if (start_year is None) != (end_year is None):
+        raise ValueError("must supply both start year and end year or none")
+
+    def _emit(batch):
+        batch = _process_batch(batch, derive, start_year, end_year, domain)
+        return batch if len(batch) else None
+
+    pending = None
+    for chunk in _read_chunks(filename, chunksize):
+        if pending is not None and len(pending):
+            chunk = pd.concat([pending, chunk])
+        num = chunk['num'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, num[1:] != num[:-1]])
+
+        # The last track may continue into the next chunk, so only the
+        # tracks before it are complete:
+        nbatches = (len(starts) - 1) // ntracks
+        bounds = starts[:nbatches * ntracks + 1:ntracks]
+        for i0, i1 in zip(bounds[:-1], bounds[1:]):
+            batch = _emit(chunk.iloc[i0:i1].copy())
+            if batch is not None:
+                yield batch
+        pending = chunk.iloc[bounds[-1]:]
+
+    if pending is not None and len(pending):
+        batch = _emit(pending.copy())
+        if batch is not None:
+            yield batch
+
+
+# Extensions of the output formats of :class:`TrackWriter`:
+MERGED_FORMATS = {'csv': '.dat', 'feather': '.arrow'}
+
+
+def shift_years(times, years):
+    """
+    Shift datetimes by a whole number of years. The month, day and time of
+    day are unchanged, except that 29 February becomes 28 February in a year
+    that is not a leap year (the same as :class:`pandas.DateOffset`).
+
+    :param times: `numpy.array` of `datetime64` values
+    :param int years: Number of years to add
+
+    :returns: `numpy.array` of `datetime64[ns]` values
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    if years == 0:
+        return times.copy()
+    months = times.astype('datetime64[M]')
+    days = times.astype('datetime64[D]')
+    tod = times - days
+    day = (days - months.astype('datetime64[D]')).astype(int)
+    month = months.astype(int) % 12
+    year = months.astype(int) // 12 + 1970 + years
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    day[(month == 1) & (day == 28) & ~leap] = 27
+    newmonths = ((year - 1970) * 12 + month).astype('datetime64[M]')
+    return newmonths.astype('datetime64[D]') + day + tod
+
+
+class TrackWriter(object):
+    """
+    Write a track collection incrementally, one `DataFrame` at a time, so
+    the full collection is never held in memory.
+
+    The output formats are "csv" (comma-separated text with a header row)
+    and "feather" (an uncompressed Arrow IPC file, which requires `pyarrow`).
+    The column types of the Arrow file are set by the first `DataFrame`
+    written.
+
+    Use as a context manager::
+
+        with TrackWriter("GROUP1_RCP45_2081-2100", ['csv', 'feather']) as w:
+            for df in members:
+                w.write(df)
+
+    :param str basename: Path of the output files, without the extension
+    :param formats: Output format, or list of formats
+    """
+
+    def __init__(self, basename, formats='csv'):
+        if isinstance(formats, str):
+            formats = [formats]
+        for fmt in formats:
+            if fmt not in MERGED_FORMATS:
+                raise ValueError(f"Unknown output format: {fmt}")
+        self.filenames = {fmt: basename + MERGED_FORMATS[fmt]
+                          for fmt in formats}
+        self.nrows = 0
+        self._header = True
+        self._schema = None
+        self._sink = None
+        self._writer = None
+        if 'feather' in self.filenames:
+            import pyarrow  # noqa: F401
+        if 'csv' in self.filenames:
+            # Truncate any existing file:
+            open(self.filenames['csv'], 'w').close()
+
+    def write(self, df):
+        """
+        Append a `DataFrame` to the output files.
+
+        :param df: :class:`pandas.DataFrame`
+        """
+        if 'csv' in self.filenames:
+            df.to_csv(self.filenames['csv'], mode='a', header=self._header,
+                      index=False)
+        if 'feather' in self.filenames:
+            import pyarrow as pa
+            if self._writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema.remove_metadata()
+                self._sink = pa.OSFile(self.filenames['feather'], 'wb')
+                self._writer = pa.ipc.new_file(self._sink, self._schema)
+            table = pa.Table.from_pandas(df, schema=self._schema,
+                                         preserve_index=False)
+            self._writer.write_table(table)
+        self._header = False
+        self.nrows += len(df)
+
+    def close(self):
+        """Finish writing the output files"""
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_merged_tracks(filename, columns=None):
+    """
+    Read a track collection written by :class:`TrackWriter`. Arrow files are
+    memory-mapped, so the columns are only read from disk when they are
+    used.
+
+    :param str filename: Path to a ".arrow" or csv (".dat") file
+    :param list columns: Only read these columns
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    if filename.endswith(MERGED_FORMATS['feather']):
+        import pyarrow as pa
+        with pa.memory_map(filename) as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+    dates = ['datetime'] if columns is None or 'datetime' in columns else []
+    return pd.read_csv(filename, usecols=columns, parse_dates=dates)
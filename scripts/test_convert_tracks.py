@@ -0,0 +1,131 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import convert_tracks
+from test_trackio import make_tracks, write_grouped
+
+np.random.seed(seed=7263)
+
+
+class TestConvertTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmpdir, 'input')
+        self.output = os.path.join(self.tmpdir, 'output')
+        self.tracks = {}
+        for name in ['GROUP1_RCP45_2021-2040', 'GROUP1_RCP85_2021-2040']:
+            trackpath = os.path.join(self.input, name, 'tracks')
+            os.makedirs(trackpath)
+            for i in range(3):
+                filename = os.path.join(trackpath, f'tracks.{i:05d}.nc')
+                self.tracks[filename] = make_tracks(4)
+                write_grouped(filename, self.tracks[filename])
+        self.kwds = dict(groups=['GROUP1'], rcps=['RCP45', 'RCP85'],
+                         periods=['2021-2040', '2041-2060'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def archive_members(self, name):
+        with tarfile.open(os.path.join(self.output, f'{name}.tar.gz')) as tar:
+            return sorted(tar.getnames())
+
+    def testDiscover(self):
+        """Test the track files of each scenario are found"""
+        scenarios = convert_tracks.discover(self.input, **self.kwds)
+        self.assertEqual(sorted(scenarios), ['GROUP1_RCP45_2021-2040',
+                                             'GROUP1_RCP85_2021-2040'])
+        self.assertEqual(sum(len(v) for v in scenarios.values()), 6)
+
+    def testConvert(self):
+        """Test the files are converted and archived"""
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            **self.kwds)
+        self.assertEqual(counts, {'GROUP1_RCP45_2021-2040': 3,
+                                  'GROUP1_RCP85_2021-2040': 3})
+        self.assertEqual(self.archive_members('GROUP1_RCP45_2021-2040'),
+                         [f'tracks.{i:05d}.csv' for i in range(3)])
+        for filename, tracks in self.tracks.items():
+            name = filename.split(os.sep)[-3]
+            csvfile = convert_tracks.output_name(
+                filename, os.path.join(self.output, name))
+            df = pd.read_csv(csvfile)
+            data = np.concatenate(tracks)
+            self.assertEqual(len(df), len(data))
+            np.testing.assert_allclose(df['CentralPressure'],
+                                       data['CentralPressure'])
+            self.assertEqual(df['Datetime'][0], '1980-12-30 08:00:00')
+
+    def testUpToDate(self):
+        """Test unchanged files are skipped and changed files converted"""
+        convert_tracks.convert_all(self.input, self.output, **self.kwds)
+        tarname = os.path.join(self.output, 'GROUP1_RCP45_2021-2040.tar.gz')
+        mtime = os.path.getmtime(tarname)
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            **self.kwds)
+        self.assertEqual(sum(counts.values()), 0)
+        self.assertEqual(os.path.getmtime(tarname), mtime)
+
+        changed = sorted(self.tracks)[4]
+        write_grouped(changed, make_tracks(2))
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            **self.kwds)
+        self.assertEqual(counts, {'GROUP1_RCP45_2021-2040': 0,
+                                  'GROUP1_RCP85_2021-2040': 1})
+        self.assertEqual(self.archive_members('GROUP1_RCP85_2021-2040'),
+                         [f'tracks.{i:05d}.csv' for i in range(3)])
+        manifest = convert_tracks.read_manifest(
+            os.path.join(self.output, 'GROUP1_RCP85_2021-2040'))
+        self.assertEqual(manifest[os.path.basename(changed)],
+                         convert_tracks.checksum(changed))
+
+    def testStaleArchive(self):
+        """Test an archive is rebuilt after files are converted without it"""
+        name = 'GROUP1_RCP85_2021-2040'
+        convert_tracks.convert_all(self.input, self.output, **self.kwds)
+        changed = sorted(self.tracks)[3]
+        write_grouped(changed, make_tracks(2))
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            archive=False, **self.kwds)
+        self.assertEqual(counts[name], 1)
+
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            **self.kwds)
+        self.assertEqual(sum(counts.values()), 0)
+        csvfile = convert_tracks.output_name(
+            changed, os.path.join(self.output, name))
+        tarname = os.path.join(self.output, f'{name}.tar.gz')
+        with tarfile.open(tarname) as tar:
+            member = tar.extractfile(os.path.basename(csvfile)).read()
+        with open(csvfile, 'rb') as fh:
+            self.assertEqual(member, fh.read())
+        state = convert_tracks.read_manifest(
+            os.path.join(self.output, name), convert_tracks.ARCHIVE_STATE)
+        self.assertEqual(state[os.path.basename(changed)],
+                         convert_tracks.checksum(changed))
+
+        # The archive is not rebuilt once it is up to date:
+        mtime = os.path.getmtime(tarname)
+        convert_tracks.convert_all(self.input, self.output, **self.kwds)
+        self.assertEqual(os.path.getmtime(tarname), mtime)
+
+    def testProcessPool(self):
+        """Test the conversion in a pool of processes"""
+        counts = convert_tracks.convert_all(self.input, self.output,
+                                            processes=2, fmt='parquet',
+                                            **self.kwds)
+        self.assertEqual(sum(counts.values()), 6)
+        self.assertEqual(self.archive_members('GROUP1_RCP85_2021-2040'),
+                         [f'tracks.{i:05d}.parquet' for i in range(3)])
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestConvertTracks, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy.stats import lognorm, norm, expon
+
+import distfit
+
+np.random.seed(seed=8123)
+
+
+class CountingDist(object):
+    """Wraps a distribution and counts the calls to `fit`"""
+
+    def __init__(self, dist):
+        self.dist = dist
+        self.name = dist.name
+        self.calls = 0
+
+    def fit(self, data, *args, **kwds):
+        self.calls += 1
+        return self.dist.fit(data, *args, **kwds)
+
+
+class TestFitCache(unittest.TestCase):
+    data = lognorm.rvs(0.5, scale=20, size=200)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dist = CountingDist(lognorm)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCachedFit(self):
+        """Test a repeated fit is taken from the cache"""
+        cache = distfit.FitCache()
+        expected = lognorm.fit(self.data, loc=0, scale=1)
+        for _ in range(3):
+            params = cache.fit(self.dist, self.data, loc=0, scale=1)
+            self.assertEqual(params, tuple(expected))
+        self.assertEqual(self.dist.calls, 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        # The key is the content of the sample, not the object:
+        cache.fit(self.dist, list(self.data), loc=0, scale=1)
+        self.assertEqual(self.dist.calls, 1)
+
+    def testKey(self):
+        """Test different samples, arguments and distributions are refitted"""
+        cache = distfit.FitCache()
+        cache.fit(self.dist, self.data, loc=0, scale=1)
+        cache.fit(self.dist, self.data[:-1], loc=0, scale=1)
+        cache.fit(self.dist, self.data, loc=1, scale=1)
+        self.assertEqual(self.dist.calls, 3)
+        params = cache.fit(norm, self.data)
+        self.assertEqual(len(params), 2)
+        self.assertEqual(len(cache), 4)
+
+    def testEviction(self):
+        """Test the least recently used fits are evicted"""
+        cache = distfit.FitCache(maxsize=2)
+        samples = [self.data + i for i in range(3)]
+        cache.fit(self.dist, samples[0], loc=0)
+        cache.fit(self.dist, samples[1], loc=0)
+        cache.fit(self.dist, samples[0], loc=0)
+        cache.fit(self.dist, samples[2], loc=0)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(self.dist.calls, 3)
+        cache.fit(self.dist, samples[0], loc=0)
+        self.assertEqual(self.dist.calls, 3)
+        cache.fit(self.dist, samples[1], loc=0)
+        self.assertEqual(self.dist.calls, 4)
+
+    def testStore(self):
+        """Test fits are reused from the persistent store"""
+        cachedir = os.path.join(self.tmpdir, 'fits')
+        expected = distfit.FitCache(cachedir=cachedir).fit(
+            self.dist, self.data, loc=0, scale=1)
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+        cache = distfit.FitCache(cachedir=cachedir)
+        self.assertEqual(cache.fit(self.dist, self.data, loc=0, scale=1),
+                         expected)
+        self.assertEqual(self.dist.calls, 1)
+
+    def testDefaultCache(self):
+        """Test the module level function uses the shared cache"""
+        distfit.DEFAULT_CACHE.clear()
+        distfit.fit(self.dist, self.data, loc=0)
+        distfit.fit(self.dist, self.data, loc=0)
+        self.assertEqual(self.dist.calls, 1)
+        self.assertEqual(distfit.DEFAULT_CACHE.hits, 1)
+
+
+class TestClosedForm(unittest.TestCase):
+    data = lognorm.rvs(0.5, scale=20, size=500)
+
+    def assertParamsAlmostEqual(self, result, expected):
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            self.assertAlmostEqual(r, e, places=6)
+
+    def testLognormFixedLocation(self):
+        """Test the analytic lognormal fit matches scipy"""
+        cache = distfit.FitCache()
+        for kwds in [dict(floc=0), dict(floc=0, loc=0, scale=1),
+                     dict(floc=0, fscale=20), dict(floc=0, f0=0.4),
+                     dict(floc=1.5)]:
+            params, method = cache.fit(lognorm, self.data, full_output=True,
+                                       **kwds)
+            self.assertEqual(method, distfit.ANALYTIC)
+            self.assertParamsAlmostEqual(params, lognorm.fit(self.data,
+                                                             **kwds))
+        self.assertEqual(cache.methods[distfit.ANALYTIC], 5)
+
+    def testOtherDistributions(self):
+        """Test the analytic exponential and normal fits match scipy"""
+        for dist, kwds in [(expon, dict(floc=0)), (norm, {})]:
+            params, method = distfit.fit_distribution(dist, self.data, **kwds)
+            self.assertEqual(method, distfit.ANALYTIC)
+            self.assertParamsAlmostEqual(params, dist.fit(self.data, **kwds))
+
+    def testOptimiser(self):
+        """Test fits without a closed form use the optimiser"""
+        for kwds in [dict(loc=0, scale=1), dict(fscale=20)]:
+            params, method = distfit.fit_distribution(lognorm, self.data,
+                                                      **kwds)
+            self.assertEqual(method, distfit.OPTIMISER)
+        params, method = distfit.fit_distribution(lognorm, self.data, 0.5,
+                                                  floc=0)
+        self.assertEqual(method, distfit.OPTIMISER)
+
+
+class TestFitTable(unittest.TestCase):
+    datadict = {f"M{i} RCP{45 if i % 2 else 85}":
+                pd.DataFrame({'pdiff': lognorm.rvs(0.6, scale=12,
+                                                   size=40 + 30 * i)})
+                for i in range(5)}
+    bins = np.arange(0, 100, 5)
+
+    def testStackModels(self):
+        """Test the model data are stacked into a long table"""
+        df = distfit.stack_models(self.datadict, period='1981-2010', bc=True)
+        self.assertEqual(list(df.columns),
+                         ['Model', 'RCP', 'period', 'bc', 'value'])
+        self.assertEqual(len(df), sum(len(v) for v in self.datadict.values()))
+        self.assertEqual(list(df['Model'].unique()),
+                         [f"M{i}" for i in range(5)])
+
+    def testTable(self):
+        """Test the grouped fits and histograms match each group alone"""
+        df = pd.concat([
+            distfit.stack_models(self.datadict, period='1981-2010', bc=False),
+            distfit.stack_models(self.datadict, period='2081-2100', bc=True)],
+            ignore_index=True)
+        table = distfit.fit_table(df, bins=self.bins, loc=0, scale=1)
+        self.assertEqual(len(table), 10)
+        self.assertEqual(list(table.columns[:7]),
+                         ['Model', 'RCP', 'period', 'bc', 'mu', 'sigma',
+                          'zeta'])
+        self.assertEqual(list(table.columns[7:]), self.bins[:-1].tolist())
+        for i, (m, data) in enumerate(self.datadict.items()):
+            row = table.iloc[i]
+            self.assertEqual(f"{row['Model']} {row['RCP']}", m)
+            h, _ = np.histogram(data.pdiff, bins=self.bins, density=True)
+            np.testing.assert_array_equal(
+                row.iloc[7:].to_numpy(dtype=float), h)
+            params = lognorm.fit(data.pdiff, loc=0, scale=1)
+            np.testing.assert_allclose(
+                row[['mu', 'sigma', 'zeta']].to_numpy(dtype=float), params)
+
+
+if __name__ == "__main__":
+    testSuite = unittest.TestSuite([
+        unittest.makeSuite(TestFitCache, 'test'),
+        unittest.makeSuite(TestClosedForm, 'test'),
+        unittest.makeSuite(TestFitTable, 'test')])
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
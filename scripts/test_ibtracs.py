@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import ibtracs
+from tclv import filter_tracks_domain
+
+np.random.seed(seed=1432)
+
+
+def make_ibtracs_file(filename, ntracks=40):
+    """
+    Write a synthetic IBTrACS v04 csv file, with a row of units after the
+    header and blank (' ') missing values.
+    """
+    rows = []
+    for n in range(ntracks):
+        sid = f"{1980 + n // 4}{n:03d}S{n:05d}"
+        npoints = np.random.randint(1, 20)
+        lon0, lat0 = np.random.uniform(100, 190), np.random.uniform(-40, 0)
+        basin = ['SP', 'SI', 'NA', 'WP'][n % 4]
+        start = pd.Timestamp(1980 + n // 4, 1 + n % 12, 3)
+        for i in range(npoints):
+            pres = np.random.uniform(950, 1005)
+            poci = ' ' if np.random.rand() < 0.1 else f"{1008.0:.1f}"
+            rows.append({'SID': sid, 'SEASON': 1980 + n // 4,
+                         'NUMBER': n, 'BASIN': basin, 'SUBBASIN': 'MM',
+                         'NAME': 'TEST',
+                         'ISO_TIME': str(start + pd.Timedelta(hours=3 * i)),
+                         'NATURE': 'TS', 'LAT': f"{lat0 - 0.8 * i:.2f}",
+                         'LON': f"{lon0 + 1.5 * i:.2f}",
+                         'WMO_WIND': ' ', 'WMO_PRES': f"{pres:.1f}",
+                         'BOM_WIND': ' ', 'BOM_POCI': poci})
+    df = pd.DataFrame(rows)
+    units = pd.DataFrame([{c: ' ' for c in df.columns}])
+    pd.concat([units, df]).to_csv(filename, index=False)
+
+
+class TestLoadIbtracs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'ibtracs.test.csv')
+        make_ibtracs_file(self.filename)
+        self.domain = (135, 160, -25, -10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def obstc(self, best):
+        """Apply the point and track filters used for the observed data"""
+        best = best[best.poci.notnull() & best.pmin.notnull()]
+        best = best.assign(pdiff=best.poci - best.pmin)
+        best = best[best.pdiff > 1]
+        return filter_tracks_domain(best, *self.domain).reset_index(drop=True)
+
+    def testDomain(self):
+        """Test the domain subset gives the same tracks as the full data"""
+        full = ibtracs.load_ibtracs(self.filename, cache=False)
+        self.assertEqual(full['num'].nunique(), 40)
+        self.assertIn('NA', full['basin'].unique())
+        expected = self.obstc(full)
+        result = self.obstc(ibtracs.load_ibtracs(self.filename, self.domain,
+                                                 cache=False))
+        pd.testing.assert_frame_equal(result, expected)
+
+    def testCache(self):
+        """Test cached extracts give the same data"""
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("No parquet engine available")
+        expected = ibtracs.load_ibtracs(self.filename, self.domain,
+                                        cache=False)
+        # First load builds the extract, second builds the subset from the
+        # extract and the third reads the cached subset:
+        for i in range(3):
+            if i == 1:
+                os.remove(ibtracs._cache_file(
+                    self.filename, None,
+                    ibtracs._cache_key(self.filename, domain=self.domain,
+                                       basins=None, seasons=None)))
+            result = ibtracs.load_ibtracs(self.filename, self.domain)
+            pd.testing.assert_frame_equal(result, expected,
+                                          check_dtype=False)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.tmpdir, ibtracs.CACHE_DIR))), 2)
+
+    def testFilters(self):
+        """Test basin and season filters"""
+        full = ibtracs.load_ibtracs(self.filename, cache=False)
+        for cache in [False, True]:
+            df = ibtracs.load_ibtracs(self.filename, basins=['SP', 'SI'],
+                                      seasons=(1982, 1985), cache=cache)
+            expected = full[full['basin'].isin(['SP', 'SI']) &
+                            full['season'].between(1982, 1985)]
+            pd.testing.assert_frame_equal(df, expected.reset_index(drop=True),
+                                          check_dtype=False)
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestLoadIbtracs, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
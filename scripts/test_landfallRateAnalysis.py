@@ -0,0 +1,220 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import LineString, Point
+
+import landfallRateAnalysis as lra
+from test_trackio import make_tracks, write_grouped
+
+np.random.seed(seed=90210)
+
+
+class TestReadTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'tracks.nc')
+        self.tracks = make_tracks(10)
+        write_grouped(self.filename, self.tracks)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSegments(self):
+        """Test the segments match a loop over the tracks"""
+        segments = lra.readTracks(self.filename)
+        expected = []
+        for i, t in enumerate(self.tracks):
+            for n in range(len(t) - 1):
+                expected.append((i, t['Longitude'][n], t['Latitude'][n],
+                                 t['Longitude'][n + 1], t['Latitude'][n + 1],
+                                 t['CentralPressure'][n]))
+        result = segments[['track', 'x0', 'y0', 'x1', 'y1',
+                           'CentralPressure']].itertuples(index=False)
+        self.assertEqual([tuple(r) for r in result], expected)
+
+    def testCategory(self):
+        """Test the categories match the pressure bins"""
+        pressure = np.array([920., 930., 931., 955., 970.5, 985., 989.,
+                             990., 995., 1020., 1021.])
+        expected = pd.cut(pressure, bins=lra.CATEGORY_BINS,
+                          labels=lra.CATEGORY_LABELS)
+        expected = np.asarray(expected.astype(float))
+        result = lra.pressureCategory(pressure)
+        np.testing.assert_array_equal(np.where(result < 0, np.nan, result),
+                                      expected)
+
+    def testGeometry(self):
+        """Test the segment geometries are created on request"""
+        segments = lra.readTracks(self.filename)
+        self.assertNotIn('geometry', segments)
+        gdf = lra.toGeoDataFrame(segments)
+        self.assertIsInstance(gdf, gpd.GeoDataFrame)
+        for row in gdf.head(20).itertuples():
+            self.assertTrue(row.geometry.equals(
+                LineString([(row.x0, row.y0), (row.x1, row.y1)])))
+
+
+def make_gates(ngates=48):
+    """Gates along a line of latitude, each 2 degrees wide"""
+    x = 110 + 2 * np.arange(ngates + 1)
+    geometry = [LineString([(x[i + 1], -20.), (x[i], -20.)])
+                for i in range(ngates)]
+    return gpd.GeoDataFrame({'gate': np.arange(ngates)}, geometry=geometry)
+
+
+def make_segments(n=3000):
+    """Random track segments, some crossing the gates"""
+    x0 = np.random.uniform(105, 215, n)
+    y0 = np.random.uniform(-25, -15, n)
+    segments = pd.DataFrame({'x0': x0, 'y0': y0,
+                             'x1': x0 + np.random.normal(0, 2, n),
+                             'y1': y0 + np.random.normal(0, 2, n),
+                             'CentralPressure':
+                                 np.random.uniform(920, 1010, n)})
+    segments['category'] = lra.pressureCategory(segments['CentralPressure'])
+    return segments
+
+
+class TestCrossings(unittest.TestCase):
+
+    def setUp(self):
+        self.gates = make_gates()
+        self.segments = make_segments()
+
+    def reference(self, gate):
+        """Crossings of a gate, with shapely predicates"""
+        gdf = lra.toGeoDataFrame(self.segments)
+        crossings = gdf.crosses(gate)
+        return [i for i in np.flatnonzero(crossings)
+                if lra.isLeft(gate, Point(gdf.geometry.iloc[i].coords[0]))]
+
+    def testCrossings(self):
+        """Test the crossings match the shapely predicates"""
+        gateindex, seg = lra.findCrossings(self.gates, self.segments,
+                                           chunksize=500)
+        self.assertTrue(len(seg) > 0)
+        for i, gate in enumerate(self.gates.geometry):
+            self.assertEqual(list(seg[gateindex == i]), self.reference(gate))
+
+    def testMultipartGate(self):
+        """Test gates with more than two vertices"""
+        gates = gpd.GeoDataFrame(geometry=[
+            LineString([(150, -20), (140, -20), (130, -22)])])
+        gateindex, seg = lra.findCrossings(gates, self.segments)
+        self.assertEqual(list(seg), self.reference(gates.geometry[0]))
+
+    def testCountCrossings(self):
+        """Test the gate statistics"""
+        gates = lra.countCrossings(self.gates.copy(), self.segments, 3)
+        self.assertTrue((gates['sim'] == 3).all())
+        for i, gate in enumerate(self.gates.geometry):
+            l = self.segments.iloc[self.reference(gate)]
+            row = gates.iloc[i]
+            self.assertEqual(row['count'], len(l))
+            if len(l) == 0:
+                self.assertTrue(np.isnan(row['meanlfintensity']))
+                continue
+            self.assertAlmostEqual(row['meanlfintensity'],
+                                   l['CentralPressure'].mean())
+            self.assertEqual(row['minlfintensity'], l['CentralPressure'].min())
+            cathist, _ = np.histogram(l['category'], bins=range(7))
+            self.assertEqual(list(row[['cat1', 'cat2', 'cat3', 'cat4',
+                                       'cat5']]), list(cathist[1:]))
+
+
+class TestGateSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.gates = make_gates(6)
+        self.sims = []
+        for sim in range(40):
+            segments = make_segments(300)
+            gateindex, seg = lra.findCrossings(self.gates, segments)
+            self.sims.append(lra.gateStatistics(
+                len(self.gates), gateindex,
+                segments['CentralPressure'].to_numpy()[seg],
+                segments['category'].to_numpy()[seg]))
+
+    def reference(self):
+        """Summary statistics of the table of all simulations"""
+        df = pd.concat([pd.DataFrame(dict(stats, gate=np.arange(6)))
+                        for stats in self.sims])
+        funcs = {'sum': 'sum', 'nanmean': 'mean', 'nanstd': 'std',
+                 'min': 'min', 'max': 'max'}
+        grouped = df.groupby('gate')
+        columns = {}
+        for key, names in lra.SUMMARY_STATS.items():
+            for name in names:
+                if name in lra.QUANTILES:
+                    values = grouped[key].quantile(lra.QUANTILES[name])
+                else:
+                    values = grouped[key].agg(funcs[name])
+                columns[f"{key}_{name}"] = values.to_numpy(dtype=float)
+        return pd.DataFrame(columns)
+
+    def testSummary(self):
+        """Test the streaming summary matches the grouped table"""
+        summary = lra.GateSummary(6)
+        for stats in self.sims:
+            summary.update(stats)
+        self.assertEqual(summary.nsims, 40)
+        result = summary.summary()
+        pd.testing.assert_frame_equal(result.astype(float), self.reference(),
+                                      check_exact=False)
+
+    def testMerge(self):
+        """Test merging summaries of separate simulations"""
+        parts = [lra.GateSummary(6), lra.GateSummary(6)]
+        for i, stats in enumerate(self.sims):
+            parts[i % 2].update(stats)
+        summary = parts[0].merge(parts[1])
+        pd.testing.assert_frame_equal(summary.summary().astype(float),
+                                      self.reference(), check_exact=False)
+
+
+class TestLandfallStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filelist = []
+        for i in range(4):
+            filename = os.path.join(self.tmpdir, f'tracks.{i:05d}.nc')
+            tracks = make_tracks(30)
+            for t in tracks:
+                # Move the tracks south of the gates, heading north from the
+                # left of the gates, so some cross them:
+                t['Latitude'] = -40 - t['Latitude'] + 2 * np.random.normal()
+                t['Longitude'] += np.random.uniform(-30, 70)
+            write_grouped(filename, tracks)
+            self.filelist.append(filename)
+        self.gates = make_gates()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testParallel(self):
+        """Test the parallel driver matches the simulations one at a time"""
+        summary = lra.landfallStatistics(self.filelist, self.gates,
+                                         processes=2)
+        expected = lra.GateSummary(len(self.gates))
+        for f in self.filelist:
+            gates = lra.countCrossings(self.gates.copy(), lra.readTracks(f), 0)
+            expected.update({key: gates[key].to_numpy()
+                             for key in lra.SUMMARY_STATS})
+        self.assertGreater(summary.stats['count'].sum.sum(), 0)
+        pd.testing.assert_frame_equal(summary.summary(), expected.summary())
+
+
+if __name__ == "__main__":
+    testSuite = unittest.TestSuite([
+        unittest.makeSuite(TestReadTracks, 'test'),
+        unittest.makeSuite(TestCrossings, 'test'),
+        unittest.makeSuite(TestGateSummary, 'test'),
+        unittest.makeSuite(TestLandfallStatistics, 'test')])
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+import merge_tracks
+from tclv import read_merged_tracks
+
+
+def write_track_file(filename, year):
+    pd.DataFrame({'num': [1, 1], 'year': [year, year],
+                  'datetime': [f"{year}-02-28 18:00:00",
+                               f"{year}-02-29 00:00:00" if year % 4 == 0
+                               else f"{year}-03-01 00:00:00"],
+                  'pdiff': [10., 12.]}).to_csv(filename, index=False)
+
+
+class TestMergeTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = Path(tempfile.mkdtemp())
+        self.indir = self.tmpdir / 'corrected'
+        self.outdir = self.tmpdir / 'ensemble'
+        os.makedirs(self.indir)
+        os.makedirs(self.outdir)
+        # Members of GROUP2, written in reverse order:
+        for member in reversed(merge_tracks.GROUPS['GROUP2'][:3]):
+            write_track_file(self.indir / f"{member}_RCP45_bc_tracks.csv",
+                             1984)
+            write_track_file(self.indir / f"{member}_RCP45_2081-2100.csv",
+                             2084)
+        write_track_file(self.indir / "OTHERQ_RCP45_2081-2100.csv", 2084)
+        (self.indir / "README").touch()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testIndex(self):
+        """Test files are indexed in the order of the group members"""
+        index, unmatched = merge_tracks.build_index(self.indir)
+        self.assertEqual(len(index), 2 * 2 * 5)
+        files = index[('GROUP2', 'RCP45', '2081-2100')]
+        self.assertEqual([f.name.split('_')[0] for f in files],
+                         merge_tracks.GROUPS['GROUP2'][:3])
+        self.assertEqual(len(index[('GROUP2', 'RCP45', '1981-2010')]), 3)
+        self.assertEqual([f.name for f in unmatched],
+                         ["OTHERQ_RCP45_2081-2100.csv", "README"])
+        self.assertTrue(merge_tracks.belongs('GROUP2', 'RCP45', '1981-2010',
+                                             files[0].with_name(
+                                                 "CCSM4Q_RCP45_bc.csv")))
+
+    def testMergeAll(self):
+        """Test the members are offset by whole periods"""
+        outfiles = merge_tracks.merge_all(self.indir, self.outdir)
+        self.assertEqual(sum(f is not None for f in outfiles), 2)
+        df = pd.read_csv(self.outdir / "GROUP2_RCP45_2081-2100.dat")
+        self.assertEqual(df['year'].tolist(), [2084, 2084, 2104, 2104,
+                                               2124, 2124])
+        self.assertEqual(pd.to_datetime(df['datetime']).dt.year.tolist(),
+                         df['year'].tolist())
+        self.assertEqual(df['datetime'].tolist()[1::2],
+                         ["2084-02-29 00:00:00", "2104-02-29 00:00:00",
+                          "2124-02-29 00:00:00"])
+        # 29 February 1984 is shifted to 28 February in 2014:
+        ref = pd.read_csv(self.outdir / "GROUP2_RCP45_1981-2010.dat")
+        self.assertEqual(ref['datetime'].tolist()[1::2],
+                         ["1984-02-29 00:00:00", "2014-02-28 00:00:00",
+                          "2044-02-29 00:00:00"])
+
+    def testFormats(self):
+        """Test the csv and Arrow outputs hold the same data"""
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not available")
+        index, _ = merge_tracks.build_index(self.indir)
+        key = ('GROUP2', 'RCP45', '2081-2100')
+        outfiles = merge_tracks.merge_tracks(*key, index[key],
+                                             str(self.outdir))
+        csv = read_merged_tracks(outfiles['csv'])
+        arrow = read_merged_tracks(outfiles['feather'])
+        pd.testing.assert_frame_equal(arrow, csv, check_dtype=False)
+        self.assertEqual(read_merged_tracks(outfiles['feather'],
+                                            ['year']).shape, (6, 1))
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestMergeTracks, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
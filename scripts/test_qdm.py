@@ -1,8 +1,11 @@
 import unittest
 import numpy as np
+import pandas as pd
 from scipy.stats import lognorm
 import NumpyTestCase
-from qdm import qdm
+from qdm import (qdm, qdm_numpy, qdm_batch, bootstrap_qdm, qdm_empirical,
+                 qdm_tables, qdm_apply)
+from tclv import load_ensemble
 
 np.random.seed(seed=233423)
 
@@ -32,12 +35,200 @@ class TestQDM(NumpyTestCase.NumpyTestCase):
     
     def testRefInput(self):
         """Test using reference data as future returns obs dist params"""
-        testqfut = qdm(self.obsdist, self.refdist, self.refdist)
+        testqfut = qdm(self.obsdist, self.refdist, self.refdist)[1]
         testp = lognorm.fit(testqfut)
         self.assertAlmostEqual(self.obsp[0], testp[0], places=2)
         self.assertAlmostEqual(self.obsp[1], testp[1], places=2)
         self.assertAlmostEqual(self.obsp[2], testp[2], places=2)
 
+    def testEngine(self):
+        """Test an unknown engine is rejected"""
+        self.assertRaises(ValueError, qdm, self.obsdist, self.refdist,
+                          self.futdist, engine='fortran')
+
+    def testRatio(self):
+        """Test relative changes in quantiles are preserved"""
+        mhatc, mhatp = qdm(self.obsdist, self.refdist, 1.5 * self.refdist)
+        self.numpyAssertAlmostEqual(mhatp, 1.5 * mhatc)
+
+    def testAdditive(self):
+        """Test absolute changes in quantiles are preserved"""
+        mhatc, mhatp = qdm(self.obsdist, self.refdist, self.refdist + 5.,
+                           ratio=False)
+        self.numpyAssertAlmostEqual(mhatp, mhatc + 5.)
+
+    def testTrace(self):
+        """Test values below the trace value are set to zero"""
+        ref = np.where(self.refdist < 0.6, 0., self.refdist)
+        mhatc, mhatp = qdm(self.obsdist, ref, ref, trace=0.5)
+        self.assertTrue((mhatc[ref == 0] == 0).all())
+        self.assertTrue((mhatp[(mhatp > 0) & (mhatp < 0.5)]).size == 0)
+
+    def testQuantileCount(self):
+        """Test the number of quantiles used in the mapping"""
+        mhatc, mhatp = qdm(self.obsdist, self.refdist, self.futdist, n=11)
+        self.assertEqual(len(mhatc), len(self.refdist))
+        self.assertEqual(len(mhatp), len(self.futdist))
+        # Reference values at the reference deciles map to the deciles of
+        # the observations:
+        tau = np.linspace(0, 1, 11)
+        qref = np.quantile(self.refdist, tau)
+        mhatc, mhatp = qdm(self.obsdist, qref, qref, n=11)
+        self.numpyAssertAlmostEqual(mhatc, np.quantile(self.obsdist, tau))
+
+    def testSeed(self):
+        """Test results with random jitter are reproducible"""
+        ref = np.ones(50)
+        a = qdm_numpy(self.obsdist, ref, self.futdist, seed=5)
+        b = qdm_numpy(self.obsdist, ref, self.futdist, seed=5)
+        self.numpyAssertEqual(a[0], b[0])
+        self.numpyAssertEqual(a[1], b[1])
+
+    def testREngine(self):
+        """Test the NumPy and R implementations give the same result"""
+        try:
+            from qdm import _mbc
+            _mbc()
+        except Exception:
+            self.skipTest("rpy2 or the R MBC package is not available")
+        for ratio in [True, False]:
+            for n in [None, 101]:
+                expected = qdm(self.obsdist, self.refdist, self.futdist,
+                               ratio=ratio, n=n, engine='r')
+                result = qdm(self.obsdist, self.refdist, self.futdist,
+                             ratio=ratio, n=n, engine='numpy')
+                self.numpyAssertAlmostEqual(result[0], expected[0])
+                self.numpyAssertAlmostEqual(result[1], expected[1])
+
+class TestQDMBatch(NumpyTestCase.NumpyTestCase):
+    obsdist = lognorm.rvs(0.57, size=100)
+    members = {'A': (lognorm.rvs(0.45, size=80), lognorm.rvs(0.55, size=120)),
+               'B': (lognorm.rvs(0.5, size=150), lognorm.rvs(0.6, size=60)),
+               'C': (np.ones(30), lognorm.rvs(0.5, size=40))}
+
+    def testBatchEqualsMembers(self):
+        """Test batched QDM gives the same result as each member alone"""
+        for ratio in [True, False]:
+            for n in [None, 2, 50]:
+                df = qdm_batch(self.obsdist, self.members, ratio=ratio, n=n,
+                               seed=11)
+                for k, (ref, fut) in self.members.items():
+                    mhatc, mhatp = qdm_numpy(self.obsdist, ref, fut,
+                                             ratio=ratio, n_tau=n, seed=11)
+                    sub = df[df['member'] == k]
+                    refc = sub[sub['period'] == 'ref']
+                    futc = sub[sub['period'] == 'fut']
+                    self.numpyAssertEqual(refc['index'].to_numpy(),
+                                          np.arange(len(ref)))
+                    self.numpyAssertEqual(refc['value'].to_numpy(), ref)
+                    self.numpyAssertEqual(futc['value'].to_numpy(), fut)
+                    if k == 'C':
+                        # The observations are not jittered for the constant
+                        # member in the batch, so the future values differ
+                        # by the size of the jitter. The reference values
+                        # depend on the order of the jittered values, which
+                        # span the observed distribution:
+                        self.assertTrue(refc['corrected'].between(
+                            self.obsdist.min(), self.obsdist.max()).all())
+                        self.numpyAssertAlmostEqual(
+                            futc['corrected'].to_numpy(), mhatp, prec=1e-8)
+                    else:
+                        self.numpyAssertEqual(refc['corrected'].to_numpy(),
+                                              mhatc)
+                        self.numpyAssertEqual(futc['corrected'].to_numpy(),
+                                              mhatp)
+
+    def testTableLayout(self):
+        """Test the output has a row for each input value"""
+        df = qdm_batch(self.obsdist, self.members)
+        self.assertEqual(list(df.columns),
+                         ['member', 'period', 'index', 'value', 'corrected'])
+        self.assertEqual(len(df), sum(len(r) + len(f) for r, f in
+                                      self.members.values()))
+        self.assertEqual(list(df['member'].cat.categories), ['A', 'B', 'C'])
+
+    def testBadInput(self):
+        """Test empty members and NaN values are rejected"""
+        self.assertRaises(ValueError, qdm_batch, self.obsdist, {})
+        self.assertRaises(ValueError, qdm_batch, self.obsdist,
+                          {'A': (np.array([]), self.obsdist)})
+        self.assertRaises(ValueError, qdm_batch, self.obsdist,
+                          {'A': (self.obsdist, np.array([1., np.nan]))})
+        self.assertRaises(ValueError, qdm_batch, np.array([1., np.nan]),
+                          self.members)
+
+class TestBootstrap(unittest.TestCase):
+    obsdist = lognorm.rvs(0.57, size=100)
+    members = {'A': (lognorm.rvs(0.45, size=80), lognorm.rvs(0.55, size=120)),
+               'B': (lognorm.rvs(0.5, size=150), lognorm.rvs(0.6, size=60))}
+    probs = [0.1, 0.5, 0.9]
+
+    def testIntervals(self):
+        """Test the estimates are inside the confidence intervals"""
+        df = bootstrap_qdm(self.obsdist, self.members, nboot=40,
+                           probs=self.probs, seed=2)
+        self.assertEqual(len(df), 2 * 2 * 3)
+        self.assertEqual(set(df['stat']), {'corrected', 'delta'})
+        self.assertTrue((df['lower'] <= df['upper']).all())
+        self.assertTrue(df['estimate'].between(df['lower'],
+                                               df['upper']).mean() > 0.8)
+        # The estimate of delta is the change in the simulated quantiles:
+        ref, fut = self.members['B']
+        delta = df[(df['member'] == 'B') & (df['stat'] == 'delta')]
+        expected = np.quantile(fut, self.probs) / np.quantile(ref, self.probs)
+        np.testing.assert_allclose(delta['estimate'], expected)
+
+    def testReproducible(self):
+        """Test the results depend on the seed, not the number of processes"""
+        a = bootstrap_qdm(self.obsdist, self.members, nboot=6,
+                          probs=self.probs, seed=7)
+        b = bootstrap_qdm(self.obsdist, self.members, nboot=6,
+                          probs=self.probs, seed=7, processes=2)
+        pd.testing.assert_frame_equal(a, b)
+        c = bootstrap_qdm(self.obsdist, self.members, nboot=6,
+                          probs=self.probs, seed=8)
+        self.assertFalse(np.allclose(a['lower'], c['lower']))
+
+class TestEmpiricalQDM(NumpyTestCase.NumpyTestCase):
+    obsdist = lognorm.rvs(0.57, size=300)
+    refdist = lognorm.rvs(0.45, size=2000)
+    futdist = lognorm.rvs(0.55, size=2000)
+
+    def testSmallSample(self):
+        """Test exact quantile tables give the same result as qdm_numpy"""
+        for ratio in [True, False]:
+            expected = qdm_numpy(self.obsdist, self.refdist, self.futdist,
+                                 ratio=ratio, n_tau=500, seed=3)
+            result = qdm_empirical(self.obsdist, self.refdist, self.futdist,
+                                   ratio=ratio, nknots=500, seed=3)
+            self.numpyAssertAlmostEqual(result[0], expected[0], prec=1e-10)
+            self.numpyAssertAlmostEqual(result[1], expected[1], prec=1e-10)
+        result = qdm(self.obsdist, self.refdist, self.futdist, ratio=False,
+                     n=500, engine='empirical')
+        self.numpyAssertAlmostEqual(result[1], expected[1], prec=1e-10)
+
+    def testChunks(self):
+        """Test tables built and applied in chunks"""
+        tables = qdm_tables(self.obsdist, self.refdist, self.futdist,
+                            nknots=101, ratio=False)
+        chunked = qdm_tables(np.array_split(self.obsdist, 3),
+                             np.array_split(self.refdist, 7),
+                             iter(np.array_split(self.futdist, 5)),
+                             nknots=101, ratio=False, size=200)
+        for key in ['obs', 'ref', 'fut']:
+            self.assertEqual(len(chunked[key]), 101)
+            # Estimates are within the spacing of the 101 knots:
+            ranks = np.searchsorted(np.sort(getattr(self, f"{key}dist")),
+                                    chunked[key]) / len(getattr(
+                                        self, f"{key}dist"))
+            self.assertLess(np.abs(ranks - tables['tau']).max(), 0.02)
+        expected = qdm_apply(self.futdist, tables, ratio=False)
+        result = np.concatenate([qdm_apply(x, tables, ratio=False) for x in
+                                 np.array_split(self.futdist, 4)])
+        self.numpyAssertEqual(result, expected)
+        self.assertRaises(ValueError, qdm_apply, self.futdist, tables,
+                          'other')
+
 class TestLoadData(unittest.TestCase):
     goodTestPath = "./"
     badTestPath = ""
@@ -46,9 +237,14 @@ class TestLoadData(unittest.TestCase):
     domain = (135, 160, -25, -10)
 
     def testSwapYearInput(self):
-        self.assertRaises(ValueError, loadTCLVdata, end_year, start_year)
+        self.assertRaises(ValueError, load_ensemble, self.goodTestPath,
+                          self.end_year, self.start_year)
 
 if __name__ == "__main__":
     #flStartLog('', 'CRITICAL', False)
-    testSuite = unittest.makeSuite(TestQDM,'test')
+    testSuite = unittest.TestSuite([unittest.makeSuite(TestQDM,'test'),
+                                    unittest.makeSuite(TestQDMBatch,'test'),
+                                    unittest.makeSuite(TestBootstrap,'test'),
+                                    unittest.makeSuite(TestEmpiricalQDM,'test'),
+                                    unittest.makeSuite(TestLoadData,'test')])
     unittest.TextTestRunner(verbosity=2).run(testSuite)
@@ -0,0 +1,109 @@
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from streamstats import QuantileSketch, RunningStats, chunks, sketch
+
+np.random.seed(seed=5412)
+
+
+class TestQuantileSketch(unittest.TestCase):
+    data = np.random.lognormal(2.5, 0.6, size=200000)
+    probs = np.linspace(0, 1, 101)
+
+    def rankError(self, qs):
+        """Largest difference between the rank of the estimates and probs"""
+        ranks = np.searchsorted(np.sort(self.data), qs.quantile(self.probs))
+        return np.abs(ranks / len(self.data) - self.probs).max()
+
+    def testExact(self):
+        """Test small samples give exact quantiles"""
+        qs = sketch(self.data[:500], size=100)
+        self.assertTrue(qs.exact)
+        np.testing.assert_allclose(qs.quantile(self.probs),
+                                   np.quantile(self.data[:500], self.probs))
+
+    def testChunks(self):
+        """Test estimates from chunks of a large sample"""
+        qs = sketch(np.array_split(self.data, 37), size=1000)
+        self.assertFalse(qs.exact)
+        self.assertEqual(qs.count, len(self.data))
+        self.assertLess(self.rankError(qs), 0.005)
+        self.assertEqual(qs.quantile(0), self.data.min())
+        self.assertEqual(qs.quantile(1), self.data.max())
+        self.assertLessEqual(len(qs._values), qs.buffersize)
+
+    def testSeries(self):
+        """Test a one-dimensional array-like is treated as a single chunk"""
+        series = pd.Series(self.data[:1000])
+        self.assertEqual(len(list(chunks(series))), 1)
+        self.assertEqual(len(list(chunks(self.data[:1000].tolist()))), 1)
+        self.assertEqual(len(list(chunks(np.split(self.data[:1000], 4)))), 4)
+        np.testing.assert_array_equal(
+            sketch(series, size=100).quantile(self.probs),
+            sketch(series.to_numpy(), size=100).quantile(self.probs))
+
+    def testMerge(self):
+        """Test merged sketches of partitions of the data"""
+        parts = [sketch(part, size=1000)
+                 for part in np.array_split(self.data, 4)]
+        qs = parts[0]
+        for part in parts[1:]:
+            qs.merge(part)
+        self.assertEqual(qs.count, len(self.data))
+        self.assertLess(self.rankError(qs), 0.005)
+        self.assertEqual(len(QuantileSketch().merge(parts[1]).quantile(
+            self.probs)), len(self.probs))
+
+    def testEmpty(self):
+        """Test empty sketches and NaN values"""
+        qs = QuantileSketch()
+        self.assertRaises(ValueError, qs.quantile, 0.5)
+        qs.update([np.nan, 1., 3.])
+        self.assertEqual(qs.count, 2)
+        self.assertEqual(qs.quantile(0.5), 2.)
+        self.assertRaises(ValueError, QuantileSketch, 1)
+
+
+class TestRunningStats(unittest.TestCase):
+    data = np.random.normal(10, 3, size=(200, 6))
+    data[np.random.uniform(size=data.shape) < 0.2] = np.nan
+    data[:, 5] = np.nan
+
+    def assertStats(self, rs, data):
+        with warnings.catch_warnings():
+            # All NaN column:
+            warnings.simplefilter('ignore', RuntimeWarning)
+            np.testing.assert_array_equal(rs.n, (~np.isnan(data)).sum(0))
+            np.testing.assert_allclose(rs.sum, np.nansum(data, 0))
+            np.testing.assert_allclose(rs.nanmean, np.nanmean(data, 0))
+            np.testing.assert_allclose(rs.std(ddof=1),
+                                       np.nanstd(data, 0, ddof=1))
+            np.testing.assert_array_equal(rs.min, np.nanmin(data, 0))
+            np.testing.assert_array_equal(rs.max, np.nanmax(data, 0))
+
+    def testUpdate(self):
+        """Test the statistics match numpy, ignoring NaN"""
+        rs = RunningStats(6)
+        for row in self.data:
+            rs.update(row)
+        self.assertStats(rs, self.data)
+
+    def testMerge(self):
+        """Test merged accumulators match a single accumulator"""
+        parts = [RunningStats(6) for _ in range(3)]
+        for i, row in enumerate(self.data):
+            parts[i % 3].update(row)
+        rs = RunningStats(6)
+        for part in parts:
+            rs.merge(part)
+        self.assertStats(rs, self.data)
+
+
+if __name__ == "__main__":
+    testSuite = unittest.TestSuite([
+        unittest.makeSuite(TestQuantileSketch, 'test'),
+        unittest.makeSuite(TestRunningStats, 'test')])
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
@@ -0,0 +1,431 @@
+import os
+import sys
+import types
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import tclv
+
+np.random.seed(seed=233423)
+
+
+def make_track_file(filename, ntracks=20, interleave=True):
+    """
+    Write a synthetic TCLV track file with the 17-column layout. If
+    `interleave` is True, the points of some tracks are split into separate
+    blocks of rows.
+    """
+    rows = []
+    for num in range(1, ntracks + 1):
+        npoints = np.random.randint(1, 30)
+        start = pd.Timestamp(1981 + num % 40, 1 + num % 12, 1)
+        pmin = 1005 - np.cumsum(np.random.uniform(-2, 4, npoints))
+        for i in range(npoints):
+            t = start + pd.Timedelta(hours=6 * i)
+            rows.append([num, t.year, t.month, t.day, t.hour,
+                         140 + 0.5 * i, -12 - 0.3 * i, pmin[i],
+                         -np.random.uniform(1e-5, 1e-3), 20.0, 1.0, 2.0,
+                         3.0, 1008.0, 100.0, 200.0, 0.1])
+    if interleave:
+        # Move the first half of track 3 to the end of the file:
+        idx = [i for i, r in enumerate(rows) if r[0] == 3]
+        move = idx[:len(idx) // 2]
+        rows = ([r for i, r in enumerate(rows) if i not in move] +
+                [rows[i] for i in move])
+    with open(filename, 'w') as fh:
+        for r in rows:
+            fh.write(" ".join(str(v) for v in r) + "\n")
+
+
+def reference_fields(df):
+    """Derived fields, calculated with grouped (per-track) operations"""
+    df = df.copy()
+    tracks = df.groupby('num')
+    df['dt'] = tracks['datetime'].diff().dt.total_seconds()
+    df['age'] = (df.groupby('num')['dt'].cumsum().fillna(0)) / 3600.
+    df['pdiff'] = df['poci'] - df['pmin']
+    df['ni'] = df.pdiff / df.groupby('num').pdiff.transform('max')
+    return df
+
+
+class TestLoadTrackFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir,
+                                     'all_tracks_TESTQ_rcp45.dat')
+        make_track_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testDatetime(self):
+        """Test datetime is constructed from the date columns"""
+        df = tclv.read_track_file(self.filename)
+        self.assertEqual(df.columns[0], 'datetime')
+        self.assertTrue((df['datetime'].dt.year == df['year']).all())
+        self.assertTrue((df['datetime'].dt.hour == df['hour']).all())
+
+    def testTrackIndex(self):
+        """Test track segments are contiguous after ordering"""
+        num = np.array([1, 1, 2, 2, 2, 1, 3])
+        order, starts, lengths = tclv.track_index(num)
+        np.testing.assert_array_equal(num[order], [1, 1, 1, 2, 2, 2, 3])
+        np.testing.assert_array_equal(starts, [0, 3, 6])
+        np.testing.assert_array_equal(lengths, [3, 3, 1])
+        order, starts, lengths = tclv.track_index(np.array([4, 4, 2]))
+        self.assertIsNone(order)
+        np.testing.assert_array_equal(starts, [0, 2])
+
+    def testDerivedFields(self):
+        """Test derived fields match the per-track calculation"""
+        raw = tclv.read_track_file(self.filename)
+        expected = reference_fields(raw)
+        df = tclv.derive_track_fields(raw.copy())
+        pd.testing.assert_frame_equal(df, expected)
+
+    def testCache(self):
+        """Test cached data is identical and rebuilt when stale"""
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("No parquet engine available")
+        df = tclv.load_track_file(self.filename)
+        datafile, metafile = tclv._cache_paths(self.filename)
+        self.assertTrue(os.path.isfile(datafile))
+        cached = tclv.load_track_file(self.filename)
+        pd.testing.assert_frame_equal(df, cached)
+
+        make_track_file(self.filename, ntracks=5)
+        os.utime(self.filename, ns=(0, 0))
+        self.assertIsNone(tclv._read_cache(self.filename))
+        df = tclv.load_track_file(self.filename)
+        self.assertEqual(df['num'].nunique(), 5)
+
+
+class TestFilterTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, 'all_tracks_TESTQ_rcp45.dat')
+        make_track_file(filename, ntracks=60)
+        self.df = tclv.load_track_file(filename, cache=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testFilterTracks(self):
+        """Test filtered tracks match the per-track filter"""
+        summary = tclv.track_summary(self.df)
+        for start, end, zeta, age in [(1981, 2010, 0, 36),
+                                      (1990, 2000, 5e-4, 24),
+                                      (2011, 2020, 0, 0)]:
+            expected = self.df.groupby('num').filter(
+                lambda x: (x['datetime'].dt.year.min() >= start) &
+                (x['datetime'].dt.year.max() <= end) &
+                (x['age'].max() >= age) &
+                (np.abs(x['vorticity'].min()) > zeta))
+            result = tclv.filter_tracks(self.df, start, end, zeta, age)
+            pd.testing.assert_frame_equal(result, expected)
+            result = tclv.filter_tracks(self.df, start, end, zeta, age,
+                                        summary=summary)
+            pd.testing.assert_frame_equal(result, expected)
+
+    def testFilterTracksDomain(self):
+        """Test domain filter matches the shapely intersection test"""
+        try:
+            from shapely.geometry import box as sbox
+            from shapely.geometry import LineString, Point
+        except ImportError:
+            self.skipTest("shapely is not available")
+        df = self.df.copy()
+        df['lon'] = np.random.uniform(120, 170, len(df))
+        df['lat'] = np.random.uniform(-35, 0, len(df))
+        for domain in [(135, 160, -25, -10), (150, 155, -20, -15),
+                       (90, 180, -40, 0)]:
+            minlon, maxlon, minlat, maxlat = domain
+            box = sbox(minlon, minlat, maxlon, maxlat, ccw=False)
+
+            def intersects(x):
+                if len(x) == 1:
+                    geom = Point(x['lon'].iloc[0], x['lat'].iloc[0])
+                else:
+                    geom = LineString(zip(x['lon'], x['lat']))
+                return geom.intersects(box)
+
+            expected = df.groupby('num').filter(intersects)
+            result = tclv.filter_tracks_domain(df, *domain)
+            pd.testing.assert_frame_equal(result, expected)
+
+    def testSegmentsIntersectBox(self):
+        """Test segment-box intersection for edge cases"""
+        x0 = np.array([0., 0., 5., 0., 11., 0.])
+        y0 = np.array([0., 5., 5., 10., 11., 12.])
+        x1 = np.array([2., 20., 5., 20., 11., -1.])
+        y1 = np.array([2., 5., 5., 10., 11., 13.])
+        result = tclv.segments_intersect_box(x0, y0, x1, y1, 1, 10, 1, 10)
+        np.testing.assert_array_equal(
+            result, [True, True, True, True, False, False])
+
+    def testTrackSummary(self):
+        """Test the track summary has one row per track"""
+        summary = tclv.track_summary(self.df)
+        self.assertEqual(len(summary), self.df['num'].nunique())
+        self.assertEqual(summary['npoints'].sum(), len(self.df))
+
+
+class TestLoadEnsemble(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for model in ['MODELB', 'MODELA']:
+            for rcp in ['rcp85', 'rcp45']:
+                make_track_file(os.path.join(
+                    self.tmpdir, f'all_tracks_{model}_{rcp}.dat'), ntracks=30)
+        make_track_file(os.path.join(self.tmpdir,
+                                     'all_tracks_ERAIntQ_rcp85.dat'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testLabels(self):
+        """Test files are labelled and returned in sorted order"""
+        data = tclv.load_ensemble(self.tmpdir)
+        self.assertEqual(list(data.keys()),
+                         ['MODELA RCP45', 'MODELA RCP85',
+                          'MODELB RCP45', 'MODELB RCP85'])
+
+    def testParallel(self):
+        """Test the process pool gives the same result as a serial load"""
+        domain = (140, 150, -20, -10)
+        serial = tclv.load_ensemble(self.tmpdir, 1990, 2010, domain)
+        parallel = tclv.load_ensemble(self.tmpdir, 1990, 2010, domain,
+                                      processes=2)
+        self.assertEqual(list(serial.keys()), list(parallel.keys()))
+        for label in serial:
+            pd.testing.assert_frame_equal(serial[label], parallel[label])
+
+    def testFailure(self):
+        """Test a bad file is reported after all files are attempted"""
+        with open(os.path.join(self.tmpdir,
+                               'all_tracks_BAD_rcp45.dat'), 'w') as fh:
+            fh.write("not a track file\n")
+        with self.assertRaises(RuntimeError):
+            tclv.load_ensemble(self.tmpdir)
+
+    def testYears(self):
+        """Test invalid year arguments are rejected"""
+        self.assertRaises(ValueError, tclv.load_ensemble, self.tmpdir, 1990)
+        self.assertRaises(ValueError, tclv.load_ensemble, self.tmpdir,
+                          2010, 1990)
+
+
+class TestMaxWindInputs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, 'all_tracks_TESTQ_rcp45.dat')
+        make_track_file(filename, ntracks=30)
+        self.df = tclv.load_track_file(filename, cache=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testInputs(self):
+        """Test index and time step match the per-row calculation"""
+        df = self.df
+        idx = df.num.values
+        expidx = np.ones(len(idx))
+        expidx[1:][idx[1:] == idx[:-1]] = 0
+        expdt = ((df['datetime'] - df['datetime'].shift())
+                 .fillna(pd.Timedelta(seconds=0))
+                 .apply(lambda x: x / np.timedelta64(1, 'h'))
+                 .astype('int64') % (24*60))
+        varidx, dt = tclv.max_wind_inputs(df, 'datetime')
+        np.testing.assert_array_equal(varidx, expidx)
+        np.testing.assert_array_equal(dt, expdt.values)
+
+    def stubTCRM(self):
+        """
+        Replace the TCRM `maxWindSpeed` function with a stub that encodes
+        the track index, time step and central pressure in its result.
+        """
+        calls = []
+
+        def maxWindSpeed(varidx, dt, lon, lat, pmin, poci, gustfactor=1.0):
+            calls.append(len(varidx))
+            return 1e7 * varidx + 1e4 * dt + pmin
+
+        loadData = types.ModuleType('Utilities.loadData')
+        loadData.maxWindSpeed = maxWindSpeed
+        utilities = types.ModuleType('Utilities')
+        utilities.loadData = loadData
+        return calls, mock.patch.dict(sys.modules, {
+            'Utilities': utilities, 'Utilities.loadData': loadData})
+
+    def assertDecoded(self, df):
+        """Check `vmax` encodes the inputs calculated for `df` alone"""
+        varidx, dt = tclv.max_wind_inputs(df, 'datetime')
+        vmax = df['vmax'].to_numpy()
+        np.testing.assert_array_equal(vmax // 1e7, varidx)
+        np.testing.assert_array_equal((vmax % 1e7) // 1e4, dt)
+        np.testing.assert_allclose(vmax % 1e4, df['pmin'].to_numpy())
+
+    def testBatch(self):
+        """Test batched wind speeds are returned to each member"""
+        num = self.df['num'].to_numpy()
+        # Split the data within a track, so adjacent members share a `num`:
+        split = np.flatnonzero(num[1:] == num[:-1])[10] + 1
+        members = {'A': self.df.iloc[:split].copy(),
+                   'B': self.df.iloc[split:].copy()}
+        self.assertEqual(members['A']['num'].iloc[-1],
+                         members['B']['num'].iloc[0])
+        calls, stub = self.stubTCRM()
+        with stub:
+            result = tclv.calculate_max_wind(members)
+        self.assertEqual(calls, [len(self.df)])
+        self.assertIs(result, members)
+        for df in result.values():
+            self.assertDecoded(df)
+            self.assertEqual(df['vmax'].iloc[0] // 1e7, 1)
+
+    def testSingle(self):
+        """Test a single DataFrame is returned with the wind speeds"""
+        df = self.df.copy()
+        calls, stub = self.stubTCRM()
+        with stub:
+            result = tclv.calculate_max_wind(df)
+        self.assertIs(result, df)
+        self.assertEqual(calls, [len(df)])
+        self.assertDecoded(result)
+
+    def testEmpty(self):
+        """Test empty inputs do not call TCRM"""
+        calls, stub = self.stubTCRM()
+        with stub:
+            self.assertEqual(tclv.calculate_max_wind({}), {})
+            result = tclv.calculate_max_wind({'A': self.df.iloc[:0].copy()})
+        self.assertEqual(calls, [])
+        self.assertEqual(len(result['A']['vmax']), 0)
+
+
+class TestIterTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir,
+                                     'all_tracks_TESTQ_rcp45.dat')
+        make_track_file(self.filename, ntracks=40, interleave=False)
+        self.df = tclv.load_track_file(self.filename, cache=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testBatches(self):
+        """Test batches hold complete tracks and match a full load"""
+        for ntracks, chunksize in [(1, 7), (5, 33), (100, 1000)]:
+            batches = list(tclv.iter_tracks(self.filename, ntracks,
+                                            chunksize))
+            for batch in batches[:-1]:
+                self.assertEqual(batch['num'].nunique(), ntracks)
+            self.assertLessEqual(batches[-1]['num'].nunique(), ntracks)
+            nums = np.concatenate([b['num'].unique() for b in batches])
+            self.assertEqual(len(nums), len(np.unique(nums)))
+            pd.testing.assert_frame_equal(pd.concat(batches), self.df)
+
+    def testFilters(self):
+        """Test filters are applied to each batch"""
+        domain = (140, 150, -20, -10)
+        expected = tclv.filter_tracks_domain(
+            tclv.filter_tracks(self.df, 1990, 2010), *domain)
+        batches = tclv.iter_tracks(self.filename, 4, 50, start_year=1990,
+                                   end_year=2010, domain=domain)
+        pd.testing.assert_frame_equal(pd.concat(list(batches)), expected)
+
+    def testMerged(self):
+        """Test tracks with repeated numbers in a merged file"""
+        members = [self.df, self.df.assign(pmin=self.df['pmin'] - 5.)]
+        merged = os.path.join(self.tmpdir, 'GROUP1_RCP45_1981-2010.dat')
+        pd.concat(members).to_csv(merged, index=False)
+        batches = list(tclv.iter_tracks(merged, ntracks=3, chunksize=25))
+        result = pd.concat(batches, ignore_index=True)
+        expected = pd.concat([tclv.derive_track_fields(m.copy())
+                              for m in members], ignore_index=True)
+        self.assertEqual(sum(b['num'].nunique() for b in batches),
+                         2 * self.df['num'].nunique())
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+class TestSyntheticCatalogue(unittest.TestCase):
+
+    def testCatalogue(self):
+        """Test the benchmark catalogue has the TCLV file layout"""
+        from benchmark_tclv import make_catalogue, write_catalogue
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'all_tracks_SYNTHQ_rcp45.dat')
+            for npoints in [1000, 12345]:
+                write_catalogue(make_catalogue(npoints, seed=1), filename)
+                df = tclv.load_track_file(filename, cache=False)
+                self.assertEqual(len(df), npoints)
+                self.assertTrue((df['dt'].dropna() == 6 * 3600).all())
+                self.assertGreater(len(tclv.filter_tracks_domain(df)), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestMergedOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testShiftYears(self):
+        """Test shifting datetimes matches pandas.DateOffset"""
+        times = pd.Series(pd.date_range('1980-01-01', '1989-12-31 18:00',
+                                        freq='6h'))
+        for years in [0, 1, 4, 30, -7]:
+            expected = times + pd.offsets.DateOffset(years=years)
+            result = tclv.shift_years(times.to_numpy(), years)
+            np.testing.assert_array_equal(result, expected.to_numpy())
+
+    def testWriter(self):
+        """Test appending to csv and Arrow files"""
+        try:
+            import pyarrow  # noqa: F401
+            formats = ['csv', 'feather']
+        except ImportError:
+            formats = ['csv']
+        base = os.path.join(self.tmpdir, 'merged')
+        parts = [pd.DataFrame({'num': np.arange(n), 'pdiff': np.ones(n) * n,
+                               'datetime': pd.date_range('2000-01-01',
+                                                         periods=n)})
+                 for n in [3, 5, 2]]
+        with tclv.TrackWriter(base, formats) as writer:
+            for df in parts:
+                writer.write(df)
+        self.assertEqual(writer.nrows, 10)
+        expected = pd.concat(parts, ignore_index=True)
+        for fmt in formats:
+            result = tclv.read_merged_tracks(writer.filenames[fmt])
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        self.assertRaises(ValueError, tclv.TrackWriter, base, 'shapefile')
+
+
+if __name__ == "__main__":
+    testSuite = unittest.TestSuite([
+        unittest.makeSuite(TestLoadTrackFile, 'test'),
+        unittest.makeSuite(TestFilterTracks, 'test'),
+        unittest.makeSuite(TestLoadEnsemble, 'test'),
+        unittest.makeSuite(TestMaxWindInputs, 'test'),
+        unittest.makeSuite(TestIterTracks, 'test'),
+        unittest.makeSuite(TestSyntheticCatalogue, 'test'),
+        unittest.makeSuite(TestMergedOutput, 'test')])
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from trackcollection import TrackCollection
+from test_trackio import make_tracks, write_grouped
+
+np.random.seed(seed=40211)
+
+
+class TestTrackCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = make_tracks(15)
+        # Include an empty track:
+        self.tracks.insert(3, self.tracks[0][:0])
+        self.data = np.concatenate(self.tracks)
+        self.offsets = np.r_[0, np.cumsum([len(t) for t in self.tracks])]
+        self.collection = TrackCollection.from_array(self.data, self.offsets)
+
+    def testViews(self):
+        """Test the tracks are views of the field arrays"""
+        tc = self.collection
+        self.assertEqual(len(tc), len(self.tracks))
+        self.assertEqual(tc.npoints, len(self.data))
+        for track, expected in zip(tc, self.tracks):
+            self.assertEqual(len(track), len(expected))
+            if len(expected):
+                self.assertTrue(np.shares_memory(track.Longitude,
+                                                 tc.Longitude))
+            np.testing.assert_array_equal(track.CentralPressure,
+                                          expected['CentralPressure'])
+            np.testing.assert_array_equal(track.data, expected)
+        self.assertEqual(tc[-1].trackId, (len(tc), len(tc)))
+        with self.assertRaises(AttributeError):
+            tc[0].WindSpeed
+
+    def testReductions(self):
+        """Test the per-track statistics match a loop over the tracks"""
+        tc = self.collection
+        pmin = tc.min_pressure()
+        life = tc.lifetime()
+        for i, track in enumerate(self.tracks):
+            if len(track) == 0:
+                self.assertTrue(np.isnan(pmin[i]))
+                continue
+            self.assertEqual(pmin[i], track['CentralPressure'].min())
+            self.assertEqual(life[i], track['TimeElapsed'].max())
+            self.assertEqual(tc[i].trackMinPressure, pmin[i])
+        self.assertIsNone(tc.max_wind())
+        starts = [t['Datetime'][0] for t in self.tracks if len(t)]
+        np.testing.assert_array_equal(tc.start_time(), starts)
+
+    def testSegments(self):
+        """Test the segments join consecutive points of each track"""
+        seg = self.collection.segments()
+        expected = []
+        for i, track in enumerate(self.tracks):
+            for j in range(len(track) - 1):
+                expected.append((i, track['Longitude'][j],
+                                 track['Latitude'][j],
+                                 track['Longitude'][j + 1],
+                                 track['Latitude'][j + 1]))
+        result = list(zip(seg['track'], seg['x0'], seg['y0'], seg['x1'],
+                          seg['y1']))
+        self.assertEqual(result, expected)
+
+    def testSelect(self):
+        """Test selecting a subset of the tracks"""
+        mask = np.arange(len(self.tracks)) % 3 == 1
+        subset = self.collection.select(mask)
+        expected = [t for t, m in zip(self.tracks, mask) if m]
+        self.assertEqual(len(subset), len(expected))
+        for track, data in zip(subset, expected):
+            np.testing.assert_array_equal(track.data, data)
+
+    def testFromFile(self):
+        """Test reading a collection from a TCRM track file"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'tracks.nc')
+            write_grouped(filename, self.tracks[:5])
+            tc = TrackCollection.from_file(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(tc.trackids, [(n, 1000 + n) for n in range(5)])
+        np.testing.assert_array_equal(tc.lengths,
+                                      [len(t) for t in self.tracks[:5]])
+        self.assertEqual(tc.Datetime.dtype, np.dtype('datetime64[us]'))
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestTrackCollection, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
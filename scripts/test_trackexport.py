@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+import trackexport
+from trackcollection import TrackCollection
+
+
+def make_collection():
+    """
+    Five tracks: the first crosses 0E (eastward), the second does not cross,
+    the third is a single point, the fourth is empty, and the fifth crosses
+    0E (westward).
+    """
+    x = np.array([358., 359.5, 1., 2., 10., 20., 30., 5., 1., 359.])
+    y = np.array([-10., -11., -12., -13., -5., -6., -7., -8., -1., -2.])
+    pressure = np.array([1000., 990., 980., 970., 960., 950., 920., 990.,
+                         1000., 1001.])
+    offsets = [0, 4, 7, 8, 8, 10]
+    fields = {'CycloneNumber': np.repeat([1, 2, 3, 4, 5], np.diff(offsets)),
+              'Datetime': (np.datetime64('2000-01-01T00:00', 'us') +
+                           np.arange(10) * np.timedelta64(6, 'h')),
+              'TimeElapsed': np.r_[0:24:6, 0:18:6, 0, 0, 6].astype(float),
+              'Longitude': x, 'Latitude': y, 'CentralPressure': pressure}
+    return TrackCollection(fields, offsets)
+
+
+class TestTrackExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tc = make_collection()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCrossings(self):
+        """Test segments crossing 0E are found, in both directions"""
+        x0, y0 = np.array([359.5, 10., 1.]), np.array([-11., -5., -1.])
+        x1, y1 = np.array([1., 20., 359.]), np.array([-12., -6., -2.])
+        mask, xa, xb, yc = trackexport.antimeridian_crossings(x0, y0, x1, y1)
+        np.testing.assert_array_equal(mask, [True, False, True])
+        np.testing.assert_array_equal(xa, [360., 0.])
+        np.testing.assert_array_equal(xb, [0., 360.])
+        np.testing.assert_allclose(yc, [-11 - 1 / 3., -1.5])
+
+    def testSegments(self):
+        """Test one feature per point, split at 0E"""
+        gdf = trackexport.segments(self.tc)
+        self.assertEqual(len(gdf), self.tc.npoints)
+        np.testing.assert_array_equal(gdf['CycloneNumber'],
+                                      self.tc.CycloneNumber)
+        nparts = [len(g.geoms) for g in gdf.geometry]
+        self.assertEqual(nparts, [1, 2, 1, 1, 1, 1, 1, 1, 2, 1])
+        first, second = gdf.geometry.iloc[1].geoms
+        self.assertEqual(first.coords[0], (359.5, -11.))
+        self.assertEqual(second.coords[-1], (1., -12.))
+        # The last point of each track is a line of zero length:
+        lengths = shapely.length(gdf.geometry.values)
+        np.testing.assert_array_equal(lengths[[3, 6, 7, 9]], 0)
+        self.assertTrue((np.delete(lengths, [3, 6, 7, 9]) > 0).all())
+        self.assertEqual(gdf.geometry.iloc[7].geoms[0].coords[:],
+                         [(5., -8.), (5., -8.)])
+        np.testing.assert_array_equal(
+            gdf['Category'],
+            trackexport.pressure_category(self.tc.CentralPressure))
+
+    def testDissolve(self):
+        """Test one feature per track, with the track attributes"""
+        gdf = trackexport.dissolved(self.tc)
+        self.assertEqual(list(gdf['CycloneNumber']), [1, 2, 3, 5])
+        self.assertEqual(list(gdf['MinPressure']), [970., 920., 990., 1000.])
+        self.assertEqual(list(gdf['Age']), [18., 12., 0., 6.])
+        self.assertEqual(list(gdf['Category']), [2, 5, 1, 0])
+        geoms = gdf.geometry.values
+        self.assertEqual([len(g.geoms) for g in geoms], [2, 1, 1, 2])
+        self.assertEqual(list(geoms[0].geoms[0].coords)[:2],
+                         [(358., -10.), (359.5, -11.)])
+        self.assertEqual(list(geoms[0].geoms[1].coords)[1:],
+                         [(1., -12.), (2., -13.)])
+        self.assertEqual(geoms[2].length, 0)
+
+    def testPoints(self):
+        """Test one feature per point, with the date components"""
+        gdf = trackexport.points(self.tc)
+        self.assertEqual(len(gdf), self.tc.npoints)
+        np.testing.assert_array_equal(gdf.geometry.x, self.tc.Longitude)
+        self.assertEqual(list(gdf['Hour'][:4]), [0, 6, 12, 18])
+
+    def testWrite(self):
+        """Test the features are written to GeoParquet and FlatGeobuf"""
+        for ext in ['parquet', 'fgb']:
+            filename = os.path.join(self.tmpdir, f'tracks.{ext}')
+            n = trackexport.export_tracks(self.tc, filename, mode='dissolve')
+            if ext == 'parquet':
+                gdf = gpd.read_parquet(filename)
+            else:
+                gdf = gpd.read_file(filename)
+            self.assertEqual(len(gdf), n)
+            # The spatial index of a FlatGeobuf file changes the order:
+            gdf = gdf.sort_values('CycloneNumber', ignore_index=True)
+            self.assertEqual(gdf.crs, trackexport.CRS)
+            self.assertTrue(gdf.geometry.geom_equals(
+                trackexport.dissolved(self.tc).geometry).all())
+        with self.assertRaises(ValueError):
+            trackexport.export_tracks(self.tc, 'tracks.xyz')
+        with self.assertRaises(ValueError):
+            trackexport.to_frame(self.tc, mode='lines')
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestTrackExport, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
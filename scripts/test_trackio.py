@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+import trackio
+
+np.random.seed(seed=5128)
+
+UNITS = "hours since 1900-01-01 00:00"
+
+NC_DTYPE = np.dtype({'names': trackio.TCRM_COLS,
+                     'formats': ('i4', 'f8') + ('f8',) * 8})
+
+
+def make_tracks(ntracks=12):
+    """Synthetic track data, as stored in a TCRM track file"""
+    tracks = []
+    for num in range(ntracks):
+        npoints = np.random.randint(1, 25)
+        data = np.zeros(npoints, dtype=NC_DTYPE)
+        data['CycloneNumber'] = num + 1
+        data['Datetime'] = 710000 + 24 * num + 6 * np.arange(npoints)
+        data['TimeElapsed'] = 6 * np.arange(npoints)
+        data['Longitude'] = 140 + np.random.uniform(0, 1, npoints).cumsum()
+        data['Latitude'] = -12 - np.random.uniform(0, 1, npoints).cumsum()
+        data['CentralPressure'] = np.random.uniform(940, 1005, npoints)
+        data['EnvPressure'] = 1008.
+        data['rMax'] = np.random.uniform(20, 60, npoints)
+        tracks.append(data)
+    return tracks
+
+
+def write_grouped(filename, tracks, calendar='standard', trackids=True,
+                  units=UNITS):
+    """Write tracks in the grouped layout of a TCRM track file"""
+    ncobj = Dataset(filename, 'w')
+    tdtype = ncobj.createCompoundType(NC_DTYPE, 'track_dtype')
+    group = ncobj.createGroup('tracks')
+    for n, data in enumerate(tracks):
+        tgroup = group.createGroup(f'tracks-{n:04d}')
+        tgroup.createDimension('time', None)
+        time = tgroup.createVariable('time', 'f8', ('time',))
+        time.units = units
+        time.calendar = calendar
+        tvar = tgroup.createVariable('track', tdtype, ('time',))
+        if trackids:
+            tvar.trackId = repr((n, 1000 + n))
+        time[:] = data['Datetime']
+        tvar[:] = data
+    ncobj.close()
+
+
+def write_single(filename, data):
+    """Write a single track as separate variables"""
+    ncobj = Dataset(filename, 'w')
+    ncobj.createDimension('time', len(data))
+    for f in NC_DTYPE.names:
+        var = ncobj.createVariable(f, NC_DTYPE[f], ('time',))
+        var[:] = data[f]
+    ncobj.time_units = UNITS
+    ncobj.calendar = 'standard'
+    ncobj.trackId = '(4, 77)'
+    ncobj.close()
+
+
+class TestReadTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'tracks.nc')
+        self.tracks = make_tracks()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertTrackEqual(self, result, expected, calendar='standard'):
+        for f in NC_DTYPE.names:
+            if f == 'Datetime':
+                continue
+            np.testing.assert_array_equal(result[f], expected[f])
+        if calendar == 'standard':
+            dates = num2date(expected['Datetime'], UNITS, calendar,
+                             only_use_cftime_datetimes=False)
+            self.assertEqual(result['Datetime'].tolist(), list(dates))
+        else:
+            dates = num2date(expected['Datetime'], UNITS, calendar)
+            self.assertEqual(list(result['Datetime']), list(dates))
+
+    def testGrouped(self):
+        """Test all the tracks are read into one array"""
+        write_grouped(self.filename, self.tracks)
+        data, offsets, trackids = trackio.read_tracks(self.filename)
+        self.assertEqual(data.dtype, trackio.TRACK_DTYPE)
+        self.assertEqual(len(offsets), len(self.tracks) + 1)
+        self.assertEqual(offsets[-1], sum(len(t) for t in self.tracks))
+        self.assertEqual(trackids, [(n, 1000 + n)
+                                    for n in range(len(self.tracks))])
+        views = trackio.track_views(data, offsets)
+        for view, expected in zip(views, self.tracks):
+            self.assertTrue(np.shares_memory(view, data))
+            self.assertTrackEqual(view, expected)
+
+    def testDefaultIds(self):
+        """Test tracks without a trackId attribute are numbered"""
+        write_grouped(self.filename, self.tracks[:3], trackids=False)
+        _, _, trackids = trackio.read_tracks(self.filename)
+        self.assertEqual(trackids, [(1, 3), (2, 3), (3, 3)])
+
+    def testCalendar(self):
+        """Test times in non-standard calendars are kept as cftime objects"""
+        write_grouped(self.filename, self.tracks, calendar='noleap')
+        data, offsets, _ = trackio.read_tracks(self.filename)
+        self.assertEqual(data.dtype['Datetime'], object)
+        for view, expected in zip(trackio.track_views(data, offsets),
+                                  self.tracks):
+            self.assertTrackEqual(view, expected, calendar='noleap')
+
+    def testOutOfRange(self):
+        """Test standard calendar times outside the range of Python
+        datetimes are kept as cftime objects"""
+        units = "hours since 0001-01-01 00:00"
+        write_grouped(self.filename, self.tracks, units=units)
+        data, offsets, _ = trackio.read_tracks(self.filename)
+        self.assertEqual(data.dtype['Datetime'], object)
+        expected = np.concatenate([t['Datetime'] for t in self.tracks])
+        self.assertEqual(list(data['Datetime']),
+                         list(num2date(expected, units, 'standard')))
+        self.assertEqual(data['Datetime'][0].year, 81)
+
+        times = trackio.convert_times([0., 24.], "days since 9999-12-31")
+        self.assertEqual(times.dtype, object)
+        self.assertEqual(times[1].year, 10000)
+
+    def testSingleTrack(self):
+        """Test a file with a single track in separate variables"""
+        write_single(self.filename, self.tracks[0])
+        data, offsets, trackids = trackio.read_tracks(self.filename)
+        self.assertEqual(list(offsets), [0, len(self.tracks[0])])
+        self.assertEqual(trackids, [(4, 77)])
+        self.assertTrackEqual(data, self.tracks[0])
+
+    def testParseTrackId(self):
+        """Test track IDs are parsed without evaluating the attribute"""
+        self.assertEqual(trackio.parse_track_id("(3, 1021)"), (3, 1021))
+        self.assertEqual(trackio.parse_track_id("(3, __import__('os'))"),
+                         (3,))
+
+
+if __name__ == "__main__":
+    testSuite = unittest.makeSuite(TestReadTracks, 'test')
+    unittest.TextTestRunner(verbosity=2).run(testSuite)
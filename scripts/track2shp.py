@@ -2,10 +2,13 @@ import os
 import Utilities.shapefile as shapefile
 from Utilities.metutils import convert, bearing2theta
 import numpy as np
-from netCDF4 import Dataset, num2date
 from datetime import datetime
 from shapely.geometry import Point, LineString
 
+from trackio import read_tracks, track_views
+from trackcollection import TrackCollection
+from trackexport import export_tracks
+
 TCRMFIELD_NAMES = ('CycloneNumber', 'TimeElapsed', 
                    'Longitude', 'Latitude', 'Speed', 'Bearing',
                    'pCentre', 'pEnv', 'rMax',
@@ -21,15 +24,9 @@ TCRMFIELDS = [[n, t, w, p] for n, t, w, p in zip(TCRMFIELD_NAMES,
 
 ISO_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-TCRM_COLS = ('CycloneNumber', 'Datetime', 'TimeElapsed', 'Longitude',
-             'Latitude', 'Speed', 'Bearing', 'CentralPressure',
-             'EnvPressure', 'rMax')
-
 TCRM_UNIT = ('', '', 'hr', 'degree', 'degree', 'kph', 'degrees',
                   'hPa', 'hPa', 'km')
 
-TCRM_FMTS = ('i', 'object', 'f', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8')
-
 TCRM_CNVT = {
     0: lambda s: int(float(s.strip() or 0)),
     1: lambda s: datetime.strptime(s.strip(), ISO_FORMAT),
@@ -39,11 +36,6 @@ TCRM_CNVT = {
     8: lambda s: convert(float(s.strip() or 0), TCRM_UNIT[8], 'Pa'),
 }
 
-TRACK_DT_ERR = "Track data does not have required \
-attributes to convert to datetime object"
-
-TRACK_EMPTY_GROUP = """No track groups in this netcdf file: {0}"""
-
 class Track(object):
     """
     A single tropical cyclone track.
@@ -143,74 +135,23 @@ def ncReadTrackData(trackfile):
     :class:`Track` objects. The returned :class:`Track` objects *must*
     have all attributes accessed by the `__getattr__` method.
 
+    All the tracks are read into a single array by
+    :func:`trackio.read_tracks`, and the data of each :class:`Track` is a
+    view into that array.
+
     :param str trackfile: track data filename (netCDF4 format).
 
     :return: track data
     :rtype: list of :class:`Track` objects
 
     """
-
-    track_dtype = np.dtype({'names':TCRM_COLS,
-                            'formats':TCRM_FMTS})
-    try:
-        ncobj = Dataset(trackfile, mode='r')
-    except (IOError, RuntimeError):
-        log.exception("Cannot open {0}".format(trackfile))
-        raise IOError("Cannot open {0}".format(trackfile))
-
-    g = ncobj.groups
-    if not bool(g):
-        # We have a track file that stores data in separate variables
-        print(f"Reading data from a single track file")
-        dt = ncobj.variables['Datetime']
-        units = ncobj.getncattr('time_units')
-        calendar = ncobj.getncattr('calendar')
-        dtt = num2date(dt[:], units, calendar)
-        newtd = np.zeros(len(dtt), dtype=track_dtype)
-        for f in ncobj.variables.keys():
-            if f != 'Datetime' and f in track_dtype.names:
-                newtd[f] = ncobj.variables[f][:]
-        newtd['Datetime'] = dtt
-        track = Track(newtd)
-        track.trackfile = trackfile
-        track.trackId = eval(ncobj.trackId)
-
-        return [track]
-
+    data, offsets, trackids = read_tracks(trackfile)
     tracks = []
-    if "tracks" in g.keys():
-        tgroup = g['tracks'].groups
-        ntracks = len(tgroup)
-        for i, (t, data) in enumerate(tgroup.items()):
-            # log.debug("Loading data for {0}".format(t))
-            track_data = data.variables['track'][:]
-
-            try: 
-                dt = num2date(track_data['Datetime'],
-                              data.variables['time'].units,
-                              data.variables['time'].calendar)
-            except AttributeError:
-                # log.exception(TRACK_DT_ERR)
-                raise AttributeError
-
-            newtd = np.zeros(len(track_data), dtype=track_dtype)
-            for f in track_data.dtype.names:
-                if f != 'Datetime' and f in track_dtype.names:
-                    newtd[f] = track_data[f]
-            newtd['Datetime'] = dt
-
-            track = Track(newtd)
-            track.trackfile = trackfile
-            if hasattr(data.variables['track'], "trackId"):
-                track.trackId = eval(data.variables['track'].trackId)
-            else:
-                track.trackId = (i+1, ntracks)
-            tracks.append(track)
-
-    else:
-        print(TRACK_EMPTY_GROUP.format(trackfile))
-
-    ncobj.close()
+    for trackdata, trackId in zip(track_views(data, offsets), trackids):
+        track = Track(trackdata)
+        track.trackfile = trackfile
+        track.trackId = trackId
+        tracks.append(track)
     return tracks
 
 def recdropfields(rec, names):
@@ -363,82 +304,44 @@ def add_field(a, descr):
         b[name] = a[name]
     return b
 
-import argparse
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-id', '--track_id')
-args = parser.parse_args()
-trackId = args.track_id
-
-# trackId= "005-06282"
-
-trackNum, trackYear = int(trackId.split('-')[0]), int(trackId.split('-')[1])  
-
-trackfileloc = "/g/data/w85/QFES_SWHA/tracks"
-
-shpfileout = os.path.join('/g/data/w85/QFES_SWHA/wind/regional', trackId, 'tracks')
-#shpfileout = os.path.join("/home/547/cxa547/tmp/", trackId, "tracks")
-if not os.path.isdir(shpfileout):
-    os.makedirs(shpfileout)
-
-#For tracks pulled of THREDDS (e.g. http://dapds00.nci.org.au/thredds/fileServer/fj6/TCRM/TCHA18/tracks/tracks.04697.nc)
-# track_file = os.path.join(trackfileloc, 'tracks.{0}.nc'.format(trackId.rpartition("-")[2]))
-
-#For individual track .nc files
-track_file = os.path.join(trackfileloc, 'track.{0}.nc'.format(trackId))
-
-tracks = ncReadTrackData(track_file)
-     
-for track in tracks:
-    if track.CycloneNumber[0] == trackNum:
-
-        track.data = add_field(track.data, [('Year', int), ('Month', int),
-                                                    ('Day', int), ('Hour', int),
-                                                    ('Minute', int), ('Category', int)])
-
-        i = 0
-        for rec in track.data:
-            rec['Year'] = int(track.Datetime[i].strftime('%Y'))
-            rec['Month'] = int(track.Datetime[i].strftime('%m'))
-            rec['Day'] = int(track.Datetime[i].strftime('%d'))
-            rec['Hour'] = int(track.Datetime[i].strftime('%H'))
-            rec['Minute'] = int(track.Datetime[i].strftime('%M'))
-            if rec["CentralPressure"] < 930:
-                Cat = 5  
-            elif rec["CentralPressure"] < 955:
-                Cat = 4
-            elif rec["CentralPressure"] < 970:
-                Cat = 3
-            elif rec["CentralPressure"] < 985:
-                Cat = 2
-            elif rec["CentralPressure"] < 999:
-                Cat = 1
-            else:
-                Cat = 0
+def main():
+    import argparse
 
-            rec['Category'] = Cat
-            # Comment out this line if the track doesn't cross the dateline.
-            #rec['Longitude'] = rec['Longitude']- 360.
-            i+=1
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-id', '--track_id')
+    parser.add_argument('-f', '--format', default='fgb',
+                        help="Output format (fgb, parquet or shp)")
+    args = parser.parse_args()
+    trackId = args.track_id
 
-        track.data = recdropfields(track.data, ['Datetime'])
+    # trackId= "005-06282"
+
+    trackNum = int(trackId.split('-')[0])
+
+    trackfileloc = "/g/data/w85/QFES_SWHA/tracks"
+
+    shpfileout = os.path.join('/g/data/w85/QFES_SWHA/wind/regional', trackId, 'tracks')
+    #shpfileout = os.path.join("/home/547/cxa547/tmp/", trackId, "tracks")
+    if not os.path.isdir(shpfileout):
+        os.makedirs(shpfileout)
+
+    #For tracks pulled of THREDDS (e.g. http://dapds00.nci.org.au/thredds/fileServer/fj6/TCRM/TCHA18/tracks/tracks.04697.nc)
+    # track_file = os.path.join(trackfileloc, 'tracks.{0}.nc'.format(trackId.rpartition("-")[2]))
 
+    #For individual track .nc files
+    track_file = os.path.join(trackfileloc, 'track.{0}.nc'.format(trackId))
 
-        line_shpfile = os.path.join(shpfileout, 'track.{0}.line.shp'.format(str(trackId)))
-        line_prjfile = os.path.join(shpfileout, 'track.{0}.line.prj'.format(str(trackId)))
-        mytracks2line([track], line_shpfile)
-        # mytracks2line([track], line_shpfile, dissolve=True)
+    tracks = TrackCollection.from_file(track_file)
+    tracks = tracks.select(
+        tracks.reduce(np.minimum, 'CycloneNumber', fill=-1) == trackNum)
 
-        pt_shpfile = os.path.join(shpfileout, 'track.{0}.point.shp'.format(str(trackId)))
-        pt_prjfile = os.path.join(shpfileout, 'track.{0}.point.prj'.format(str(trackId)))
-        tracks2point([track], pt_shpfile)
+    # Segments (or whole tracks, with mode='dissolve') and points are written
+    # in bulk. Use the "shp" format for tools that require shapefiles.
+    for name, mode in [('line', 'segments'), ('point', 'points')]:
+        outputfile = os.path.join(
+            shpfileout, 'track.{0}.{1}.{2}'.format(trackId, name, args.format))
+        export_tracks(tracks, outputfile, mode=mode)
 
-        prjwkt = "GEOGCS['GCS_GDA_1994',DATUM['D_GDA_1994',SPHEROID['GRS_1980',6378137.0,298.257222101]],PRIMEM['Greenwich',0.0],UNIT['Degree',0.0174532925199433]]"
-        
-        prjfh_l = open(line_prjfile, 'w')
-        prjfh_l.write(prjwkt)
-        prjfh_l.close()
 
-        prjfh_p = open(pt_prjfile, 'w')
-        prjfh_p.write(prjwkt)
-        prjfh_p.close()
+if __name__ == '__main__':
+    main()
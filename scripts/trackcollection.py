@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `trackcollection` -- Columnar storage of a collection of TC tracks
+========================================================================
+
+.. module:: trackcollection
+    :synopsis: Hold a collection of tracks as one array per field, with an
+    array of the offsets of the start of each track.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+A :class:`TrackCollection` stores the points of all tracks in contiguous
+arrays, one per field (e.g. `Longitude`, `CentralPressure`), in the order of
+the tracks. The points of track `i` are the elements `offsets[i]` to
+`offsets[i + 1]` of each array (a compressed sparse row layout).
+
+Per-track statistics (minimum pressure, lifetime, start time, ...) are
+calculated as reductions over the offsets, rather than by looping over
+:class:`Track` objects, and the segments of all the tracks are described
+by arrays of the start and end of each segment. Indexing a collection
+returns a :class:`TrackView`, which has the same attributes as a
+:class:`Track`, but whose fields are views of the collection's arrays.
+
+Example::
+
+    >>> tracks = TrackCollection.from_file("tracks.00001.nc")
+    >>> pmin = tracks.min_pressure()
+    >>> for track in tracks:
+    ...     print(track.trackId, track.CentralPressure.min())
+
+"""
+
+import logging
+
+import numpy as np
+
+from trackio import read_tracks
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TrackView(object):
+    """
+    A single track in a :class:`TrackCollection`. The fields are available
+    as attributes (as for a :class:`Track`), and are views of the arrays of
+    the collection, so no data are copied.
+
+    :param collection: :class:`TrackCollection` the track belongs to
+    :param int index: Index of the track in the collection
+    """
+
+    def __init__(self, collection, index):
+        self._collection = collection
+        self.index = index
+        self.trackId = collection.trackids[index]
+        self.trackfile = collection.trackfile
+        self._slice = slice(collection.offsets[index],
+                            collection.offsets[index + 1])
+
+    def __len__(self):
+        return self._slice.stop - self._slice.start
+
+    def __getattr__(self, key):
+        """
+        Get the values of the field `key` for this track.
+
+        :param str key: Name of the field
+        """
+        if key.startswith('_'):
+            raise AttributeError(key)
+        try:
+            return self._collection.fields[key][self._slice]
+        except KeyError:
+            raise AttributeError(f"Track has no field {key}")
+
+    @property
+    def data(self):
+        """
+        The track data as a structured array (a copy of the fields, for
+        code that requires a :class:`Track`-like record array)
+        """
+        return self._collection.to_array(self._slice)
+
+    @property
+    def trackMinPressure(self):
+        if len(self) and 'CentralPressure' in self._collection.fields:
+            return np.min(self.CentralPressure)
+        return None
+
+    @property
+    def trackMaxWind(self):
+        if len(self) and 'WindSpeed' in self._collection.fields:
+            return np.max(self.WindSpeed)
+        return None
+
+    def inRegion(self, gridLimit):
+        """
+        Check if the tropical cyclone track starts within a region.
+
+        :param dict gridLimit: the region to check, with keys `xMin`,
+            `xMax`, `yMin` and `yMax`
+        """
+        return ((gridLimit['xMin'] <= self.Longitude[0] <= gridLimit['xMax'])
+                and (gridLimit['yMin'] <= self.Latitude[0]
+                     <= gridLimit['yMax']))
+
+
+class TrackCollection(object):
+    """
+    A collection of tracks, stored as one contiguous array per field.
+
+    :param dict fields: `numpy.array` of the values of each field, for all
+        the points of all tracks (in order of the tracks)
+    :param offsets: Integer `numpy.array` of the index of the first point
+        of each track, with the total number of points as the last element
+    :param list trackids: `trackId` of each track. Default is to number the
+        tracks as for TCRM track files, i.e. (n, number of tracks).
+    :param str trackfile: Name of the file the tracks were read from
+    """
+
+    def __init__(self, fields, offsets, trackids=None, trackfile=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if self.offsets.ndim != 1 or len(self.offsets) < 1 or \
+                self.offsets[0] != 0 or np.any(np.diff(self.offsets) < 0):
+            raise ValueError("Offsets must be non-decreasing and start at 0")
+        npoints = self.offsets[-1]
+        self.fields = {}
+        for name, values in fields.items():
+            values = np.ascontiguousarray(values)
+            if len(values) != npoints:
+                raise ValueError(f"Field {name} has {len(values)} values, "
+                                 f"but the offsets describe {npoints} points")
+            self.fields[name] = values
+        ntracks = len(self.offsets) - 1
+        if trackids is None:
+            trackids = [(i + 1, ntracks) for i in range(ntracks)]
+        if len(trackids) != ntracks:
+            raise ValueError("There must be one trackId for each track")
+        self.trackids = list(trackids)
+        self.trackfile = trackfile
+
+    @classmethod
+    def from_array(cls, data, offsets, trackids=None, trackfile=None):
+        """
+        Create a collection from a structured array of track points (e.g.
+        from :func:`trackio.read_tracks`).
+
+        :param data: Structured `numpy.array` of all the track points
+        :param offsets: Offsets of the start of each track
+        """
+        return cls({name: data[name] for name in data.dtype.names}, offsets,
+                   trackids, trackfile)
+
+    @classmethod
+    def from_file(cls, trackfile):
+        """
+        Read a TCRM netCDF track file.
+
+        :param str trackfile: Path to the track file
+        """
+        data, offsets, trackids = read_tracks(trackfile)
+        return cls.from_array(data, offsets, trackids, trackfile)
+
+    @classmethod
+    def from_tracks(cls, tracks):
+        """
+        Create a collection from a list of :class:`Track` objects (or any
+        objects with a structured `data` attribute and a `trackId`).
+
+        :param list tracks: :class:`Track` objects, all with the same fields
+        """
+        if not tracks:
+            return cls({}, [0])
+        data = np.concatenate([t.data for t in tracks])
+        offsets = np.r_[0, np.cumsum([len(t.data) for t in tracks])]
+        return cls.from_array(data, offsets, [t.trackId for t in tracks],
+                              getattr(tracks[0], 'trackfile', None))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Track index out of range")
+        return TrackView(self, index)
+
+    def __iter__(self):
+        return (TrackView(self, i) for i in range(len(self)))
+
+    def __getattr__(self, key):
+        """All the values of the field `key`"""
+        if key.startswith('_') or key == 'fields':
+            raise AttributeError(key)
+        try:
+            return self.fields[key]
+        except KeyError:
+            raise AttributeError(f"Collection has no field {key}")
+
+    @property
+    def npoints(self):
+        """Total number of points in the collection"""
+        return int(self.offsets[-1])
+
+    @property
+    def lengths(self):
+        """Number of points in each track"""
+        return np.diff(self.offsets)
+
+    @property
+    def track_index(self):
+        """Index of the track of each point"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def to_array(self, index=slice(None)):
+        """
+        Copy the fields of the collection (or some of its points) into a
+        structured array.
+
+        :param index: Index of the points to copy. Default is all points.
+        """
+        dtype = np.dtype([(name, values.dtype)
+                          for name, values in self.fields.items()])
+        if not self.fields:
+            return np.zeros(0, dtype=dtype)
+        first = next(iter(self.fields.values()))[index]
+        data = np.empty(len(first), dtype=dtype)
+        for name, values in self.fields.items():
+            data[name] = values[index]
+        return data
+
+    def select(self, mask):
+        """
+        Create a new collection of the selected tracks. The data are copied.
+
+        :param mask: Boolean `numpy.array` (one value per track), or an array
+            of track indices
+
+        :returns: :class:`TrackCollection`
+        """
+        index = np.arange(len(self))[mask]
+        lengths = self.lengths[index]
+        starts = self.offsets[:-1][index]
+        points = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]],
+                           lengths) + np.arange(lengths.sum())
+        return TrackCollection(
+            {name: values[points] for name, values in self.fields.items()},
+            np.r_[0, np.cumsum(lengths)],
+            [self.trackids[i] for i in index], self.trackfile)
+
+    def reduce(self, ufunc, field, fill=np.nan):
+        """
+        Apply a reduction (e.g. `numpy.minimum`) to the values of a field in
+        each track.
+
+        :param ufunc: `numpy.ufunc` with a `reduceat` method
+        :param str field: Name of the field
+        :param fill: Value for tracks without any points
+
+        :returns: `numpy.array` with one value per track
+        """
+        values = self.fields[field]
+        lengths = self.lengths
+        nonempty = lengths > 0
+        try:
+            dtype = np.result_type(values.dtype, np.asarray(fill).dtype)
+        except TypeError:
+            dtype = object
+        result = np.full(len(self), fill, dtype=dtype)
+        if nonempty.any():
+            result[nonempty] = ufunc.reduceat(values,
+                                              self.offsets[:-1][nonempty])
+        return result
+
+    def first(self, field):
+        """Value of a field at the first point of each track"""
+        return self.fields[field][self.offsets[:-1][self.lengths > 0]]
+
+    def last(self, field):
+        """Value of a field at the last point of each track"""
+        return self.fields[field][self.offsets[1:][self.lengths > 0] - 1]
+
+    def min_pressure(self):
+        """Minimum central pressure of each track"""
+        return self.reduce(np.minimum, 'CentralPressure')
+
+    def max_wind(self):
+        """
+        Maximum wind speed of each track, or `None` if the tracks do not
+        have a `WindSpeed` field
+        """
+        if 'WindSpeed' not in self.fields:
+            return None
+        return self.reduce(np.maximum, 'WindSpeed')
+
+    def lifetime(self):
+        """Lifetime (maximum `TimeElapsed`) of each track"""
+        return self.reduce(np.maximum, 'TimeElapsed')
+
+    def start_time(self):
+        """Time of the first point of each track (excluding empty tracks)"""
+        return self.first('Datetime')
+
+    def segment_index(self):
+        """
+        Index of the first point of each segment, i.e. each pair of
+        consecutive points in the same track.
+
+        :returns: Integer `numpy.array`; segment `k` joins points `idx[k]`
+            and `idx[k] + 1`
+        """
+        ends = np.zeros(self.npoints, dtype=bool)
+        ends[self.offsets[1:][self.lengths > 0] - 1] = True
+        return np.flatnonzero(~ends)
+
+    def segments(self, x='Longitude', y='Latitude'):
+        """
+        Coordinates of the start and end of every segment of every track.
+
+        :param str x: Name of the field of x coordinates
+        :param str y: Name of the field of y coordinates
+
+        :returns: :class:`dict` of `numpy.array`: "index" (of the first point
+            of the segment), "track" (index of the track), and "x0", "y0",
+            "x1", "y1"
+        """
+        idx = self.segment_index()
+        xs, ys = self.fields[x], self.fields[y]
+        return {'index': idx, 'track': self.track_index[idx],
+                'x0': xs[idx], 'y0': ys[idx],
+                'x1': xs[idx + 1], 'y1': ys[idx + 1]}
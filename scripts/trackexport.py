@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `trackexport` -- Export track collections to vector formats
+=================================================================
+
+.. module:: trackexport
+    :synopsis: Build point or line geometries for all the tracks in a
+    :class:`TrackCollection` at once, and write them to GeoParquet,
+    FlatGeobuf (or any other format supported by `geopandas`).
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+Three representations of the tracks are available:
+
+* "points" - one feature for each track point
+* "segments" - one line feature for each track point, joining it to the
+  next point of the track, with the attributes of the point. The last
+  point of each track is a line of zero length (as in the shapefiles
+  written by `track2shp.mytracks2line`).
+* "dissolve" - one line feature for each track, with the start time,
+  lifetime and minimum pressure of the track
+
+The geometries are created with the vectorised constructors in `shapely`
+from the coordinate arrays of the collection, so there are no loops over
+tracks or points. Segments that cross the edge of the longitude domain
+(0E for TCRM tracks, which have longitudes between 0 and 360) are split
+into two parts at the crossing, so all line geometries are
+`MultiLineString` features.
+
+Unlike shapefiles, the output formats do not restrict the names, widths or
+precision of the attribute fields.
+
+"""
+
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+LOGGER = logging.getLogger(__name__)
+
+# Datum of TCRM track coordinates (GDA94):
+CRS = "EPSG:4283"
+
+MODES = ('points', 'segments', 'dissolve')
+
+DRIVERS = {'.fgb': 'FlatGeobuf', '.gpkg': 'GPKG', '.shp': 'ESRI Shapefile',
+           '.geojson': 'GeoJSON'}
+
+
+def pressure_category(pressure):
+    """
+    Categorise central pressure values (hPa) by the Bureau of Meteorology's
+    TC intensity scale (0 for pressures of 999 hPa and above).
+
+    :param pressure: `numpy.array` of central pressure values
+
+    :returns: `numpy.array` of categories
+    """
+    return 5 - np.digitize(pressure, [930, 955, 970, 985, 999])
+
+
+def antimeridian_crossings(x0, y0, x1, y1, wrap=360.):
+    """
+    Find the segments that cross the edge of the longitude domain
+    [`wrap` - 360, `wrap`), i.e. where the longitude changes by more than
+    180 degrees, and the latitude where they cross.
+
+    :param x0, y0: `numpy.array` of the coordinates of the segment starts
+    :param x1, y1: `numpy.array` of the coordinates of the segment ends
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: tuple of (mask of crossing segments, longitude of the end of
+        the first part, longitude of the start of the second part, latitude
+        of the crossing) - the last three for the crossing segments only
+    """
+    dx = x1 - x0
+    mask = np.abs(dx) > 180.
+    x0, y0, x1, y1, dx = x0[mask], y0[mask], x1[mask], y1[mask], dx[mask]
+    east = dx < 0
+    shift = np.where(east, 360., -360.)
+    xa = np.where(east, wrap, wrap - 360.)
+    xb = np.where(east, wrap - 360., wrap)
+    frac = (xa - x0) / (x1 + shift - x0)
+    yc = y0 + frac * (y1 - y0)
+    return mask, xa, xb, yc
+
+
+def point_attributes(tc, index=slice(None)):
+    """
+    Attributes of track points: all the fields of the collection, plus the
+    date and time components and the intensity category.
+
+    :param tc: :class:`TrackCollection`
+    :param index: Index of the points. Default is all points.
+
+    :returns: :class:`pandas.DataFrame`
+    """
+    df = pd.DataFrame({name: values[index]
+                       for name, values in tc.fields.items()})
+    if 'Datetime' in df and df['Datetime'].dtype.kind == 'M':
+        dt = df['Datetime'].dt
+        df['Year'] = dt.year
+        df['Month'] = dt.month
+        df['Day'] = dt.day
+        df['Hour'] = dt.hour
+        df['Minute'] = dt.minute
+    if 'CentralPressure' in df:
+        df['Category'] = pressure_category(df['CentralPressure'].to_numpy())
+    return df
+
+
+def segment_geometry(tc, wrap=360.):
+    """
+    Line geometries of every segment of every track, with one segment for
+    each point. The segment of the last point of a track (including single
+    point tracks) is a line of zero length.
+
+    :param tc: :class:`TrackCollection`
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: tuple of the index of the first point of each segment, and a
+        `numpy.array` of `MultiLineString` geometries
+    """
+    idx = np.arange(tc.npoints)
+    last = tc.offsets[1:][tc.lengths > 0] - 1
+    nxt = idx + 1
+    nxt[last] = last
+    x, y = tc.Longitude, tc.Latitude
+    x0, y0, x1, y1 = x[idx], y[idx], x[nxt], y[nxt]
+    mask, xa, xb, yc = antimeridian_crossings(x0, y0, x1, y1, wrap)
+
+    # Each segment is one part, and each crossing segment is split in two:
+    segs = np.arange(len(idx))
+    crossing = segs[mask]
+    starts = np.column_stack([x0, y0])
+    ends = np.column_stack([x1, y1])
+    ends[mask] = np.column_stack([xa, yc])
+    parts = np.concatenate([np.stack([starts, ends], axis=1),
+                            np.stack([np.column_stack([xb, yc]),
+                                      np.column_stack([x1[mask], y1[mask]])],
+                                     axis=1)])
+    order = np.argsort(np.r_[segs, crossing], kind='stable')
+    coords = parts[order].reshape(-1, 2)
+    partoffsets = 2 * np.arange(len(order) + 1)
+    geomoffsets = np.r_[0, np.cumsum(1 + mask)]
+    return idx, shapely.from_ragged_array(
+        shapely.GeometryType.MULTILINESTRING, coords,
+        (partoffsets, geomoffsets))
+
+
+def track_geometry(tc, wrap=360.):
+    """
+    Line geometries of each track, split where the track crosses the edge
+    of the longitude domain. Single point tracks are represented by a line
+    of zero length.
+
+    :param tc: :class:`TrackCollection`
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: tuple of the index of the tracks with at least one point, and
+        a `numpy.array` of `MultiLineString` geometries
+    """
+    n = tc.npoints
+    x, y = tc.Longitude, tc.Latitude
+    track = tc.track_index
+    lengths = tc.lengths
+    first = tc.offsets[:-1][lengths > 0]
+    single = tc.offsets[:-1][lengths == 1]
+
+    idx = tc.segment_index()
+    mask, xa, xb, yc = antimeridian_crossings(x[idx], y[idx], x[idx + 1],
+                                              y[idx + 1], wrap)
+    cross = idx[mask]
+
+    # Insert the end and start of the parts at each crossing after the first
+    # point of the segment, and repeat the point of single point tracks:
+    px = np.concatenate([x, xa, xb, x[single]])
+    py = np.concatenate([y, yc, yc, y[single]])
+    key = np.concatenate([3 * np.arange(n), 3 * cross + 1, 3 * cross + 2,
+                          3 * single + 1])
+    newpart = np.zeros(len(key), dtype=bool)
+    newpart[first] = True
+    newpart[n + len(cross):n + 2 * len(cross)] = True
+    owner = np.concatenate([track, track[cross], track[cross], track[single]])
+
+    order = np.argsort(key)
+    coords = np.column_stack([px[order], py[order]])
+    partoffsets = np.r_[np.flatnonzero(newpart[order]), len(key)]
+    parttrack = owner[order][partoffsets[:-1]]
+    geomoffsets = np.r_[np.flatnonzero(np.diff(parttrack, prepend=-1)),
+                        len(parttrack)]
+    return parttrack[geomoffsets[:-1]], shapely.from_ragged_array(
+        shapely.GeometryType.MULTILINESTRING, coords,
+        (partoffsets, geomoffsets))
+
+
+def points(tc, crs=CRS):
+    """
+    Point features of all the track points.
+
+    :param tc: :class:`TrackCollection`
+    :param crs: Coordinate reference system of the track coordinates
+
+    :returns: :class:`geopandas.GeoDataFrame`
+    """
+    geometry = shapely.points(tc.Longitude, tc.Latitude)
+    return gpd.GeoDataFrame(point_attributes(tc), geometry=geometry, crs=crs)
+
+
+def segments(tc, crs=CRS, wrap=360.):
+    """
+    Line features of every segment of every track, with the attributes of
+    the first point of the segment. There is one feature for each track
+    point: the last point of each track (and any single point track) is a
+    line of zero length.
+
+    :param tc: :class:`TrackCollection`
+    :param crs: Coordinate reference system of the track coordinates
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: :class:`geopandas.GeoDataFrame`
+    """
+    idx, geometry = segment_geometry(tc, wrap)
+    return gpd.GeoDataFrame(point_attributes(tc, idx), geometry=geometry,
+                            crs=crs)
+
+
+def dissolved(tc, crs=CRS, wrap=360.):
+    """
+    One line feature for each track, with the cyclone number, start time,
+    lifetime, minimum central pressure (and maximum wind speed, if available)
+    and the category of the minimum pressure.
+
+    :param tc: :class:`TrackCollection`
+    :param crs: Coordinate reference system of the track coordinates
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: :class:`geopandas.GeoDataFrame`
+    """
+    tracks, geometry = track_geometry(tc, wrap)
+    df = point_attributes(tc, tc.offsets[:-1][tracks])
+    df = df[[c for c in ['CycloneNumber', 'Datetime', 'Year', 'Month', 'Day',
+                         'Hour', 'Minute'] if c in df]]
+    df['Age'] = tc.lifetime()[tracks]
+    df['MinPressure'] = tc.min_pressure()[tracks]
+    maxwind = tc.max_wind()
+    if maxwind is not None:
+        df['MaxWind'] = maxwind[tracks]
+    df['Category'] = pressure_category(df['MinPressure'].to_numpy())
+    return gpd.GeoDataFrame(df, geometry=geometry, crs=crs)
+
+
+def to_frame(tc, mode='segments', crs=CRS, wrap=360.):
+    """
+    Build the features of a track collection.
+
+    :param tc: :class:`TrackCollection`
+    :param str mode: One of "points", "segments" or "dissolve"
+    :param crs: Coordinate reference system of the track coordinates
+    :param float wrap: Eastern edge of the longitude domain
+
+    :returns: :class:`geopandas.GeoDataFrame`
+    """
+    if mode == 'points':
+        return points(tc, crs)
+    if mode == 'segments':
+        return segments(tc, crs, wrap)
+    if mode == 'dissolve':
+        return dissolved(tc, crs, wrap)
+    raise ValueError(f"Unknown mode {mode}: must be one of {MODES}")
+
+
+def write_frame(gdf, filename, driver=None):
+    """
+    Write features to a file. GeoParquet is used for files with a
+    ".parquet" extension, otherwise the driver is determined from the
+    extension (e.g. ".fgb" for FlatGeobuf).
+
+    :param gdf: :class:`geopandas.GeoDataFrame`
+    :param str filename: Output file
+    :param str driver: Name of the OGR driver, to override the extension
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if driver is None and ext == '.parquet':
+        gdf.to_parquet(filename)
+        return
+    driver = driver or DRIVERS.get(ext)
+    if driver is None:
+        raise ValueError(f"Cannot determine the format of {filename}")
+    LOGGER.debug(f"Writing {len(gdf)} features to {filename}")
+    try:
+        # Write all the features in one batch through Arrow, if possible:
+        import pyogrio  # noqa: F401
+        kwds = {'engine': 'pyogrio', 'use_arrow': True}
+    except ImportError:
+        kwds = {}
+    gdf.to_file(filename, driver=driver, **kwds)
+
+
+def export_tracks(tc, filename, mode='segments', crs=CRS, wrap=360.,
+                  driver=None):
+    """
+    Write the tracks in a collection to a vector file.
+
+    :param tc: :class:`TrackCollection`
+    :param str filename: Output file (e.g. "tracks.parquet", "tracks.fgb")
+    :param str mode: One of "points", "segments" or "dissolve"
+    :param crs: Coordinate reference system of the track coordinates
+    :param float wrap: Eastern edge of the longitude domain
+    :param str driver: Name of the OGR driver, to override the extension
+
+    :returns: Number of features written
+    """
+    gdf = to_frame(tc, mode, crs, wrap)
+    write_frame(gdf, filename, driver)
+    return len(gdf)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+:mod: `trackio` -- Bulk reading of TCRM netCDF track files
+==========================================================
+
+.. module:: trackio
+    :synopsis: Read all the tracks in a TCRM netCDF track file into a single
+    structured array, with an index of the start of each track.
+
+.. moduleauthor:: Craig Arthur, <craig.arthur@ga.gov.au
+
+TCRM stores each track in a separate group of the netCDF file
+(`tracks/<name>/track`, a compound variable), or a single track as separate
+variables in the root group. Reading these one track at a time (converting
+the times, allocating a new array and copying each field) is very slow for
+files with thousands of tracks.
+
+:func:`read_tracks` reads the compound data of every group, then builds
+a single structured array of all the track points, converting all the times
+with one call to :func:`netCDF4.num2date` (for each distinct set of time
+units). The tracks are described by an array of offsets: the points of track
+`i` are `data[offsets[i]:offsets[i + 1]]`, and :func:`track_views` returns
+these slices, which are views into the array (not copies).
+
+"""
+
+import re
+import logging
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+LOGGER = logging.getLogger(__name__)
+
+TCRM_COLS = ('CycloneNumber', 'Datetime', 'TimeElapsed', 'Longitude',
+             'Latitude', 'Speed', 'Bearing', 'CentralPressure',
+             'EnvPressure', 'rMax')
+
+TCRM_FMTS = ('i', 'datetime64[us]', 'f', 'f8', 'f8', 'f8', 'f8', 'f8',
+             'f8', 'f8')
+
+TRACK_DTYPE = np.dtype({'names': TCRM_COLS, 'formats': TCRM_FMTS})
+
+# Calendars that can be represented by `numpy.datetime64`:
+STANDARD_CALENDARS = ('standard', 'gregorian', 'proleptic_gregorian')
+
+
+def parse_track_id(value):
+    """
+    Parse a `trackId` attribute (e.g. "(3, 1021)") into a tuple of integers,
+    without evaluating the string.
+
+    :param str value: `trackId` attribute
+
+    :returns: tuple of int
+    """
+    return tuple(int(v) for v in re.findall(r'-?\d+', str(value)))
+
+
+def convert_times(times, units, calendar='standard'):
+    """
+    Convert numeric times to datetimes in a single vectorised call.
+
+    :param times: `numpy.array` of times
+    :param str units: Time units (e.g. "hours since 1900-01-01 00:00")
+    :param str calendar: Calendar of the times
+
+    :returns: `numpy.array` of `datetime64[us]` values for the standard
+        calendars, otherwise an object array of `cftime` datetimes. Times
+        in the standard calendars that cannot be represented by Python
+        datetimes (e.g. before 1582-10-15 or after 9999) are also returned
+        as `cftime` datetimes.
+    """
+    times = np.asarray(times, dtype=float)
+    if calendar.lower() in STANDARD_CALENDARS:
+        try:
+            dates = num2date(times, units, calendar,
+                             only_use_cftime_datetimes=False,
+                             only_use_python_datetimes=True)
+            return np.asarray(dates, dtype='datetime64[us]')
+        except (ValueError, OverflowError):
+            LOGGER.debug(f"Times in {units} ({calendar}) are outside the "
+                         "range of Python datetimes")
+    return np.asarray(num2date(times, units, calendar), dtype=object)
+
+
+def _object_dtype():
+    """Track dtype with an object `Datetime` field, for cftime datetimes"""
+    return np.dtype({'names': TCRM_COLS,
+                     'formats': tuple('object' if n == 'Datetime' else f
+                                      for n, f in zip(TCRM_COLS, TCRM_FMTS))})
+
+
+def _merge_fields(parts, times, dtype):
+    """
+    Copy the fields of a list of compound arrays into a single array of
+    `dtype`, with the converted times.
+    """
+    fields = [f for f in dtype.names if f != 'Datetime']
+    data = np.zeros(sum(len(p) for p in parts), dtype=dtype)
+    if len(parts):
+        raw = np.concatenate(parts)
+        for f in fields:
+            if f in raw.dtype.names:
+                data[f] = raw[f]
+    data['Datetime'] = times
+    return data
+
+
+def _read_groups(tgroup):
+    """
+    Read the compound track data, time units and track IDs of each group.
+    """
+    parts, units, ids = [], [], []
+    ntracks = len(tgroup)
+    for i, data in enumerate(tgroup.values()):
+        var = data.variables['track']
+        var.set_auto_mask(False)
+        parts.append(var[:])
+        try:
+            time = data.variables['time']
+            units.append((time.units, getattr(time, 'calendar', 'standard')))
+        except (KeyError, AttributeError):
+            raise AttributeError("Track data does not have required "
+                                 "attributes to convert to datetime object")
+        if hasattr(var, 'trackId'):
+            ids.append(parse_track_id(var.trackId))
+        else:
+            ids.append((i + 1, ntracks))
+    return parts, units, ids
+
+
+def read_tracks(trackfile):
+    """
+    Read all the tracks in a TCRM netCDF track file.
+
+    :param str trackfile: Path to the track file (netCDF4 format)
+
+    :returns: tuple of (`data`, `offsets`, `trackids`):
+
+        * `data` is a structured `numpy.array` of all the track points,
+          with the fields in :data:`TCRM_COLS`
+        * `offsets` is an integer `numpy.array` of length (number of tracks
+          + 1); the points of track `i` are `data[offsets[i]:offsets[i+1]]`
+        * `trackids` is a list of the `trackId` tuple of each track
+
+    :raises: `IOError` if the file cannot be opened
+    """
+    try:
+        ncobj = Dataset(trackfile, mode='r')
+    except (IOError, RuntimeError):
+        LOGGER.exception(f"Cannot open {trackfile}")
+        raise IOError(f"Cannot open {trackfile}")
+
+    try:
+        if not ncobj.groups:
+            # A single track, stored in separate variables:
+            LOGGER.debug(f"Reading data from a single track file")
+            ncobj.set_auto_mask(False)
+            fields = {f: v[:] for f, v in ncobj.variables.items()}
+            times = convert_times(fields['Datetime'],
+                                  ncobj.getncattr('time_units'),
+                                  ncobj.getncattr('calendar'))
+            dtype = TRACK_DTYPE if times.dtype != object else \
+                _object_dtype()
+            data = np.zeros(len(times), dtype=dtype)
+            for f in dtype.names:
+                if f != 'Datetime' and f in fields:
+                    data[f] = fields[f]
+            data['Datetime'] = times
+            offsets = np.array([0, len(data)])
+            return data, offsets, [parse_track_id(ncobj.trackId)]
+
+        if 'tracks' not in ncobj.groups:
+            LOGGER.warning(f"No track groups in this netcdf file: {trackfile}")
+            return np.zeros(0, dtype=TRACK_DTYPE), np.zeros(1, dtype=int), []
+
+        parts, units, ids = _read_groups(ncobj.groups['tracks'].groups)
+    finally:
+        ncobj.close()
+
+    lengths = np.array([len(p) for p in parts], dtype=int)
+    offsets = np.r_[0, np.cumsum(lengths)]
+    rawtimes = np.concatenate([p['Datetime'] for p in parts]) if parts \
+        else np.zeros(0)
+
+    # Convert the times of all tracks with the same units together:
+    times = None
+    groupunits = np.repeat(np.arange(len(units)), lengths)
+    for u in set(units):
+        mask = np.isin(groupunits, [i for i, v in enumerate(units) if v == u])
+        converted = convert_times(rawtimes[mask], *u)
+        if times is None:
+            times = np.empty(len(rawtimes), dtype=converted.dtype)
+        elif converted.dtype != times.dtype:
+            times = times.astype(object)
+        times[mask] = converted
+    if times is None:
+        times = np.zeros(0, dtype='datetime64[us]')
+
+    dtype = TRACK_DTYPE if times.dtype != object else _object_dtype()
+    return _merge_fields(parts, times, dtype), offsets, ids
+
+
+def track_views(data, offsets):
+    """
+    Split the track data into the individual tracks. Each track is a view
+    into `data`, so no data are copied.
+
+    :param data: Structured `numpy.array` of track points
+    :param offsets: `numpy.array` of the start of each track, with the total
+        number of points as the last element
+
+    :returns: list of structured `numpy.array`
+    """
+    return [data[start:end] for start, end in zip(offsets[:-1], offsets[1:])]